@@ -0,0 +1,108 @@
+# bench_transports.py
+"""
+Benchmark các transport (transports.py) trên Linux, không cần thiết bị thật:
+- serial / posix : pty (os.openpty), đầu master đóng vai thiết bị, echo lại frame
+- tcp            : socket server local, echo lại frame
+- rfc2217        : chỉ chạy khi truyền --rfc2217 host:port (vd. ser2net với loopback)
+
+Mỗi vòng: write(frame) rồi read(len(frame)) -> đo round-trip (giống một transaction Modbus 8 byte).
+
+    python bench_transports.py --rounds 2000 --size 8
+"""
+
+import argparse
+import os
+import socket
+import statistics
+import threading
+import time
+
+from transports import open_transport
+
+
+def _pty_echo(master_fd, stop):
+    while not stop.is_set():
+        try:
+            data = os.read(master_fd, 4096)
+        except OSError:
+            return
+        if data:
+            os.write(master_fd, data)
+
+
+def _tcp_echo(srv, stop):
+    conn, _ = srv.accept()
+    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    with conn:
+        while not stop.is_set():
+            data = conn.recv(4096)
+            if not data:
+                return
+            conn.sendall(data)
+
+
+def _run(name, dev_cfg, rounds, size):
+    t = open_transport("BOARD_RELAY", dev_cfg)
+    frame = bytes(range(size))
+    samples = []
+    errors = 0
+    try:
+        t.reset_input_buffer()
+        for _ in range(rounds):
+            t0 = time.perf_counter()
+            t.write(frame)
+            resp = t.read(size)
+            samples.append((time.perf_counter() - t0) * 1e6)
+            if resp != frame:
+                errors += 1
+        stats = t.describe()
+    finally:
+        t.close()
+    samples.sort()
+    p = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))]
+    print(f"{name:8s} rounds={rounds:5d} mean={statistics.fmean(samples):8.1f}us "
+          f"p50={p(0.5):8.1f}us p99={p(0.99):8.1f}us max={samples[-1]:8.1f}us "
+          f"errors={errors} rx={stats['bytes_rx']}B tx={stats['bytes_tx']}B")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark transport backends")
+    ap.add_argument("--rounds", type=int, default=1000)
+    ap.add_argument("--size", type=int, default=8)
+    ap.add_argument("--baud", type=int, default=9600, help="baud áp lên pty (pty không giới hạn tốc độ thật)")
+    ap.add_argument("--rfc2217", default=None, help="host:port của RFC2217 server loopback")
+    args = ap.parse_args()
+    timeouts = {"read_timeout_s": 1.0, "write_timeout_s": 1.0}
+
+    for kind in ("serial", "posix"):
+        master, slave = os.openpty()
+        stop = threading.Event()
+        threading.Thread(target=_pty_echo, args=(master, stop), daemon=True).start()
+        try:
+            _run(kind, {"baud_rate": args.baud, "transport": {"type": kind, "path": os.ttyname(slave), **timeouts}},
+                 args.rounds, args.size)
+        finally:
+            stop.set()
+            os.close(slave)
+            os.close(master)
+
+    srv = socket.socket()
+    srv.bind(("127.0.0.1", 0))
+    srv.listen(1)
+    stop = threading.Event()
+    threading.Thread(target=_tcp_echo, args=(srv, stop), daemon=True).start()
+    try:
+        _run("tcp", {"transport": {"type": "tcp", "host": "127.0.0.1", "port": srv.getsockname()[1], **timeouts}},
+             args.rounds, args.size)
+    finally:
+        stop.set()
+        srv.close()
+
+    if args.rfc2217:
+        host, port = args.rfc2217.rsplit(":", 1)
+        _run("rfc2217", {"baud_rate": args.baud, "transport": {"type": "rfc2217", "host": host, "port": int(port), **timeouts}},
+             args.rounds, args.size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# circuit_breaker.py
+"""
+Circuit breaker cho relay I/O (BOARD_RELAY)
+- closed: cho phép I/O; fail_threshold lỗi link liên tiếp -> open
+- open: từ chối ngay với lỗi cache (không tốn retry x timeout cho mỗi frame); một thread nền
+  probe (probe_fn) mỗi probe_interval_ms ở trạng thái half_open
+- probe thành công -> closed; thất bại -> quay lại open, chờ lần probe sau
+- Thống kê: số lần open, số request bị từ chối, thời gian đã tiết kiệm (ước lượng theo thời gian
+  trung bình của các lần I/O lỗi)
+"""
+
+import threading
+import time
+from typing import Dict, Any, Optional, Callable
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, probe_fn: Optional[Callable[[], bool]] = None, fail_threshold: int = 3,
+                 probe_interval_ms: float = 2000.0, enabled: bool = True, on_change: Optional[Callable] = None):
+        """probe_fn() -> True nếu thiết bị đã trả lời lại. on_change(name, old, new, last_error)."""
+        self.name = name
+        self.enabled = bool(enabled)
+        self._probe = probe_fn
+        self.fail_threshold = max(1, int(fail_threshold))
+        self.probe_interval_s = max(0.05, float(probe_interval_ms) / 1000.0)
+        self._on_change = on_change
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.state = CLOSED
+        self.failures = 0  # liên tiếp
+        self.last_error: Optional[str] = None
+        self.opened_at: Optional[float] = None
+        self.opened_count = 0
+        self.rejected = 0
+        self.probes = 0
+        self.probe_failures = 0
+        self._fail_ms_total = 0.0
+        self._fail_n = 0
+
+    # --- I/O path ---
+    def allow(self) -> Optional[str]:
+        """None nếu được phép I/O, ngược lại thông báo lỗi cache (trả ngay cho caller)."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            if self.state == CLOSED:
+                return None
+            self.rejected += 1
+            return f"{self.name} circuit {self.state}: {self.last_error}"
+
+    def record(self, ok: bool, error: Optional[str] = None, elapsed_ms: float = 0.0):
+        if not self.enabled:
+            return
+        with self._lock:
+            if ok:
+                self.failures = 0
+                return
+            self.failures += 1
+            self.last_error = error
+            self._fail_ms_total += elapsed_ms
+            self._fail_n += 1
+            trip = self.state == CLOSED and self.failures >= self.fail_threshold
+            if trip:
+                self._set(OPEN)
+        if trip:
+            self._start_prober()
+
+    # --- trạng thái ---
+    def _set(self, new: str):
+        # gọi trong _lock
+        old, self.state = self.state, new
+        if new == OPEN and old == CLOSED:
+            self.opened_at = time.monotonic()
+            self.opened_count += 1
+        if new == CLOSED:
+            self.opened_at = None
+            self.failures = 0
+        if self._on_change is not None and old != new:
+            try:
+                self._on_change(self.name, old, new, self.last_error)
+            except Exception:
+                pass
+
+    def reset(self):
+        """Đóng breaker ngay (vd. sau khi reconnect thành công)."""
+        with self._lock:
+            self._set(CLOSED)
+        self._wake.set()
+
+    def _start_prober(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._prober, name=f"{self.name}-probe", daemon=True)
+            self._thread.start()
+
+    def _prober(self):
+        while True:
+            self._wake.clear()
+            self._wake.wait(self.probe_interval_s)
+            with self._lock:
+                if self.state == CLOSED:
+                    return
+                self._set(HALF_OPEN)
+                self.probes += 1
+            try:
+                ok = bool(self._probe()) if self._probe is not None else True
+                err = None
+            except Exception as e:
+                ok, err = False, str(e)
+            with self._lock:
+                if ok:
+                    self._set(CLOSED)
+                    return
+                self.probe_failures += 1
+                if err:
+                    self.last_error = err
+                self._set(OPEN)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            avg_fail = self._fail_ms_total / self._fail_n if self._fail_n else 0.0
+            return {
+                "enabled": self.enabled,
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "fail_threshold": self.fail_threshold,
+                "last_error": self.last_error,
+                "open_for_ms": int((time.monotonic() - self.opened_at) * 1000) if self.opened_at else None,
+                "opened_count": self.opened_count,
+                "rejected": self.rejected,
+                "saved_ms_est": round(self.rejected * avg_fail, 1),
+                "probes": self.probes,
+                "probe_failures": self.probe_failures,
+            }
@@ -10,8 +10,7 @@ server.py — VM2030 + PLC + Board Relay + ZeroMQ
 - GET_JOB: send %J{n}_B<CR>, collect 2 segments (header + body), normalize to JobCncModel.
 """
 import serial, serial.tools.list_ports
-import time, json, os, threading, re, uuid, argparse
-from queue import Queue
+import time, json, os, threading, re, uuid, argparse, queue
 from datetime import datetime, timezone
 import zmq
 import random
@@ -24,6 +23,29 @@ except ImportError:
     _HAS_SEQ_LOGGER = False
     print("Warning: logger_setup not found. Seq logging disabled.")
 
+from sc_rx_pipeline import ScRxPipeline, EchoMatcher, COMPLETION_CODES
+from sc_completion import CompletionRegistry
+from sc_link_health import LinkHealth
+from sc_tx_queue import PriorityTxQueue, TxQueueFull
+from relay_async import RelayExecutor
+from relay_controller import RelayController
+from modbus_snapshot import RegisterSnapshot
+from poll_scheduler import PollScheduler
+from register_map import RegisterMap
+from circuit_breaker import CircuitBreaker
+from zmq_frontend import LanedRouter
+from op_results import AsyncOps
+from idempotency import IdempotencyCache, MISS
+from single_flight import SingleFlight
+import request_context as reqctx
+from modbus_link import ModbusTransactor
+from modbus_scheduler import ModbusScheduler
+from modbus_rtu import (crc_ok, read_holding_frame, read_holding_response_len, parse_registers,
+                        relay_frame, write_relays_frame, parse_exception, exception_message,
+                        fc16_echo_ok, fc16_echo_detail, warm_frame_cache, RELAY_COUNT)
+from sc_jog import JogStreamer
+from transports import open_transport, is_network_transport, transport_type, transport_endpoint
+
 # -----------------------------
 # Files & Globals
 # -----------------------------
@@ -32,24 +54,45 @@ JOB_STORE_FILE  = "job_store.json"
 
 ser = None              # BOARD_RELAY (Modbus)
 ser_cmd = None          # SOFTWARE_COMMAND -> VM2030
-cmd_queue = None        # queue to writer
+cmd_queue = None        # PriorityTxQueue to writer (lane emergency/normal)
 ser_lock = threading.Lock()     # lock cho BOARD_RELAY
+_modbus = ModbusTransactor(lambda: ser, ser_lock)  # transaction engine BOARD_RELAY (main cấu hình theo baud)
+# thread sở hữu bus RS485: actuation > ready > poll, xoay vòng giữa các slave trong cùng lớp
+_bus = ModbusScheduler(is_error=lambda r: isinstance(r, dict) and ("error" in r or r.get("ok") is False))
+_regs = RegisterSnapshot()      # snapshot các signal (register_map) do background_read publish
+_regmap = None                  # RegisterMap hiện tại (dựng từ config khi dùng lần đầu / trong main)
+_slaves = {}                    # slave phụ trên cùng bus: name -> {slave_id, map, snapshot, poll, cfg}
+_relay_breakers = {}            # slave_id -> CircuitBreaker quanh relay I/O
+_poll = PollScheduler()         # lịch poll của background_read (main cấu hình lại theo read_settings)
 
 # Seq logging
 seq_logger = None       # Seq logger instance
 
 # Relay error tracking
-_relay_errors = []      # Track relay errors during operations
+_relay_exec = RelayExecutor(enabled=False)  # relay worker (main tạo lại theo config "relay_async")
+_relay_ctl = RelayController(lambda start, codes: _relay_ctl_write(start, codes))  # shadow + gộp FC16 (main cấu hình lại)
 
 # SC RX state
 sc_rx_lock = threading.Lock()   # lock cho VM2030 RX cache/buffer
 sc_rx_cv = threading.Condition(sc_rx_lock)
 _last_status_code = {"code": None, "ts": None}  # last byte (0x1F on complete)
-_sc_rx_buffer = bytearray()      # buffer thu ASCII cho các lệnh GET/UPLOAD
+_sc_rx = ScRxPipeline()          # RX pipeline: ring buffer + frame theo 0x1F/0x87 (cấu hình lại trong main)
+_sc_completions = CompletionRegistry()  # future theo op_id, resolve ngay khi nhận 0x1F/0x87
+
+# Echo verification: trạng thái echo của VM2030 (đổi khi TOGGLE_ECHO thành công)
+_sc_echo_state = {"enabled": False}
+_sc_echo_stats = {"verified": 0, "mismatch": 0, "missing": 0, "retransmits": 0}
+
+# Retry policy: thống kê gửi lại và latency EWMA theo command (để ước lượng sub-timeout)
+_sc_retry_stats = {"retries": 0, "recovered": 0, "exhausted": 0}
+_sc_latency_ewma = {}
+# Deadline client gửi trong envelope ("deadline" epoch ms / "timeoutMs"): request có deadline, bị từ chối
+# (đã quá hạn / không kịp theo latency EWMA / chờ lane device quá hạn), bị kẹp timeout, bị bỏ giữa chừng
+_deadline_stats = {"requests": 0, "refused_expired": 0, "refused_infeasible": 0, "lane_wait_expired": 0,
+                   "clamped": 0, "abandoned": 0}
 
-# Reader thread control for GET_JOB
-_reader_thread_enabled = threading.Event()  # Controls if reader thread should process data
-_reader_thread_enabled.set()  # Default: enabled
+# Link health VM2030 (RX silence, RTT probe, up/down)
+_sc_link = LinkHealth()
 
 LOG_LEVELS = {"off":0, "error":1, "warn":2, "info":3, "debug":4}
 
@@ -147,8 +190,11 @@ def _load_store():
     return {"jobs": {}, "sequences": {}}
 
 def _save_store(store):
-    with open(JOB_STORE_FILE, "w", encoding="utf-8") as f:
+    # ghi file tạm rồi replace: request lane "fast" đọc store song song không thấy file ghi dở
+    tmp = JOB_STORE_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
         json.dump(store, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, JOB_STORE_FILE)
 
 def _log_enabled(level):
     try:
@@ -200,8 +246,17 @@ def log_json(level, obj):
 def _ok(corr_id, message):
     return {"CorrelationId": corr_id, "IsError": False, "ErrorMessage": "", "Message": message}
 
-def _err(corr_id, msg):
-    return {"CorrelationId": corr_id, "IsError": True, "ErrorMessage": str(msg), "Message": {}}
+def _err(corr_id, msg, not_executed=False, deadline=False):
+    """
+    not_executed=True: bị từ chối trước khi gửi thiết bị (NotExecuted) -> client gửi lại an toàn, không cache.
+    deadline=True: lỗi do deadline của chính request này (DeadlineExceeded) -> không chia cho follower single-flight.
+    """
+    reply = {"CorrelationId": corr_id, "IsError": True, "ErrorMessage": str(msg), "Message": {}}
+    if not_executed:
+        reply["NotExecuted"] = True
+    if deadline:
+        reply["DeadlineExceeded"] = True
+    return reply
 
 # ---- Mongo-like ObjectId generator (24 hex) ----
 def new_object_id() -> str:
@@ -309,30 +364,69 @@ def load_config(config_file_path=CONFIG_FILE):
         "devices": {
             "BOARD_RELAY": {
                 "com_port": None, "baud_rate": 9600, "slave_id": 1,
-                "read_settings": {"start_address": 129, "num_registers": 8, "interval_ms": 500}
+                "transport": { "type": "serial", "read_timeout_s": 1.0, "write_timeout_s": 1.0 },
+                "read_settings": {"start_address": 129, "num_registers": 8, "interval_ms": 500,
+                                  "active_interval_ms": 100, "active_hold_ms": 2000,
+                                  "backoff_factor": 2.0, "backoff_max_ms": 5000,
+                                  "max_age_ms": { "ready_gate": 600, "ready_status": 1000, "position": 1000 }},
+                "timing": { "response_timeout_ms": 200, "char_bits": 11, "min_gap_ms": 1.75,
+                            "adaptive": { "enabled": True, "window": 64, "min_samples": 10,
+                                          "min_retries": 0, "max_retries": 3, "error_rate_for_max_retries": 0.2,
+                                          "timeout_min_ms": 30, "timeout_max_ms": 1000,
+                                          "timeout_factor": 3.0, "timeout_margin_ms": 10,
+                                          "max_extra_gap_ms": 5.0, "silent_after": 3 } },
+                "relay_coalesce": { "enabled": True, "window_ms": 5, "shadow_ttl_ms": 30000 },
+                "register_map": { "signals": None, "groups": { "fast": {"every": 1}, "slow": {"every": 5} },
+                                  "max_gap_registers": 6 },
+                "slaves": [],
+                "circuit_breaker": { "enabled": True, "fail_threshold": 3, "probe_interval_ms": 2000,
+                                     "probe_address": None }
             },
             "SOFTWARE_COMMAND": {
                 "com_port": None, "baud_rate": 9600,
+                "transport": { "type": "serial", "read_timeout_s": 1.0, "write_timeout_s": None,
+                               "reconnect_interval_s": 2.0 },
                 "protocol": "ascii",
                 "xonxoff": True,
                 "emit_options": { "debounce_ms": 100, "edge_only": False, "min_interval_ms": 0 },
+                "tx_queue": { "emergency": 8, "normal": 32 },
                 "default_append": "<CR>",
                 "dry_run": True,
                 "dry_run_complete_ms": 1000,
                 "print_mode": "hex_ascii",
+                "rx_buffer": { "capacity": 4096, "max_frames": 64 },
+                "echo_verify": { "enabled": True, "assume_echo_on": False, "char_factor": 2.0, "slack_ms": 30, "retransmit": 1 },
+                "link_health": { "enabled": True, "probe_interval_ms": 2000, "idle_before_probe_ms": 5000,
+                                 "probe_timeout_ms": 500, "fail_threshold": 2,
+                                 "probe": None },  # lệnh không đổi trạng thái máy; None = không probe lúc rảnh
                 "templates": {
                     "HOME": "%H<CR>",
                     "RESET": "<0x1D>"
                 }
             }
         },
-        "zeromq": {"rep_bind":"tcp://*:5555","rcv_timeout_ms":1000,"snd_timeout_ms":1000},
+        "zeromq": {"rep_bind":"tcp://*:5555","rcv_timeout_ms":1000,"snd_timeout_ms":1000,
+                   "frontend": { "mode": "router", "fast_workers": 4, "fast_queue": 256, "device_queue": 64,
+                                 "read_workers": 4, "read_queue": 64, "wait_workers": 8, "wait_queue": 64 }},
+        "async_ops": { "max_pending": 64, "max_results": 1024, "ttl_ms": 600000, "max_wait_ms": 30000 },
+        "idempotency": { "enabled": True, "max_entries": 1024, "ttl_ms": 300000 },
+        "single_flight": { "enabled": True },
         "app": { "position": { "x_index": 0, "y_index": 1, "scale": 0.01 } },
         "logging": { "level": "info", "timestamps": True, "console": True, "show_prompt": False },
         "timeouts": {
             "sc_complete_ms": 5000,
             "ui_op_timeout_ms": 20000,
-            "get_job_ms": 4000
+            "get_job_ms": 4000,
+            "abandon_margin_ms": 500
+        },
+        "relay_async": { "enabled": True, "join_ms": 0, "builtin_join_ms": 500 },
+        "jog": { "idle_timeout_ms": 5000, "stop_timeout_ms": 5000 },
+        "retry_policy": {
+            "enabled": True, "max_retries": 2,
+            "idempotent": ["HOME", "RT_HOME", "MOVE_X", "MOVE_Y", "TOGGLE_ECHO", "SET_JOB", "SET_SEQUENCE"],
+            "sub_timeout_ms": { "default": 3000, "HOME": 8000, "RT_HOME": 8000, "MOVE_X": 4000, "MOVE_Y": 4000,
+                                "TOGGLE_ECHO": 1000, "SET_JOB": 2000, "SET_SEQUENCE": 2000 },
+            "estimate_factor": 3.0, "min_sub_timeout_ms": 300
         }
     }
     cfg={}
@@ -358,6 +452,10 @@ def save_config(cfg):
 def setup_com_ports(cfg):
     def list_and_pick(device_key):
         nonlocal cfg
+        if is_network_transport(cfg["devices"][device_key]):
+            log("info", f"[{device_key}] Transport {transport_type(cfg['devices'][device_key])} "
+                        f"-> {transport_endpoint(cfg['devices'][device_key])} (không cần COM port)")
+            return
         while True:
             ports = get_available_ports()
             log("info", f"--- Cấu hình cổng cho {device_key} ---")
@@ -408,15 +506,11 @@ def open_serial_for(device_key, cfg):
         log("debug", f"[{device_key}] Dry run mode - no actual serial connection needed")
         return None
         
-    port = dev.get("com_port"); baud = int(dev.get("baud_rate",9600))
+    port = transport_endpoint(dev); baud = int(dev.get("baud_rate",9600))
     if not port: return None
     try:
-        if device_key=="SOFTWARE_COMMAND":
-            s = serial.Serial(port, baud, parity=serial.PARITY_NONE, stopbits=serial.STOPBITS_ONE,
-                              timeout=1, xonxoff=bool(dev.get("xonxoff", True)))
-        else:
-            s = serial.Serial(port, baud, parity=serial.PARITY_NONE, stopbits=serial.STOPBITS_ONE, timeout=1)
-        log("debug", f"[{device_key}] Kết nối tới {port} ({baud}bps) thành công.")
+        s = open_transport(device_key, dev)
+        log("debug", f"[{device_key}] Kết nối tới {port} ({transport_type(dev)}, {baud}bps) thành công.")
         return s
     except Exception as e:
         log("error", f"[{device_key}] Lỗi mở cổng {port}: {e}"); return None
@@ -424,16 +518,15 @@ def open_serial_for(device_key, cfg):
 # -----------------------------
 # Modbus (BOARD_RELAY)
 # -----------------------------
-def calculate_crc(data):
-    crc = 0xFFFF
-    for pos in data:
-        crc ^= pos
-        for _ in range(8):
-            if crc & 0x0001: crc >>= 1; crc ^= 0xA001
-            else: crc >>= 1
-    return crc.to_bytes(2, byteorder="little")
-
-def read_holding_registers(slave_id, start_addr, num_registers):
+def read_holding_registers(slave_id, start_addr, num_registers, priority="poll"):
+    """
+    FC03 qua bus scheduler. priority: "ready" (gating trước lệnh) hoặc "poll".
+    Các lần đọc cùng vùng thanh ghi đang chờ trong hàng được gộp thành một transaction.
+    """
+    return _bus.call(priority, _read_holding_registers_io, slave_id, start_addr, num_registers,
+                     key=("fc03", slave_id, start_addr, num_registers), lane=slave_id)
+
+def _read_holding_registers_io(slave_id, start_addr, num_registers):
     global ser
     
     # Dry run mode: return simulated values
@@ -457,20 +550,20 @@ def read_holding_registers(slave_id, start_addr, num_registers):
             return {"error": "connection_not_available", "message": "Serial connection is None"}
     
     try:
-        data = [slave_id, 0x03, start_addr>>8, start_addr&0xFF, num_registers>>8, num_registers&0xFF]
-        data += list(calculate_crc(data))
-        with ser_lock:
-            ser.reset_input_buffer(); ser.write(bytearray(data)); time.sleep(0.1)
-            expected = 3 + num_registers*2 + 2
-            response = ser.read(expected)
+        data = read_holding_frame(slave_id, start_addr, num_registers)
+        expected = read_holding_response_len(num_registers)
+        tr = _modbus.transact(data, expected)
+        response = tr["resp"]
+        if tr["exception"] and crc_ok(response[:5]):
+            return {"error": "modbus_exception", "message": exception_message(response[2])}
         if len(response) != expected: 
             return {"error": "invalid_response_length", "message": f"Expected {expected} bytes, got {len(response)}"}
-        if response[-2:] != calculate_crc(response[:-2]): 
+        if not crc_ok(response): 
             return {"error": "crc_mismatch", "message": "Response CRC validation failed"}
-        vals=[]
-        for i in range(3, len(response)-2, 2):
-            vals.append((response[i]<<8)|response[i+1])
-        return vals
+        vals = parse_registers(response, num_registers)
+        if vals is None:
+            return {"error": "invalid_response_length", "message": f"Byte count {response[2]} != {num_registers*2}"}
+        return list(vals)
     except serial.SerialException as e:
         # USB disconnected, port not available, etc.
         error_msg = f"Serial communication error: {str(e)}"
@@ -504,13 +597,61 @@ def read_holding_registers(slave_id, start_addr, num_registers):
                            function="read_holding_registers", slave_id=slave_id)
         return {"error": "unknown", "message": error_msg}
 
-def control_single_relay(slave_id, relay_addr, state_value, retries=2, tx_delay_s=0.02):
+def _relay_breaker(slave_id):
+    """Circuit breaker relay I/O của 1 slave (tạo khi dùng lần đầu theo BOARD_RELAY.circuit_breaker)."""
+    br = _relay_breakers.get(slave_id)
+    if br is None:
+        dev = config["devices"]["BOARD_RELAY"]
+        cb = dev.get("circuit_breaker", {})
+        name = "BOARD_RELAY" if slave_id == dev.get("slave_id", 1) else f"BOARD_RELAY:{slave_id}"
+        addr = cb.get("probe_address")
+        addr = int(addr if addr is not None else dev["read_settings"]["start_address"])
+
+        def _probe():
+            # half-open: 1 FC03 ngắn; slave trả lời (kể cả exception) là đã sống lại
+            vals = read_holding_registers(slave_id, addr, 1, priority="poll")
+            return isinstance(vals, (list, tuple)) or (isinstance(vals, dict) and vals.get("error") == "modbus_exception")
+
+        def _changed(n, old, new, err):
+            log("warn" if new == "open" else "info", f"[{n}] relay circuit {old} -> {new}" + (f" ({err})" if new == "open" else ""))
+
+        br = _relay_breakers.setdefault(slave_id, CircuitBreaker(
+            name, _probe, fail_threshold=int(cb.get("fail_threshold", 3)),
+            probe_interval_ms=float(cb.get("probe_interval_ms", 2000)),
+            enabled=bool(cb.get("enabled", True)), on_change=_changed))
+    return br
+
+def _relay_guarded(slave_id, io_fn, *args):
+    """
+    Relay I/O qua bus scheduler (actuation) sau circuit breaker: breaker open -> trả lỗi cache ngay.
+    Lỗi link (timeout, frame hỏng, mất port) mới tính vào breaker; Modbus exception = board vẫn sống.
+    """
+    br = _relay_breaker(slave_id)
+    err = br.allow()
+    if err:
+        return {"ok": False, "error": err, "circuit": br.state}
+    t0 = time.monotonic()
+    res = _bus.call("actuation", io_fn, slave_id, *args, lane=slave_id)
+    if not res.get("invalid"):
+        alive = bool(res.get("ok")) or str(res.get("error", "")).startswith("Modbus exception")
+        br.record(alive, res.get("error"), (time.monotonic() - t0) * 1000.0)
+    return res
+
+def control_single_relay(slave_id, relay_addr, state_value, retries=None, tx_delay_s=0.02):
     """
     FC16 write single register: relay_addr 1..12, state_value: 1=ON, 2=OFF (theo board)
+    retries=None: theo chất lượng link (_modbus.retries_for, timing.adaptive).
+    tx_delay_s: không còn dùng (timing do _modbus tính theo baud), giữ để tương thích.
+    Chạy trên bus scheduler với ưu tiên cao nhất (actuation).
     """
+    return _relay_guarded(slave_id, _control_single_relay_io, relay_addr, state_value, retries)
+
+def _control_single_relay_io(slave_id, relay_addr, state_value, retries=None):
     global ser
+    if retries is None:
+        retries = _modbus.retries_for(slave_id)
     if not (1 <= relay_addr <= 12):
-        return {"ok": False, "error": "Địa chỉ relay phải 1..12"}
+        return {"ok": False, "error": "Địa chỉ relay phải 1..12", "invalid": True}
     
     # Dry run mode
     if ser is None and config["devices"]["BOARD_RELAY"].get("dry_run", False):
@@ -533,31 +674,23 @@ def control_single_relay(slave_id, relay_addr, state_value, retries=2, tx_delay_
         log_relay_operation(seq_logger, relay_id=relay_addr, state=state_name,
                            slave_id=slave_id, retries=retries, dry_run=False)
         
-    frame = [slave_id, 0x10, 0x00, relay_addr, 0x00, 0x01, 0x02, state_value, 0x00]
-    frame += list(calculate_crc(frame))
-    ex_map = {0x01:"Illegal Function",0x02:"Illegal Data Address",0x03:"Illegal Data Value",0x04:"Slave Device Failure",0x05:"Acknowledge",0x06:"Slave Device Busy",0x07:"Negative Acknowledge",0x08:"Memory Parity Error"}
+    frame = relay_frame(slave_id, relay_addr, state_value)
     for attempt in range(retries + 1):
         try:
-            with ser_lock:
-                ser.reset_input_buffer()
-                ser.write(bytearray(frame))
-                time.sleep(tx_delay_s)
-                resp = ser.read(8)
-                if len(resp) == 0: resp = ser.read(8)
+            resp = _modbus.transact(frame, 8)["resp"]
             if len(resp) >= 5 and (resp[1] & 0x80):
                 ex_resp = resp[:5]
-                if ex_resp[-2:] != calculate_crc(ex_resp[:-2]):
+                ex_code = parse_exception(ex_resp)
+                if ex_code is None:
                     if attempt < retries: continue
                     return {"ok": False, "error": "CRC sai (exception)", "detail": {"raw": ex_resp.hex()}}
-                ex_code = ex_resp[2]
-                return {"ok": False, "error": f"Modbus exception: {ex_map.get(ex_code, f'0x{ex_code:02X}')} ({ex_code})", "detail": {"raw": ex_resp.hex()}}
+                return {"ok": False, "error": exception_message(ex_code), "detail": {"raw": ex_resp.hex()}}
             if len(resp) == 8:
-                if resp[-2:] != calculate_crc(resp[:-2]):
+                if not crc_ok(resp):
                     if attempt < retries: continue
                     return {"ok": False, "error": "CRC sai (FC16)", "detail": {"raw": resp.hex()}}
-                ok = (resp[0]==slave_id) and (resp[1]==0x10) and (resp[2]==0x00 and resp[3]==relay_addr) and (resp[4]==0x00 and resp[5]==0x01)
-                if ok:
-                    return {"ok": True, "detail": {"slave": resp[0], "function": resp[1], "address": (resp[2]<<8)|resp[3], "quantity": (resp[4]<<8)|resp[5]}}
+                if fc16_echo_ok(resp, slave_id, relay_addr, 1):
+                    return {"ok": True, "detail": fc16_echo_detail(resp)}
                 else:
                     return {"ok": False, "error": "Echo không khớp", "detail": {"raw": resp.hex()}}
             if attempt < retries: continue
@@ -566,19 +699,25 @@ def control_single_relay(slave_id, relay_addr, state_value, retries=2, tx_delay_
             if attempt < retries: continue
             return {"ok": False, "error": f"Lỗi khi ghi relay: {e}"}
         
-def control_multi_relays(slave_id, start_relay_addr, state_codes, retries=2, tx_delay_s=0.02):
+def control_multi_relays(slave_id, start_relay_addr, state_codes, retries=None, tx_delay_s=0.02):
     """
     Ghi nhiều thanh ghi liên tiếp bằng FC=0x10.
     - start_relay_addr: số kênh bắt đầu (1..12). Ví dụ 2 -> ghi kênh 2,3,...
     - state_codes: list các mã lệnh theo chuẩn board: 1=OPEN, 2=CLOSE, 3=TOGGLE, 4=LATCH, 5=MOMENTARY
       (Mỗi thanh ghi sẽ gửi [code, 0x00])
+    Chạy trên bus scheduler với ưu tiên cao nhất (actuation).
     """
+    return _relay_guarded(slave_id, _control_multi_relays_io, start_relay_addr, state_codes, retries)
+
+def _control_multi_relays_io(slave_id, start_relay_addr, state_codes, retries=None):
     global ser
+    if retries is None:
+        retries = _modbus.retries_for(slave_id)
     if not (1 <= start_relay_addr <= 12):
-        return {"ok": False, "error": "Địa chỉ bắt đầu phải 1..12"}
+        return {"ok": False, "error": "Địa chỉ bắt đầu phải 1..12", "invalid": True}
     qty = len(state_codes)
     if qty < 1 or (start_relay_addr + qty - 1) > 12:
-        return {"ok": False, "error": "Số lượng vượt quá 12 kênh"}
+        return {"ok": False, "error": "Số lượng vượt quá 12 kênh", "invalid": True}
 
     # Dry run mode
     if ser is None and config["devices"]["BOARD_RELAY"].get("dry_run", False):
@@ -594,41 +733,30 @@ def control_multi_relays(slave_id, start_relay_addr, state_codes, retries=2, tx_
         return {"ok": False, "error": "Serial connection not available"}
 
     # Khung: [slave, 0x10, addr_hi, addr_lo, qty_hi, qty_lo, byte_count, data..., CRC(lo,hi)]
-    frame = [slave_id, 0x10, 0x00, start_relay_addr, 0x00, qty, qty * 2]
-    for code in state_codes:
-        code = int(code)
+    codes = tuple(int(code) for code in state_codes)
+    for code in codes:
         if code not in (1,2,3,4,5):
             return {"ok": False, "error": f"Mã lệnh không hợp lệ: {code}"}
-        frame += [code, 0x00]  # theo tài liệu: lệnh nằm byte cao, byte thấp = 0x00
-
-    frame += list(calculate_crc(frame))
+    frame = write_relays_frame(slave_id, start_relay_addr, codes)  # lệnh nằm byte cao, byte thấp = 0x00
 
     for attempt in range(retries + 1):
         try:
-            with ser_lock:
-                ser.reset_input_buffer()
-                ser.write(bytearray(frame))
-                time.sleep(tx_delay_s)
-                # Echo FC16 chuẩn = 8 byte: slave, 0x10, addr_hi, addr_lo, qty_hi, qty_lo, CRC(lo,hi)
-                resp = ser.read(8)
-                if len(resp) == 0:
-                    resp = ser.read(8)
+            # Echo FC16 chuẩn = 8 byte: slave, 0x10, addr_hi, addr_lo, qty_hi, qty_lo, CRC(lo,hi)
+            resp = _modbus.transact(frame, 8)["resp"]
 
             if len(resp) == 8:
-                if resp[-2:] != calculate_crc(resp[:-2]):
+                if not crc_ok(resp):
                     if attempt < retries:
                         continue
                     return {"ok": False, "error": "CRC sai (FC16 echo)", "detail": {"raw": resp.hex()}}
 
-                ok = (resp[0] == slave_id and resp[1] == 0x10 and
-                      resp[2] == 0x00 and resp[3] == start_relay_addr and
-                      resp[4] == 0x00 and resp[5] == qty)
-                if ok:
+                if fc16_echo_ok(resp, slave_id, start_relay_addr, qty):
+                    detail = fc16_echo_detail(resp)
                     return {"ok": True, "detail": {
-                        "slave": resp[0],
-                        "function": resp[1],
-                        "start_address": (resp[2] << 8) | resp[3],
-                        "quantity": (resp[4] << 8) | resp[5]
+                        "slave": detail["slave"],
+                        "function": detail["function"],
+                        "start_address": detail["address"],
+                        "quantity": detail["quantity"]
                     }}
                 else:
                     return {"ok": False, "error": "Echo không khớp", "detail": {"raw": resp.hex()}}
@@ -641,16 +769,26 @@ def control_multi_relays(slave_id, start_relay_addr, state_codes, retries=2, tx_
                 continue
             return {"ok": False, "error": f"Lỗi khi ghi nhiều relay: {e}"}   
 
+def _relay_ctl_write(start_relay, codes):
+    """Ghi 1 run relay liên tục cho _relay_ctl (chạy trên flusher thread của controller)."""
+    slave = config["devices"]["BOARD_RELAY"].get("slave_id", 1)
+    return control_multi_relays(slave, start_relay, list(codes))
+
+def _relay_request(changes, label):
+    """Xếp thay đổi relay vào _relay_ctl (không block); log warn khi ghi lỗi. Future -> list lỗi."""
+    fut = _relay_ctl.request(changes, label=label)
+    def _log(f):
+        for e in f.result():
+            log("warn", f"[RELAY] {e}")
+    fut.add_done_callback(_log)
+    return fut
+
 def relay_r2_off_r3_on_simultaneous():
-    dev = config["devices"]["BOARD_RELAY"]
-    slave = dev.get("slave_id", 1)
-    # bắt đầu tại kênh 2, ghi 2 kênh: [2=CLOSE, 1=OPEN] -> tắt R2, bật R3
-    return control_multi_relays(slave, 2, [2, 1])
+    # R2=CLOSE (2), R3=OPEN (1): liền kề nên _relay_ctl ghi trong 1 khung FC16
+    return _relay_ctl.set({2: 2, 3: 1})
 
 def _relay_on(relay, on):
-    dev = config["devices"]["BOARD_RELAY"]; slave = dev.get("slave_id",1)
-    state = 1 if on else 2
-    res = control_single_relay(slave, relay, state)
+    res = _relay_ctl.set({relay: 1 if on else 2})
     if not res.get("ok"):
         log("warn", f"[RELAY] set {relay}={on} failed: {res.get('error')}")
     return res
@@ -659,42 +797,58 @@ def _relay_pulse(relay, pulse_ms):
     _relay_on(relay, True)
     threading.Timer(pulse_ms/1000.0, lambda: _relay_on(relay, False)).start()
 
-def _relay_side_effects_on_send():
+def _relay_doing(on):
+    # R2 = DOING; trả về Future -> relay worker không chờ FC16, các request gần nhau được gộp
+    return _relay_request({2: 1 if on else 2}, f"Failed to turn {'on' if on else 'off'} DOING relay")
+
+def _relay_finish():
+    # R2=OFF (2), R3=ON (1) trong cùng 1 khung FC16
+    fut = _relay_request({2: 2, 3: 1}, "R2 OFF + R3 ON (simul) failed")
+
+    # Hẹn giờ 1s rồi tắt R3 (cũng qua relay worker, không thuộc reply của op)
+    def _off_r3():
+        return _relay_request({3: 2}, "R3 OFF after pulse failed")
+    threading.Timer(1.0, lambda: _relay_exec.submit("R3_OFF", _off_r3)).start()
+    return fut
+
+def _relay_side_effects_on_send(batch=None):
     """
     (MỚI) Khi bắt đầu gửi lệnh xuống máy:
       - BẬT DOING (R2) và giữ ON cho đến khi có kết quả.
+    Chạy trên relay worker -> lệnh VM2030 được gửi ngay, không chờ FC16.
     """
-    global _relay_errors
-    _relay_errors.clear()  # Clear previous errors
-    
-    result = _relay_on(2, True)   # R2 = DOING ON
-    if not result.get("ok", True):
-        _relay_errors.append(f"Failed to turn on DOING relay: {result.get('error', 'Unknown error')}")
+    batch = batch if batch is not None else _relay_exec.batch()
+    batch.submit("R2_ON", _relay_doing, True)
+    return batch
 
-def _relay_side_effects_on_complete():
+def _relay_side_effects_on_complete(batch=None):
     """
     Hoàn thành: tắt DOING (R2) + bật FINISH (R3) ngay trong 1 khung,
-    sau đó 1s thì tắt R3.
+    sau đó 1s thì tắt R3. Không chặn reply.
     """
-    global _relay_errors
-    dev = config["devices"]["BOARD_RELAY"]
-    slave = dev.get("slave_id", 1)
+    batch = batch if batch is not None else _relay_exec.batch()
+    batch.submit("R2_OFF_R3_ON", _relay_finish)
+    return batch
 
-    # 1 khung FC16: R2=OFF (2), R3=ON (1)
-    res = control_multi_relays(slave, 2, [2, 1])
-    if not res.get("ok"):
-        error_msg = f"R2 OFF + R3 ON (simul) failed: {res.get('error')}"
-        log("warn", f"[RELAY] {error_msg}")
-        _relay_errors.append(error_msg)
+def _relay_side_effects_on_fail(batch=None):
+    """Lỗi/timeout: tắt DOING (R2), KHÔNG bật alarm nào."""
+    batch = batch if batch is not None else _relay_exec.batch()
+    batch.submit("R2_OFF", _relay_doing, False)
+    return batch
 
-    # Hẹn giờ 1s rồi tắt R3
-    def _off_r3():
-        r = control_single_relay(slave, 3, 2)  # 2 = OFF/CLOSE
-        if not r.get("ok"):
-            error_msg = f"R3 OFF after pulse failed: {r.get('error')}"
-            log("warn", f"[RELAY] {error_msg}")
-            _relay_errors.append(error_msg)
-    threading.Timer(1.0, _off_r3).start()
+def _relay_report(batch, t_start: float, join_ms=None) -> dict:
+    """
+    Kết quả relay của op tại thời điểm reply + timing. Mặc định (relay_async.join_ms = 0) không chờ:
+    action chưa xong nằm trong relay.pending và lỗi của nó KHÔNG có trong relay_errors.
+    join_ms: chờ tối đa ngần ấy cho action còn pending (lệnh cần báo lỗi relay trong reply).
+    """
+    if join_ms is None:
+        join_ms = int(config.get("relay_async", {}).get("join_ms", 0))
+    rep = batch.report(int(join_ms))
+    circuit = _relay_breaker(config["devices"]["BOARD_RELAY"].get("slave_id", 1)).state
+    return {"relay": {"done": rep["done"], "pending": rep["pending"], "circuit": circuit},
+            "timing": {"totalMs": round((time.monotonic() - t_start) * 1000.0, 3), "relaySavedMs": rep["savedMs"]},
+            "relay_errors": rep["errors"]}
 
 # -----------------------------
 # VM2030 Command builders
@@ -843,7 +997,11 @@ def _sc_dump_bytes(b: bytes):
             OperationType="SerialTX", Device="SOFTWARE_COMMAND",
             HexData=b.hex(' ').upper(), DataLength=len(b))
 
-def send_raw_to_software_command(raw_bytes: bytes, repeat=1, delay_ms=0):
+def send_raw_to_software_command(raw_bytes: bytes, repeat=1, delay_ms=0, echo=None, lane="normal", op_id=None):
+    """
+    Đưa frame vào TX queue theo lane. Raise TxQueueFull khi lane đầy (backpressure).
+    op_id: id (hoặc tuple id) của completion future, được đánh dấu "đã gửi" khi writer ghi frame ra cổng.
+    """
     global cmd_queue, ser_cmd, config
     if not isinstance(raw_bytes, (bytes, bytearray)):
         raise TypeError("raw_bytes phải là bytes")
@@ -860,7 +1018,7 @@ def send_raw_to_software_command(raw_bytes: bytes, repeat=1, delay_ms=0):
         return
 
     for _ in range(repeat):
-        cmd_queue.put(("raw_bytes", bytes(raw_bytes)))
+        cmd_queue.put(("raw_bytes", bytes(raw_bytes), echo, op_id), lane)
         if delay_ms > 0: time.sleep(delay_ms/1000.0)
 
 def software_command_writer(stop_event, ser_cmd_local, queue_local, cfg):
@@ -868,134 +1026,332 @@ def software_command_writer(stop_event, ser_cmd_local, queue_local, cfg):
     min_interval_ms = int(cfg["devices"]["SOFTWARE_COMMAND"].get("emit_options", {}).get("min_interval_ms", 0))
     last_emit_at = 0
     while not stop_event.is_set():
+        # Giãn cách min_interval_ms cho lane normal; trong lúc chờ, frame emergency
+        # (RESET/HOME từ PLC) vẫn được lấy ra và gửi ngay
+        if min_interval_ms > 0:
+            rest = (last_emit_at + min_interval_ms - int(time.time()*1000)) / 1000.0
+            if rest > 0:
+                queue_local.wait_lane("emergency", rest)
         try:
-            item = queue_local.get(timeout=0.2)
+            item, lane, waited_ms = queue_local.get(timeout=0.2)
         except:
             continue
-        if min_interval_ms > 0:
-            now = int(time.time()*1000)
-            if now - last_emit_at < min_interval_ms:
-                time.sleep((min_interval_ms - (now - last_emit_at))/1000.0)
         try:
             if isinstance(item, tuple) and item[0] == "raw_bytes":
                 payload = item[1]
-                ser_cmd_local.write(payload)
+                echo = item[2] if len(item) > 2 else None
+                op_id = item[3] if len(item) > 3 else None
+                for oid in ((op_id,) if isinstance(op_id, str) else (op_id or ())):
+                    _sc_completions.mark_sent(oid)
+                if echo is not None:
+                    # Gắn matcher vào RX pipeline ngay trước khi ghi
+                    with sc_rx_lock:
+                        echo.mark_sent()
+                        _sc_rx.echo = echo
+                # transport hiện tại (reader có thể đã kết nối lại)
+                (ser_cmd if ser_cmd is not None else ser_cmd_local).write(payload)
+                _sc_link.on_tx()
                 last_emit_at = int(time.time()*1000)
-                log("debug", f"[SC TX RAW] {payload.hex(' ')}")
+                log("debug", f"[SC TX RAW] [{lane}, waited {waited_ms:.1f} ms] {payload.hex(' ')}")
         except Exception as e:
             log("error", f"Lỗi gửi SOFTWARE_COMMAND: {e}")
 
+def _sc_on_frame(payload: bytes, code: int, ts: float = None) -> bool:
+    """
+    Sink của RX pipeline (gọi khi đang giữ sc_rx_lock): ghi lastCode và resolve
+    future của operation đang chờ. Trả True nếu frame đã có người nhận.
+    """
+    _last_status_code["code"] = code
+    _last_status_code["ts"] = _ts_local()
+    sc_rx_cv.notify_all()
+    return _sc_completions.resolve(code, payload, ts) is not None
+
+_sc_rx.sink = _sc_on_frame
+
 def software_command_reader(stop_event, ser_cmd_local, cfg):
+    """
+    Drain in_waiting theo chunk vào RX pipeline. read() block tới khi có byte đầu tiên
+    (timeout của cổng), sau đó lấy hết phần còn lại trong in_waiting -> không sleep polling.
+    """
     if ser_cmd_local is None: return
     ser_cmd_local.reset_input_buffer()
+    reconnect_s = float(cfg["devices"]["SOFTWARE_COMMAND"].get("transport", {}).get("reconnect_interval_s", 2.0))
+    next_reconnect = 0.0
     while not stop_event.is_set():
         try:
-            # Chỉ xử lý dữ liệu khi reader thread được enable
-            if not _reader_thread_enabled.is_set():
-                time.sleep(0.01)
+            if ser_cmd_local is None or not ser_cmd_local.is_open:
+                # mất kết nối (peer đóng TCP, rút cáp USB): thử mở lại theo reconnect_interval_s
+                if time.monotonic() < next_reconnect:
+                    stop_event.wait(0.2)
+                    continue
+                next_reconnect = time.monotonic() + reconnect_s
+                if not attempt_reconnect_sc():
+                    continue
+                ser_cmd_local = ser_cmd
+            n = ser_cmd_local.in_waiting
+            chunk = ser_cmd_local.read(n if n > 0 else 1)
+            if not chunk:
                 continue
-                
-            b = ser_cmd_local.read(1)
-            if not b:
-                time.sleep(0.01); continue
-            code = b[0]
-            completion_codes = [0x1F, 0x87]  # 0x1F for normal, 0x87 for RESET
-            is_completion = code in completion_codes
-            code_desc = f"0x{code:02X} {'completion' if is_completion else 'data'}"
-            if is_completion:
-                code_desc += f" ({hex(code)} = {'normal completion' if code == 0x1F else 'reset completion'})"
-            print(f"[SC RX] Received byte: {code_desc}")
+            n = ser_cmd_local.in_waiting
+            if n > 0:
+                chunk += ser_cmd_local.read(n)
+
             with sc_rx_lock:
-                if is_completion:
-                    _last_status_code["code"] = code
-                    _last_status_code["ts"] = _ts_local()
-                    sc_rx_cv.notify_all()
-                else:
-                    _sc_rx_buffer.extend(b)
+                frames = _sc_rx.feed(chunk)
+            if _sc_link.on_rx():
+                log("info", "[SC LINK] VM2030 link UP (rx)")
+            if _log_enabled("debug"):
+                log("debug", f"[SC RX] {len(chunk)} bytes, {len(frames)} frame(s): {chunk.hex(' ').upper()}")
         except Exception as e:
             log("error", f"[SC RX] read error: {e}")
+            if _sc_link.on_port_error(f"port error: {e}"):
+                log("error", f"[SC LINK] VM2030 link DOWN: {e}")
+            try: ser_cmd_local.close()  # lần lặp sau kết nối lại
+            except: pass
             time.sleep(0.2)
 
 def sc_schedule_dryrun_complete():
     ms = int(config["devices"]["SOFTWARE_COMMAND"].get("dry_run_complete_ms", 1000))
     def _complete():
         with sc_rx_lock:
-            _last_status_code["code"] = 0x1F
-            _last_status_code["ts"] = _ts_local()
-            sc_rx_cv.notify_all()
+            _sc_rx.feed(b"\x1F")
         log("debug", "[SC DRYRUN] Simulated complete (0x1F)")
     threading.Timer(ms/1000.0, _complete).start()
 
 def sc_clear_rx():
     with sc_rx_lock:
-        _sc_rx_buffer.clear()
+        _sc_rx.clear()
         _last_status_code["code"] = None
         _last_status_code["ts"] = _ts_local()
 
-def sc_read_until_complete_collect(timeout_ms:int) -> bytes:
+def sc_begin_op(op_id: str, expected_codes=None):
+    """Đăng ký completion future cho op_id. Gọi TRƯỚC khi gửi lệnh."""
+    if expected_codes is None:
+        expected_codes = COMPLETION_CODES
+    return _sc_completions.register(op_id, expected_codes)
+
+def sc_read_until_complete_collect(timeout_ms:int, future=None) -> bytes:
     """
-    Thu toàn bộ byte từ reader thread cho đến khi nhận complete (0x1F) hoặc timeout.
-    Trả về payload đã nhận (không gồm 0x1F). Yêu cầu *đã gọi sc_clear_rx()* trước khi gửi lệnh.
+    Chờ frame kết thúc bằng complete (0x1F) của future (đăng ký bằng sc_begin_op trước khi gửi).
+    Trả về payload của frame (không gồm 0x1F); timeout thì trả phần đã nhận dở dang.
     """
-    end = time.time() + (timeout_ms/1000.0)
+    if future is None:
+        future = sc_begin_op(f"collect-{uuid.uuid4()}", (0x1F,))
+    if future.wait(timeout_ms/1000.0):
+        return future.payload
+    _sc_completions.cancel(future.op_id)
     with sc_rx_lock:
-        if _last_status_code["code"] == 0x1F:
-            data = bytes(_sc_rx_buffer)
-            _sc_rx_buffer.clear()
-            return data
-        while True:
-            remaining = end - time.time()
-            if remaining <= 0:
-                data = bytes(_sc_rx_buffer)
-                _sc_rx_buffer.clear()
-                return data
-            sc_rx_cv.wait(timeout=remaining)
-            if _last_status_code["code"] == 0x1F:
-                data = bytes(_sc_rx_buffer)
-                _sc_rx_buffer.clear()
-                return data
-
-def sc_wait_complete(timeout_ms:int, expected_codes=None):
+        return _sc_rx.partial.take()
+
+def sc_wait_complete(timeout_ms:int, expected_codes=None, future=None, cancel=True):
     """
-    Chờ completion signal từ VM2030. 
-    expected_codes: list of completion codes to wait for. Default: [0x1F, 0x87]
+    Chờ completion signal từ VM2030 qua future (không polling).
+    expected_codes: chỉ dùng khi chưa có future. Default: [0x1F, 0x87]
+    cancel=False: hết giờ vẫn giữ future (op sẽ gửi lại với cùng future).
     """
-    if expected_codes is None:
-        expected_codes = [0x1F, 0x87]  # 0x1F for normal commands, 0x87 for RESET
-    
-    print(f"[sc_wait_complete] Waiting for completion codes {[hex(c) for c in expected_codes]}, timeout={timeout_ms}ms...")
-    end = time.time() + (timeout_ms/1000.0)
-    last = None
-    check_count = 0
-    while time.time() < end:
-        with sc_rx_lock:
-            last = _last_status_code["code"]
-        check_count += 1
-        if check_count % 100 == 0:  # Log every 2 seconds (100 * 0.02s)
-            print(f"[sc_wait_complete] Check #{check_count}, current code: {hex(last) if last else None}")
-        if last in expected_codes:
-            print(f"[sc_wait_complete] SUCCESS: Received {hex(last)} after {check_count} checks")
-            return {"ok": True, "code": last}
-        time.sleep(0.02)
-    print(f"[sc_wait_complete] TIMEOUT: No completion code received, lastCode={hex(last) if last else None}")
+    if future is None:
+        future = sc_begin_op(f"wait-{uuid.uuid4()}", expected_codes)
+    if future.wait(timeout_ms/1000.0):
+        log("debug", f"[sc_wait_complete] {future.op_id}: received 0x{future.code:02X} after {future.latency_ms()} ms")
+        return {"ok": True, "code": future.code, "latencyMs": future.latency_ms()}
+    if cancel:
+        _sc_completions.cancel(future.op_id)
+    with sc_rx_lock:
+        last = _last_status_code["code"]
+    log("debug", f"[sc_wait_complete] {future.op_id}: TIMEOUT, lastCode={hex(last) if last else None}")
     return {"ok": False, "code": last}
 
+# -----------------------------
+# VM2030 link health (probe lúc rảnh)
+# -----------------------------
+def _sc_probe_raw():
+    """
+    Frame probe do cấu hình link_health.probe chỉ định (lệnh KHÔNG đổi trạng thái máy), None nếu chưa cấu hình.
+    Không tự dựng lệnh ghi từ trạng thái giả định (vd. %E theo _sc_echo_state): trạng thái đó có thể sai
+    (lúc khởi động, sau khi VM2030 mất điện) -> probe lật echo trên máy, echo verify hỏng cho mọi lệnh sau.
+    """
+    probe = config["devices"]["SOFTWARE_COMMAND"].get("link_health", {}).get("probe")
+    return ensure_even_before_cr(encode_ascii_with_tokens(probe)) if probe else None
+
+def _sc_link_error():
+    """Trả về message lỗi nếu link VM2030 đang down (và monitor được bật), ngược lại None."""
+    sc_cfg = config["devices"]["SOFTWARE_COMMAND"]
+    if sc_cfg.get("dry_run", False) or not sc_cfg.get("link_health", {}).get("enabled", True):
+        return None
+    # Không có probe thì không gì đưa link về "up" được nữa -> chỉ theo dõi, không từ chối op
+    if _sc_probe_raw() is None:
+        return None
+    if _sc_link.is_down():
+        return _sc_link.reject()
+    return None
+
+def sc_link_probe(timeout_ms: int) -> dict:
+    """Gửi probe (link_health.probe, lệnh không đổi trạng thái máy) và đo RTT."""
+    raw = _sc_probe_raw()
+    if raw is None:
+        return {"ok": False, "skipped": True}
+    fut = sc_begin_op(f"probe-{uuid.uuid4()}")
+    try:
+        cmd_queue.put(("raw_bytes", raw, None, fut.op_id), "normal")  # không dump ra log như lệnh UI
+    except TxQueueFull:
+        _sc_completions.cancel(fut.op_id)
+        return {"ok": False, "skipped": True}
+    _sc_link.on_probe_sent()
+    if fut.wait(timeout_ms/1000.0):
+        rtt = fut.latency_ms()
+        if _sc_link.on_probe_ok(rtt):
+            log("info", f"[SC LINK] VM2030 link UP (probe rtt={rtt} ms)")
+        log("debug", f"[SC LINK] probe ok rtt={rtt} ms")
+        return {"ok": True, "rttMs": rtt}
+    _sc_completions.cancel(fut.op_id)
+    # frame probe đã ghi: máy có thể trả lời muộn -> nuốt completion đó, không để UI op kế tiếp nhận nhầm
+    _sc_absorb_outstanding(fut.op_id, 1, COMPLETION_CODES, int(config.get("timeouts", {}).get("sc_complete_ms", 5000)))
+    if _sc_link.on_probe_fail(f"no reply to probe within {timeout_ms} ms"):
+        log("error", f"[SC LINK] VM2030 link DOWN: no reply to probe within {timeout_ms} ms")
+    return {"ok": False}
+
+def sc_link_monitor(stop_event, cfg):
+    """Probe SOFTWARE_COMMAND khi rảnh (không có op đang chờ, hàng đợi TX rỗng)."""
+    lh_cfg = cfg["devices"]["SOFTWARE_COMMAND"].get("link_health", {})
+    interval_s = int(lh_cfg.get("probe_interval_ms", 2000)) / 1000.0
+    idle_before_ms = int(lh_cfg.get("idle_before_probe_ms", 5000))
+    timeout_ms = int(lh_cfg.get("probe_timeout_ms", 500))
+    if not lh_cfg.get("probe"):
+        log("info", "[SC LINK] link_health.probe not configured: idle probing disabled")
+        return
+    while not stop_event.wait(interval_s):
+        try:
+            if _sc_completions.pending_count() > 0 or not cmd_queue.empty():
+                continue
+            idle = _sc_link.idle_ms()
+            if _sc_link.state == "up" and idle is not None and idle < idle_before_ms:
+                continue
+            sc_link_probe(timeout_ms)
+        except Exception as e:
+            log("error", f"[SC LINK] monitor error: {e}")
+
 # -----------------------------
 # PLC → soft_state summary
 # -----------------------------
 def make_state_summary(values, device_config, cfg, ts):
-    # map: Ready=index0, Home=index1, Reset=index2
-    idx_ready = 0; idx_home = 1; idx_reset = 2
-    def get_val(idx): return 1 if (0 <= idx < len(values) and values[idx]) else 0
+    # values: {signal: value} theo register_map (Ready/Home/Reset)
+    def get_val(name): return 1 if values.get(name) else 0
     return {"type":"soft_state","device":"SOFTWARE_COMMAND","source":"BOARD_RELAY",
             "address":device_config["read_settings"]["start_address"],
-            "states":{"Ready":get_val(idx_ready),"Home":get_val(idx_home),"Reset":get_val(idx_reset)}, "ts":ts}
+            "states":{"Ready":get_val("Ready"),"Home":get_val("Home"),"Reset":get_val("Reset")}, "ts":ts}
 
-def _is_ready_now():
+def _register_map():
+    global _regmap
+    if _regmap is None:
+        _regmap = RegisterMap.from_config(config["devices"]["BOARD_RELAY"], config.get("app", {}))
+    return _regmap
+
+def read_signals(names, priority="poll", slave=None, rmap=None):
+    """
+    Đọc các signal của register_map bằng số lần FC03 tối thiểu (RegisterMap.plan).
+    Mặc định: slave chính (BOARD_RELAY.slave_id) với register_map chính.
+    Trả {signal: value} hoặc error dict của read_holding_registers.
+    """
+    rmap = rmap or _register_map()
+    slave = slave if slave is not None else config["devices"]["BOARD_RELAY"].get("slave_id",1)
+    reads = {}
+    for start, count in rmap.plan(names):
+        vals = read_holding_registers(slave, start, count, priority=priority)
+        if not isinstance(vals, (list, tuple)):
+            return vals if isinstance(vals, dict) else {"error": "no_data", "message": "Read returned no data"}
+        reads[(start, count)] = vals
+    return rmap.decode(names, reads)
+
+def _read_signals_cached(consumer, names, priority="poll"):
+    """
+    Signal BOARD_RELAY cho consumer: dùng snapshot nếu tuổi <= read_settings.max_age_ms[consumer],
+    ngược lại đọc FC03 đồng bộ (chỉ các thanh ghi cần). Trả {signal: value} hoặc error dict.
+    """
+    rs = config["devices"]["BOARD_RELAY"]["read_settings"]
+    max_age = float(rs.get("max_age_ms", {}).get(consumer, 0))
+    return _regs.get(consumer, max_age, names, lambda n: read_signals(n, priority=priority))
+
+def _build_slaves(dev, app_cfg=None):
+    """
+    Slave phụ trên cùng bus BOARD_RELAY (devices.BOARD_RELAY.slaves):
+      [{"name": "io2", "slave_id": 2, "interval_ms": 1000, "register_map": {"signals": {...}, "groups": {...}}}]
+    Mỗi slave có register map, snapshot và nhịp poll riêng.
+    """
+    out = {}
+    for i, sc in enumerate(dev.get("slaves") or []):
+        sid = int(sc["slave_id"])
+        name = str(sc.get("name") or f"slave{sid}")
+        if sid == int(dev.get("slave_id", 1)) or name in out:
+            raise ValueError(f"BOARD_RELAY.slaves[{i}]: duplicate slave '{name}' (id {sid})")
+        rm = sc.get("register_map") or {}
+        if not rm.get("signals"):
+            raise ValueError(f"BOARD_RELAY.slaves[{i}] '{name}': register_map.signals is required")
+        interval = float(sc.get("interval_ms", dev.get("read_settings", {}).get("interval_ms", 500)))
+        out[name] = {"slave_id": sid, "cfg": sc,
+                     "map": RegisterMap(rm["signals"], rm.get("groups"), max_gap=int(rm.get("max_gap_registers", 6))),
+                     "snapshot": RegisterSnapshot(),
+                     "poll": PollScheduler(idle_ms=interval, active_ms=interval,
+                                           backoff_max_ms=float(sc.get("backoff_max_ms", 5000)))}
+    return out
+
+def _log_link_quality(tag, slave_id, prev):
+    """Log khi chất lượng link của slave đổi (good/degraded/down), kèm số liệu cửa sổ gần nhất."""
+    cur = _modbus.quality(slave_id)
+    if cur != prev and cur != "unknown":
+        st = _modbus.stats()["slaves"].get(str(slave_id), {})
+        level = "info" if cur == "good" else "warn"
+        log(level, f"[{tag}] link {prev or 'unknown'} -> {cur}: error_rate={st.get('error_rate')} "
+                   f"crc={st.get('crc_rate')} short={st.get('short_rate')} timeout={st.get('timeout_rate')} "
+                   f"timeout_ms={round(_modbus.turnaround_timeout_s(slave_id) * 1000)} retries={_modbus.retries_for(slave_id)}")
+    return cur
+
+def slave_poll_loop(stop_event, name):
+    """Poll 1 slave phụ theo nhịp riêng; giá trị publish vào snapshot của slave đó."""
+    sl = _slaves[name]
+    rmap, poll, snap = sl["map"], sl["poll"], sl["snapshot"]
+    cycle = 0; errors = 0; link_q = None
+    while poll.wait_next(stop_event):
+        try:
+            values = read_signals(rmap.names(rmap.groups_due(cycle)), slave=sl["slave_id"], rmap=rmap)
+        except Exception as e:
+            values = {"error": "exception", "message": str(e)}
+        cycle += 1
+        link_q = _log_link_quality(f"BOARD_RELAY:{name}", sl["slave_id"], link_q)
+        if _read_failed(values):
+            errors += 1
+            poll.record(False)
+            if errors == 1 or errors % 50 == 0:
+                log("warn", f"[BOARD_RELAY:{name}] slave {sl['slave_id']} read failed ({errors}x): {_read_error_message(values)}")
+        else:
+            if errors:
+                log("info", f"[BOARD_RELAY:{name}] slave {sl['slave_id']} recovered after {errors} error(s)")
+            errors = 0
+            poll.record(True)
+            snap.publish(values)
+
+def _slaves_status():
+    lanes = _bus.lane_stats()
     dev = config["devices"]["BOARD_RELAY"]
-    vals = read_holding_registers(dev.get("slave_id",1), dev["read_settings"]["start_address"], dev["read_settings"]["num_registers"])
-    if vals is None: return False
-    return 1 if (len(vals)>0 and vals[0]) else 0
+    main_id = dev.get("slave_id", 1)
+    out = {"main": {"slave_id": main_id, "bus": lanes.get(str(main_id)), "poll": _poll.stats()}}
+    for name, sl in _slaves.items():
+        st = sl["snapshot"].stats()
+        out[name] = {"slave_id": sl["slave_id"], "bus": lanes.get(str(sl["slave_id"])), "poll": sl["poll"].stats(),
+                     "signals": sl["snapshot"].values(), "age_ms": st["age_ms"]}
+    return out
+
+def _read_error_message(values):
+    if isinstance(values, dict) and "error" in values:
+        return values.get("message") or values["error"]
+    return "Read timeout/CRC error"
+
+def _read_failed(values):
+    return not isinstance(values, dict) or "error" in values
+
+def _is_ready_now():
+    vals = _read_signals_cached("ready_gate", ("Ready",), priority="ready")
+    if _read_failed(vals): return False
+    return 1 if vals.get("Ready") else 0
 
 # -----------------------------
 # JobCncModel normalization
@@ -1046,16 +1402,35 @@ def _extract_job_no_from_header(header_bytes: bytes, fallback: int | None) -> in
     m = re.search(r"%J\s*(\d+)\s*_B", s, flags=re.IGNORECASE)
     return int(m.group(1)) if m else int(fallback or 1)
 
-def sc_read_two_segments_for_get_job(total_timeout_ms: int) -> tuple[bytes, bytes]:
+def sc_read_two_segments_for_get_job(total_timeout_ms: int, futures=None) -> tuple[bytes, bytes]:
     """
     GET_JOB trả 2 lần 0x1F: (1) header '%J{n}_B\\r' (2) body 'J 15_  2.0_0_  2400_ ... ""'
-    Đọc nối tiếp 2 segment.
+    Chờ 2 future (đăng ký trước khi gửi) với cùng một deadline: trả về ngay khi 0x1F thứ hai tới.
     """
-    t1 = max(200, int(total_timeout_ms * 0.4))
-    t2 = max(200, int(total_timeout_ms * 0.6))
-    seg1 = sc_read_until_complete_collect(t1) or b""
-    seg2 = sc_read_until_complete_collect(t2) or b""
-    return seg1, seg2
+    if futures is None:
+        futures = (sc_begin_op(f"get-job-hdr-{uuid.uuid4()}", (0x1F,)),
+                   sc_begin_op(f"get-job-body-{uuid.uuid4()}", (0x1F,)))
+    deadline = time.monotonic() + total_timeout_ms/1000.0
+    segs = []
+    for fut in futures:
+        remaining_ms = max(0, int((deadline - time.monotonic()) * 1000))
+        segs.append(sc_read_until_complete_collect(remaining_ms, fut) or b"")
+    return segs[0], segs[1]
+
+def sc_request_job_segments(op_id: str, job_index: int, total_timeout_ms: int) -> tuple[bytes, bytes]:
+    """Gửi %J{n}_B<CR> qua writer queue và thu 2 segment trên RX path chung."""
+    futures = (sc_begin_op(f"{op_id}:hdr", (0x1F,)), sc_begin_op(f"{op_id}:body", (0x1F,)))
+    try:
+        send_raw_to_software_command(sc_build_get_job_info(job_index), op_id=tuple(f.op_id for f in futures))
+    except TxQueueFull:
+        for fut in futures: _sc_completions.cancel(fut.op_id)
+        raise
+    header, body = sc_read_two_segments_for_get_job(total_timeout_ms, futures)
+    # hết giờ (get_job_ms hoặc deadline client) khi máy chưa trả đủ 2 segment: 0x1F tới muộn thuộc GET_JOB này,
+    # nuốt trong 1 chu kỳ get_job_ms nữa -> _sc_wait_previous_op chặn op kế tiếp tới lúc đó
+    missing = sum(1 for fut in futures if fut.code is None)
+    _sc_absorb_outstanding(op_id, missing, (0x1F,), int(config.get("timeouts", {}).get("get_job_ms", 4000)))
+    return header, body
 
 def parse_vm2030_job_body(body_bytes: bytes, job_no: int) -> tuple[dict, list[str]]:
     """
@@ -1104,12 +1479,146 @@ def parse_vm2030_job_body(body_bytes: bytes, job_no: int) -> tuple[dict, list[st
     tail = parts[8:] if len(parts) > 8 else []
     return model, tail
 
+# -----------------------------
+# Echo verification
+# -----------------------------
+def _sc_echo_verify_active(command: str) -> bool:
+    sc_cfg = config["devices"]["SOFTWARE_COMMAND"]
+    ev_cfg = sc_cfg.get("echo_verify", {})
+    if not ev_cfg.get("enabled", True) or sc_cfg.get("dry_run", False) or ser_cmd is None:
+        return False
+    # TOGGLE_ECHO tự đổi trạng thái echo -> không kiểm tra chính nó
+    return bool(_sc_echo_state["enabled"]) and command != "TOGGLE_ECHO"
+
+def _sc_echo_budget_ms(n_bytes: int) -> float:
+    """Thời gian chờ echo: n ký tự (10 bit/ký tự) * char_factor + slack."""
+    sc_cfg = config["devices"]["SOFTWARE_COMMAND"]
+    ev_cfg = sc_cfg.get("echo_verify", {})
+    char_ms = 10000.0 / max(1, int(sc_cfg.get("baud_rate", 9600)))
+    return n_bytes * char_ms * float(ev_cfg.get("char_factor", 2.0)) + float(ev_cfg.get("slack_ms", 30))
+
+def _sc_wait_echo(echo: EchoMatcher, timeout_ms: int) -> dict:
+    """Chờ writer gửi frame rồi chờ echo trong vài character time."""
+    if not echo.sent_event.wait(timeout_ms/1000.0):
+        return {"ok": False, "error": "ECHO_MISSING: frame chưa được gửi", "detail": echo.describe()}
+    deadline = echo.sent_at + _sc_echo_budget_ms(len(echo.expected))/1000.0
+    echo.done_event.wait(max(0.0, deadline - time.monotonic()))
+    with sc_rx_lock:
+        if _sc_rx.echo is echo:
+            _sc_rx.echo = None
+        state = echo.state
+    detail = echo.describe()
+    if state == "matched":
+        _sc_echo_stats["verified"] += 1
+        return {"ok": True, "detail": detail}
+    if state == "mismatch":
+        _sc_echo_stats["mismatch"] += 1
+        return {"ok": False, "error": f"ECHO_MISMATCH at byte {echo.mismatch_at} ({detail['elapsedMs']} ms)", "detail": detail}
+    _sc_echo_stats["missing"] += 1
+    return {"ok": False, "error": f"ECHO_MISSING: {len(echo.received)}/{len(echo.expected)} bytes echoed in {detail['elapsedMs']} ms", "detail": detail}
+
+def _sc_absorb_outstanding(op_id: str, count: int, expected_codes, ttl_ms: float):
+    """count frame của op_id đã gửi mà completion chưa về: nuốt completion tới muộn trong ttl_ms."""
+    if count > 0 and ttl_ms > 0:
+        _sc_completions.absorb(op_id, count, expected_codes[0], ttl_ms / 1000.0)
+        log("debug", f"[SC COMPLETION] {op_id}: absorbing {count} late completion(s) for {int(ttl_ms)} ms")
+
+def _sc_wait_previous_op(command: str):
+    """Chờ completion còn nợ của op trước (tối đa tới deadline client). Trả message lỗi nếu vẫn còn."""
+    rem = reqctx.remaining_ms()
+    if _sc_completions.wait_orphans(None if rem is None else rem / 1000.0):
+        return None
+    log("warn", f"[SC COMPLETION] {command} not sent: VM2030 still completing {_sc_completions.orphans()}")
+    return f"SC_BUSY: VM2030 still completing a previous operation, {command} not sent"
+
+def _sc_tx_lane(command: str, raw: bytes, source: str) -> str:
+    """RESET (0x1D) và lệnh từ cạnh input PLC (HOME/RESET) đi lane emergency."""
+    if raw == sc_build_reset() or source == "input":
+        return "emergency"
+    return "normal"
+
+def _sc_expected_codes(raw: bytes):
+    # RESET hoàn tất bằng 0x87 (code chính), các lệnh khác bằng 0x1F
+    return (0x87, 0x1F) if raw == sc_build_reset() else (0x1F, 0x87)
+
+def _remaining_ms(deadline: float) -> int:
+    return max(0, int((deadline - time.monotonic()) * 1000))
+
+def _sc_retry_policy(command: str) -> dict:
+    """
+    Chỉ lệnh idempotent (HOME, MOVE_X/Y, TOGGLE_ECHO, SET_JOB, SET_SEQUENCE) được tự gửi lại.
+    START_JOB / START_SEQUENCE không bao giờ nằm trong danh sách này.
+    sub-timeout = latency EWMA * estimate_factor (kẹp trong [min_sub_timeout_ms, sub_timeout_ms]).
+    """
+    rp = config.get("retry_policy", {})
+    idempotent = bool(rp.get("enabled", True)) and command in rp.get("idempotent", []) and command not in ("START_JOB", "START_SEQUENCE")
+    subs = rp.get("sub_timeout_ms", {})
+    cap = int(subs.get(command, subs.get("default", 3000)))
+    est = _sc_latency_ewma.get(command)
+    if est is not None:
+        sub = int(min(cap, max(int(rp.get("min_sub_timeout_ms", 300)), est * float(rp.get("estimate_factor", 3.0)))))
+    else:
+        sub = cap
+    return {"idempotent": idempotent, "max_retries": int(rp.get("max_retries", 2)), "sub_timeout_ms": sub}
+
+def _sc_latency_observe(command: str, latency_ms):
+    if latency_ms is None:
+        return
+    prev = _sc_latency_ewma.get(command)
+    _sc_latency_ewma[command] = latency_ms if prev is None else prev + 0.2 * (latency_ms - prev)
+
+def _op_err(message_id, result: dict):
+    """
+    Reply lỗi của exec_sc_operation; NotExecuted khi lệnh bị từ chối trước khi ra máy, DeadlineExceeded khi
+    deadline client quyết định (DEADLINE_INFEASIBLE, op bị bỏ, SC_BUSY sau khi chờ op trước tới deadline).
+    """
+    return _err(message_id, _op_error_message(result), not_executed=bool(result.get("notExecuted")),
+                deadline=bool(result.get("deadline") or result.get("abandoned") or result.get("busy")))
+
+def _op_error_message(result: dict) -> str:
+    if result.get("error"):
+        return result["error"]
+    if result.get("abandoned"):
+        return f"DEADLINE_EXCEEDED: client deadline reached after {result.get('timeoutMs',0)} ms (lastCode={result.get('lastCode')})"
+    msg = f"Timeout {result.get('timeoutMs',0)} ms (lastCode={result.get('lastCode')})"
+    if result.get("retries"):
+        msg += f" after {result['retries']} retransmit(s)"
+    return msg
+
+def _op_reply_extras(result: dict) -> dict:
+    """Thông tin operation đưa vào Message của reply."""
+    extras = {"Op": {"Attempts": 1 + result.get("retries", 0) + result.get("retransmits", 0),
+                     "Retries": result.get("retries", 0),
+                     "EchoRetransmits": result.get("retransmits", 0),
+                     "LatencyMs": result.get("latencyMs")}}
+    if "relay" in result:
+        extras["Relay"] = result["relay"]
+        extras["Timing"] = result["timing"]
+    return extras
+
 # -----------------------------
 # SC operation execution (sync for UI)
 # -----------------------------
-def exec_sc_operation(op_id:str, command:str, raw:bytes, source:str, meta:dict=None, wait=True):
+def exec_sc_operation(op_id:str, command:str, raw:bytes, source:str, meta:dict=None, wait=True, relay_side_effects=True,
+                      relay_join_ms=None):
+    """
+    relay_side_effects=False: không bật/tắt DOING/FINISH (dùng cho jog streaming).
+    relay_join_ms: chờ relay action tối đa ngần ấy trước khi reply (mặc định relay_async.join_ms).
+    """
     meta = meta or {}
 
+    # Link VM2030 đang down -> từ chối ngay, không bật relay DOING
+    link_err = _sc_link_error()
+    if link_err:
+        log("warn", f"[SC LINK] {command} rejected: {link_err}")
+        return {"ok": False, "error": link_err, "linkDown": True, "notExecuted": True}
+
+    # Completion còn nợ của op trước (đã gửi lại / bị bỏ): máy có thể còn đang chạy lệnh đó -> không gửi chồng.
+    # Lane emergency (RESET, cạnh input PLC) không chờ.
+    busy_err = _sc_wait_previous_op(command) if _sc_tx_lane(command, raw, source) != "emergency" else None
+    if busy_err:
+        return {"ok": False, "error": busy_err, "busy": True, "notExecuted": True}
+
     # Log VM2030 command đến Seq (chỉ khi seq_logging=True)
     if seq_logger and _HAS_SEQ_LOGGER and config.get("seq_logging", True):
         log_vm2030_command(seq_logger, 
@@ -1120,55 +1629,154 @@ def exec_sc_operation(op_id:str, command:str, raw:bytes, source:str, meta:dict=N
                           data_length=len(raw),
                           wait_for_complete=wait)
 
-    # GIỮ NGUYÊN VỊ TRÍ GỌI
-    _relay_side_effects_on_send()
+    # Timeout kẹp theo deadline client; không đủ thời gian (theo latency EWMA) thì không gửi, không bật DOING
+    tout_cfg = int(config.get("timeouts",{}).get("ui_op_timeout_ms", 20000))
+    tout = reqctx.clamp_ms(tout_cfg) if wait else tout_cfg
+    if tout < tout_cfg:
+        est = _sc_latency_ewma.get(command)
+        if tout <= 0 or (est is not None and tout < est):
+            _deadline_stats["refused_infeasible"] += 1
+            log("warn", f"[DEADLINE] {command} refused: {tout} ms left, estimated {round(est) if est else '?'} ms")
+            return {"ok": False, "deadline": True, "notExecuted": True,
+                    "error": f"DEADLINE_INFEASIBLE: {command} needs ~{round(est) if est else '?'} ms, {tout} ms left before client deadline"}
+        _deadline_stats["clamped"] += 1
+
+    lane = _sc_tx_lane(command, raw, source)
+    if cmd_queue is not None and cmd_queue.is_full(lane):
+        log("warn", f"[SC TX] {command} rejected: TX lane '{lane}' full")
+        return {"ok": False, "error": f"TX_QUEUE_FULL: lane '{lane}' is full, retry later", "backpressure": True, "notExecuted": True}
+
+    # GIỮ NGUYÊN VỊ TRÍ GỌI (relay chạy song song, không chặn TX)
+    t_start = time.monotonic()
+    _poll.kick()  # op bắt đầu: poll BOARD_RELAY theo nhịp active (chờ cạnh Ready)
+    relay_batch = _relay_side_effects_on_send() if relay_side_effects else _relay_exec.batch()
     
     # CLEAR status code trước khi gửi lệnh mới
     with sc_rx_lock:
         _last_status_code["code"] = None
         _last_status_code["ts"] = _ts_local()
-    
-    send_raw_to_software_command(raw)
-
-    if config["devices"]["SOFTWARE_COMMAND"].get("dry_run", False):
-        sc_schedule_dryrun_complete()
 
-    if not wait:
-        return {"ok": True, "code": None, "note": "queued"}
+    deadline = time.monotonic() + tout/1000.0
+    policy = _sc_retry_policy(command)
+    max_retransmit = int(config["devices"]["SOFTWARE_COMMAND"].get("echo_verify", {}).get("retransmit", 1))
+    retransmits = 0   # gửi lại do echo sai/thiếu
+    retries = 0       # gửi lại do mất completion (hết sub-timeout)
+    sends = 0         # frame writer đã ghi ra máy (kể cả frame echo sai: máy vẫn có thể đã nhận) -> mỗi frame có thể sinh 1 completion
+    expected = _sc_expected_codes(raw)
+    t_wait = time.monotonic()
+    # Một future cho mọi lần gửi của op, đăng ký TRƯỚC khi gửi để không lỡ completion: completion của
+    # lần gửi nào về trước cũng thuộc op này; completion thừa của các lần gửi khác được absorb sau đó
+    fut = sc_begin_op(op_id, expected)
+    while True:
+        echo = EchoMatcher(raw) if (wait and _sc_echo_verify_active(command)) else None
+        try:
+            send_raw_to_software_command(raw, echo=echo, lane=lane, op_id=op_id)
+        except TxQueueFull as e:
+            _sc_completions.cancel(op_id)
+            _sc_absorb_outstanding(op_id, sends, expected, policy["sub_timeout_ms"])
+            if relay_side_effects:
+                _relay_side_effects_on_fail(relay_batch)  # R2 = DOING OFF
+            return {"ok": False, "error": f"TX_QUEUE_FULL: {e}", "backpressure": True, "notExecuted": sends == 0,
+                    **_relay_report(relay_batch, t_start, relay_join_ms)}
+
+        sends += 1
+        t_last_send = time.monotonic()
+        if sends == 1: t_first_send = t_last_send
+
+        if config["devices"]["SOFTWARE_COMMAND"].get("dry_run", False):
+            sc_schedule_dryrun_complete()
+
+        if not wait:
+            return {"ok": True, "code": None, "note": "queued", **_relay_report(relay_batch, t_start, relay_join_ms)}
+
+        if echo is not None:
+            ev = _sc_wait_echo(echo, _remaining_ms(deadline))
+            if not ev["ok"]:
+                if policy["idempotent"] and retransmits < max_retransmit:
+                    retransmits += 1
+                    _sc_echo_stats["retransmits"] += 1
+                    log("warn", f"[SC ECHO] {command} {ev['error']} -> retransmit #{retransmits}")
+                    continue
+                log("warn", f"[SC ECHO] {command} failed: {ev['error']}")
+                _sc_completions.cancel(fut.op_id)
+                # frame echo sai vẫn có thể đã tới máy: nuốt completion của mọi frame đã ghi
+                _sc_absorb_outstanding(op_id, sends, expected,
+                                       (time.monotonic() - t_first_send) * 1000.0 + policy["sub_timeout_ms"])
+                if relay_side_effects:
+                    _relay_side_effects_on_fail(relay_batch)  # R2 = DOING OFF
+                return {"ok": False, "error": ev["error"], "echo": ev["detail"], "retransmits": retransmits, "timeoutMs": tout,
+                        **_relay_report(relay_batch, t_start, relay_join_ms)}
+
+        # Lệnh idempotent: chờ theo sub-timeout ước lượng, hết thì tự gửi lại trong tổng timeout
+        can_retry = policy["idempotent"] and retries < policy["max_retries"]
+        remaining = _remaining_ms(deadline)
+        wait_ms = min(policy["sub_timeout_ms"], remaining) if can_retry else remaining
+        res = sc_wait_complete(wait_ms, future=fut, cancel=False)
+        if res.get("ok") or not can_retry or _remaining_ms(deadline) <= 0:
+            if not res.get("ok"):
+                _sc_completions.cancel(fut.op_id)
+            break
+        retries += 1
+        _sc_retry_stats["retries"] += 1
+        log("warn", f"[SC RETRY] {command}: no completion within {wait_ms} ms -> retransmit #{retries}")
 
-    tout = int(config.get("timeouts",{}).get("ui_op_timeout_ms", 20000))
-    res = sc_wait_complete(tout)
+    if res.get("ok"):
+        _sc_latency_observe(command, res.get("latencyMs"))
+        if retries:
+            _sc_retry_stats["recovered"] += 1
+        # máy có thể đã chạy cả các lần gửi lại: nuốt completion thừa, không để op sau nhận nhầm.
+        # Completion thừa về khoảng (lần gửi cuối - lần gửi đầu) sau completion đầu, thêm 1 sub-timeout dự phòng
+        if sends > 1:
+            _sc_absorb_outstanding(op_id, sends - 1, expected,
+                                   (t_last_send - t_first_send) * 1000.0 + policy["sub_timeout_ms"])
+    elif retries:
+        _sc_retry_stats["exhausted"] += 1
 
     if res.get("ok"):
-        # GIỮ NGUYÊN VỊ TRÍ GỌI
-        _relay_side_effects_on_complete()
-        
-        # Check for relay errors and include in response
-        global _relay_errors
-        has_relay_errors = len(_relay_errors) > 0
+        # GIỮ NGUYÊN VỊ TRÍ GỌI (không chặn reply)
+        if relay_side_effects:
+            _relay_side_effects_on_complete(relay_batch)
         
         # No more publishing - only REP responses
         
-        # Return success for VM2030 but include relay error info
-        result = {"ok": True, "code": res["code"], "timeoutMs": tout}
-        if has_relay_errors:
-            result["relay_errors"] = _relay_errors.copy()
+        # Return success for VM2030 but include relay error info (các relay action đã xong)
+        result = {"ok": True, "code": res["code"], "timeoutMs": tout, "latencyMs": res.get("latencyMs"),
+                  "retries": retries, "retransmits": retransmits, **_relay_report(relay_batch, t_start, relay_join_ms)}
+        if result["relay_errors"]:
             result["has_relay_errors"] = True
         
         return result
     else:
         # >>> THÊM DÒNG NÀY: timeout thì tắt DOING, KHÔNG bật alarm nào
-        _relay_on(2, False)  # R2 = DOING OFF
+        if relay_side_effects:
+            _relay_side_effects_on_fail(relay_batch)  # R2 = DOING OFF
+
+        # Hết thời gian do deadline client (timeout bị kẹp rõ rệt, không chỉ vài ms do timeoutMs = ui_op_timeout_ms
+        # trừ thời gian chuyển tiếp): bỏ op, nhả lane device + relay
+        margin = int(config.get("timeouts",{}).get("abandon_margin_ms", 500))
+        abandoned = tout_cfg - tout >= margin
+        if abandoned:
+            _deadline_stats["abandoned"] += 1
+            log("warn", f"[DEADLINE] {command} abandoned after {tout} ms: client deadline reached")
+            # máy vẫn có thể chạy xong op bị bỏ: completion tới muộn thuộc op này, không phải op sau.
+            # Nuốt nó trong phần còn lại của ui_op_timeout_ms; _sc_wait_previous_op chặn lệnh VM2030 kế tiếp tới lúc đó
+            _sc_absorb_outstanding(op_id, sends, expected, tout_cfg - (time.monotonic() - t_first_send) * 1000.0)
+
+        # Không có byte nào về trong suốt thời gian chờ -> nghi link chết (kể cả op bị bỏ)
+        if not config["devices"]["SOFTWARE_COMMAND"].get("dry_run", False) and (_sc_link.last_rx or 0) < t_wait:
+            if _sc_link.on_op_timeout(f"{command} timeout {tout} ms without rx"):
+                log("error", f"[SC LINK] VM2030 link DOWN: {command} timeout without rx")
 
         # No more publishing - timeout handled in response
-        return {"ok": False, "isTimeout": True, "lastCode": res.get("code"), "timeoutMs": tout}
+        return {"ok": False, "isTimeout": True, "abandoned": abandoned, "lastCode": res.get("code"), "timeoutMs": tout,
+                "retries": retries, "retransmits": retransmits, **_relay_report(relay_batch, t_start, relay_join_ms)}
 
 def _ensure_sc_available_or_err(message_id):
     sc_cfg = config["devices"]["SOFTWARE_COMMAND"]
     if sc_cfg.get("dry_run", False):
         return None
     if ser_cmd is None:
-        return _err(message_id, "SOFTWARE_COMMAND COM is not connected (dry_run=false)")
+        return _err(message_id, "SOFTWARE_COMMAND COM is not connected (dry_run=false)", not_executed=True)
     return None
 
 # -----------------------------
@@ -1187,27 +1795,27 @@ def attempt_reconnect_relay():
             ser = None
             
         device_config = config["devices"]["BOARD_RELAY"]
-        port = device_config.get("com_port")
+        port = transport_endpoint(device_config)
         
         if not port:
             log("warn", "[BOARD_RELAY] Không có cổng COM để kết nối lại")
             return False
             
-        # Check if port still exists
-        available_ports = [p.device for p in serial.tools.list_ports.comports()]
-        if port not in available_ports:
-            log("warn", f"[BOARD_RELAY] Cổng {port} không còn tồn tại")
-            return False
+        # Check if port still exists (chỉ với COM port qua pyserial)
+        if transport_type(device_config) == "serial":
+            available_ports = [p.device for p in serial.tools.list_ports.comports()]
+            if port not in available_ports:
+                log("warn", f"[BOARD_RELAY] Cổng {port} không còn tồn tại")
+                return False
             
         # Try to reconnect
-        new_ser = serial.Serial(
-            port=port,
-            baudrate=device_config.get("baud_rate", 9600),
-            timeout=1,
-            write_timeout=1
-        )
+        new_ser = open_transport("BOARD_RELAY", device_config)
         
         ser = new_ser
+        _relay_ctl.invalidate()  # board có thể đã reset: không tin shadow cũ
+        # port mới mở được: đóng circuit của mọi slave trên bus, không đợi probe_interval_ms
+        for br in list(_relay_breakers.values()):
+            br.reset()
         log("info", f"[BOARD_RELAY] Kết nối lại thành công với {port}")
         return True
         
@@ -1215,6 +1823,47 @@ def attempt_reconnect_relay():
         log("error", f"[BOARD_RELAY] Lỗi khi kết nối lại: {str(e)}")
         return False
 
+def attempt_reconnect_sc():
+    """
+    Thử kết nối lại SOFTWARE_COMMAND (VM2030) khi transport bị đóng (peer đóng TCP, mất COM port).
+    Reader thread gọi; writer luôn ghi qua ser_cmd hiện tại.
+    """
+    global ser_cmd
+
+    try:
+        old = ser_cmd
+        if old is not None:
+            try:
+                old.close()
+            except:
+                pass
+
+        device_config = config["devices"]["SOFTWARE_COMMAND"]
+        port = transport_endpoint(device_config)
+
+        if not port:
+            log("warn", "[SOFTWARE_COMMAND] Không có endpoint để kết nối lại")
+            return False
+
+        # Check if port still exists (chỉ với COM port qua pyserial)
+        if transport_type(device_config) == "serial":
+            available_ports = [p.device for p in serial.tools.list_ports.comports()]
+            if port not in available_ports:
+                log("warn", f"[SOFTWARE_COMMAND] Cổng {port} không còn tồn tại")
+                return False
+
+        new_ser = open_transport("SOFTWARE_COMMAND", device_config)
+        new_ser.reset_input_buffer()
+        with sc_rx_lock:
+            _sc_rx.clear()  # frame dở dang của kết nối cũ không ghép với byte mới
+        ser_cmd = new_ser
+        log("info", f"[SOFTWARE_COMMAND] Kết nối lại thành công với {port}")
+        return True
+
+    except Exception as e:
+        log("error", f"[SOFTWARE_COMMAND] Lỗi khi kết nối lại: {str(e)}")
+        return False
+
 # Background reader (Relay) + Input edges
 # -----------------------------
 def background_read(stop_event, last_values, error_count, device_config):
@@ -1223,7 +1872,8 @@ def background_read(stop_event, last_values, error_count, device_config):
     # Edge detection for Home/Reset
     last_emit_time = {}
     debounce_ms = int(config["devices"]["SOFTWARE_COMMAND"].get("emit_options", {}).get("debounce_ms", 100))
-    idx_ready, idx_home, idx_reset = 0, 1, 2
+    cycle = 0  # chu kỳ poll: group nào đến lượt theo register_map.groups[*].every
+    link_q = {"state": None}
 
     def handle_input_edge(name, new_val):
         if new_val != 1: return
@@ -1241,15 +1891,17 @@ def background_read(stop_event, last_values, error_count, device_config):
         threading.Thread(target=_run, daemon=True).start()
 
     try:
-        while not stop_event.is_set():
+        while _poll.wait_next(stop_event):
             try:
-                values = read_holding_registers(device_config.get("slave_id",1),
-                                                device_config["read_settings"]["start_address"],
-                                                device_config["read_settings"]["num_registers"])
+                rmap = _register_map()
+                values = read_signals(rmap.names(rmap.groups_due(cycle)))
+                cycle += 1
+                link_q["state"] = _log_link_quality("BOARD_RELAY", device_config.get("slave_id",1), link_q["state"])
                 
                 # Check if values is an error dict
                 if isinstance(values, dict) and "error" in values:
                     error_count["count"] += 1
+                    _poll.record(False)
                     error_type = values["error"]
                     error_msg = values["message"]
                     
@@ -1284,7 +1936,10 @@ def background_read(stop_event, last_values, error_count, device_config):
                             
                 elif values:  # Success case
                     error_count["count"]=0
+                    _poll.record(True)
+                    _regs.publish(values)
                     prev = last_values.get("values")
+                    values = {**(prev or {}), **values}  # group chưa đến lượt giữ giá trị cũ
                     if values != prev:
                         ts = _ts_local()
                         response = {"type":"read_response","device":"BOARD_RELAY",
@@ -1295,15 +1950,15 @@ def background_read(stop_event, last_values, error_count, device_config):
                         # No more publishing - only log the states
 
                         if prev is not None:
-                            old_home = 1 if prev[idx_home] else 0
-                            new_home = 1 if values[idx_home] else 0
+                            old_home = 1 if prev.get("Home") else 0
+                            new_home = 1 if values.get("Home") else 0
                             if new_home != old_home and new_home == 1:
                                 now_ms = int(time.time()*1000)
                                 if now_ms - last_emit_time.get("Home",0) >= debounce_ms:
                                     last_emit_time["Home"] = now_ms
                                     handle_input_edge("Home", 1)
-                            old_reset = 1 if prev[idx_reset] else 0
-                            new_reset = 1 if values[idx_reset] else 0
+                            old_reset = 1 if prev.get("Reset") else 0
+                            new_reset = 1 if values.get("Reset") else 0
                             if new_reset != old_reset and new_reset == 1:
                                 now_ms = int(time.time()*1000)
                                 if now_ms - last_emit_time.get("Reset",0) >= debounce_ms:
@@ -1314,15 +1969,14 @@ def background_read(stop_event, last_values, error_count, device_config):
                 else:
                     # Fallback for None values (shouldn't happen with new code)
                     error_count["count"] += 1
+                    _poll.record(False)
                     if error_count["count"] == 5:
                         log("warn","[BOARD_RELAY] Không thể đọc dữ liệu. Kiểm tra kết nối.")
-                        
-                time.sleep(device_config["read_settings"]["interval_ms"]/1000.0)
             except Exception as e:
                 error_count["count"] += 1
+                _poll.record(False)  # backoff thay cho sleep(1) cố định
                 if error_count["count"] == 5:
                     log("error", f"[BOARD_RELAY] Background read error: {str(e)}")
-                time.sleep(1)
     finally:
         # No more PUB socket cleanup needed
         pass
@@ -1330,6 +1984,56 @@ def background_read(stop_event, last_values, error_count, device_config):
 # -----------------------------
 # RPC (ZeroMQ REP)
 # -----------------------------
+def _sc_jog_move(axis: str, value: float) -> dict:
+    """1 bước jog; giữ _device_lock như lệnh lane device -> không có lệnh VM2030 khác chen giữa (completion nhận nhầm)."""
+    raw = build_move_axis_command(axis, value)
+    with _device_lock:
+        return exec_sc_operation(f"jog-{uuid.uuid4().hex[:8]}", f"MOVE_{axis}", raw, "jog",
+                                 {"axis": axis, "value": value}, wait=True, relay_side_effects=False)
+
+_sc_jog = JogStreamer(_sc_jog_move)
+
+def _parse_axis_value(payload: dict):
+    """(axis, value, error) từ payload {axis, value|distance}."""
+    axis = str(payload.get("axis", "")).upper()
+    if axis not in ("X", "Y"):
+        return axis, None, "Axis must be 'X' or 'Y'"
+    value = payload.get("value")
+    if value is None:
+        value = payload.get("distance")
+    if value is None:
+        return axis, None, "Value is missing in the payload"
+    try:
+        return axis, float(value), None
+    except (TypeError, ValueError):
+        return axis, None, f"Value must be a number. Received: {value}"
+
+def _collect_metrics():
+    with sc_rx_lock:
+        sc_rx = _sc_rx.stats()
+    return {"sc_rx": sc_rx, "sc_completions": _sc_completions.stats(),
+            "sc_tx": cmd_queue.stats() if cmd_queue is not None else None,
+            "sc_echo": {"enabled": _sc_echo_state["enabled"], **_sc_echo_stats},
+            "sc_orphans": _sc_completions.orphans(),
+            "transports": {k: (v.describe() if hasattr(v, "describe") else None)
+                           for k, v in (("BOARD_RELAY", ser), ("SOFTWARE_COMMAND", ser_cmd))},
+            "relay_async": _relay_exec.stats(),
+            "relay_ctl": {**_relay_ctl.stats(), "shadow": _relay_ctl.shadow()},
+            "relay_circuit": {str(sid): br.snapshot() for sid, br in _relay_breakers.items()},
+            "zmq_lanes": _zmq_frontend.stats() if _zmq_frontend is not None else None,
+            "async_ops": _async_ops.stats(),
+            "deadlines": dict(_deadline_stats),
+            "idempotency": _idempotency.stats(),
+            "single_flight": _single_flight.stats(),
+            "modbus": {**_modbus.stats(), "tuning": _modbus.tuning()},
+            "modbus_bus": _bus.stats(),
+            "register_snapshot": _regs.stats(),
+            "register_map": _register_map().describe(),
+            "slaves": _slaves_status(),
+            "relay_poll": _poll.stats(),
+            "sc_jog": _sc_jog.stats(),
+            "sc_retry": {**_sc_retry_stats, "latency_ewma_ms": {k: round(v, 3) for k, v in _sc_latency_ewma.items()}}}
+
 def handle_envelope(envelope):
     # Di chuyển các biến này lên đầu để tránh lỗi sử dụng trước khi gán giá trị
     store = _load_store()
@@ -1367,12 +2071,48 @@ def handle_envelope(envelope):
             raw = build_move_axis_command(axis, value)
             result = exec_sc_operation(message_id, f"MOVE_{axis}", raw, "ui", {"axis": axis, "value": value}, wait=True)
             if result.get("ok"):
-                return _ok(message_id, {"axis": axis, "value": value, "Sent": _sent_repr(raw)})
+                return _ok(message_id, {"axis": axis, "value": value, "Sent": _sent_repr(raw), **_op_reply_extras(result)})
             else:
-                return _err(message_id, f"Timeout {result.get('timeoutMs',0)} ms (lastCode={result.get('lastCode')})")
+                return _op_err(message_id, result)
         except Exception as e:
             return _err(message_id, f"MOVE_AXIS error: {e}")
 
+    # ----------------- JOG streaming (MOVE_AXIS không relay, latest-wins) -----------------
+    if cmd == "JOG_START":
+        sc_err = _ensure_sc_available_or_err(message_id)
+        if sc_err: return sc_err
+        link_err = _sc_link_error()
+        if link_err: return _err(message_id, link_err, not_executed=True)
+        _sc_jog.idle_timeout_ms = int(config.get("jog", {}).get("idle_timeout_ms", 5000))
+        try:
+            session = _sc_jog.start()
+        except RuntimeError as e:
+            return _err(message_id, str(e), not_executed=True)
+        return _ok(message_id, {"session": session, "idleTimeoutMs": _sc_jog.idle_timeout_ms})
+
+    if cmd == "JOG_UPDATE":
+        axis, value, perr = _parse_axis_value(payload)
+        if perr:
+            return _err(message_id, perr)
+        if not _sc_jog.active:
+            return _err(message_id, "JOG not started (send JOG_START first)")
+        try:
+            build_move_axis_command(axis, value)  # kiểm tra range ngay, không để worker báo lỗi muộn
+        except Exception as e:
+            return _err(message_id, f"JOG_UPDATE error: {e}")
+        try:
+            coalesced = _sc_jog.update(axis, value)
+        except RuntimeError as e:
+            return _err(message_id, str(e))
+        st = _sc_jog.stats()
+        return _ok(message_id, {"axis": axis, "value": value, "coalesced": coalesced,
+                                "Jog": {k: st[k] for k in ("session", "updates", "movesSent", "coalesced", "updateRateHz")}})
+
+    if cmd == "JOG_STOP":
+        flush = bool(payload.get("flush", True))
+        st = _sc_jog.stop(flush=flush, timeout_s=int(config.get("jog", {}).get("stop_timeout_ms", 5000)) / 1000.0)
+        return _ok(message_id, {"Jog": st})
+
     # ----------------- BUILTIN (HOME / RESET) -----------------
     if cmd == "BUILTIN_COMMAND":
         state = (payload.get("state") or "").strip()
@@ -1383,16 +2123,18 @@ def handle_envelope(envelope):
 
         try:
             raw = sc_build_home() if state == "rt_home" else sc_build_reset()
-            result = exec_sc_operation(message_id, state.upper(), raw, "ui", {"state": state}, wait=True)
+            # chờ DOING/FINISH ngắn để lỗi relay có mặt trong reply (nhánh "relay errors -> error reply")
+            result = exec_sc_operation(message_id, state.upper(), raw, "ui", {"state": state}, wait=True,
+                                       relay_join_ms=int(config.get("relay_async", {}).get("builtin_join_ms", 500)))
             if result.get("ok"):
                 # Check if there were relay errors even though VM2030 operation succeeded
                 if result.get("has_relay_errors", False):
                     error_msg = f"VM2030 operation succeeded but relay errors occurred: {'; '.join(result.get('relay_errors', []))}"
                     return _err(message_id, error_msg)
                 else:
-                    return _ok(message_id, {"state": state, "Sent": _sent_repr(raw)})
+                    return _ok(message_id, {"state": state, "Sent": _sent_repr(raw), **_op_reply_extras(result)})
             else:
-                return _err(message_id, f"Timeout {result.get('timeoutMs',0)} ms (lastCode={result.get('lastCode')})")
+                return _op_err(message_id, result)
         except Exception as e:
             return _err(message_id, f"BUILTIN_COMMAND error: {e}")
 
@@ -1401,7 +2143,7 @@ def handle_envelope(envelope):
         idx = int(payload.get("JobNumber") or payload.get("index") or 1)
         err = _ensure_sc_available_or_err(message_id)
         if err: return err
-        if not _is_ready_now(): return _err(message_id, "NOT_READY")
+        if not _is_ready_now(): return _err(message_id, "NOT_READY", not_executed=True)
         try:
             cached_tail = None
             if str(idx) in store.get("jobs", {}):
@@ -1433,9 +2175,9 @@ def handle_envelope(envelope):
 
             result = exec_sc_operation(message_id, "SET_JOB", raw, "ui", {"index": idx}, wait=True)
             if result.get("ok"):
-                return _ok(message_id, {"Id": job_id, "JobNumber": idx, "Sent": _sent_repr(raw)})
+                return _ok(message_id, {"Id": job_id, "JobNumber": idx, "Sent": _sent_repr(raw), **_op_reply_extras(result)})
             else:
-                return _err(message_id, f"Timeout {result.get('timeoutMs',0)} ms (lastCode={result.get('lastCode')})")
+                return _op_err(message_id, result)
 
         except Exception as e:
             return _err(message_id, f"SET_JOB error: {e}")
@@ -1480,60 +2222,37 @@ def handle_envelope(envelope):
                 }
                 return _ok(message_id, reply)
             
-            # Real mode - gửi xuống máy thật giống test_get_job_bridge.py
+            # Real mode - thu 2 segment (header + body) qua RX pipeline, deadline = get_job_ms
             if ser_cmd:
-                # TẮT reader thread tạm thời để tránh nó ăn mất dữ liệu
-                print("[GET_JOB] Temporarily disabling reader thread...")
-                _reader_thread_enabled.clear()  # Tắt reader thread
-                
-                try:
-                    job_cmd = f"%J{idx}_B\r".encode("ascii")
-                    print(f"[GET_JOB] Sending command: {job_cmd}")
-                    ser_cmd.reset_input_buffer()  # Clear buffer trước khi gửi
-                    ser_cmd.write(job_cmd)
-                    ser_cmd.flush()
-                    print("[GET_JOB] Command sent, waiting for response...")
-                    time.sleep(1.0)  # Tăng từ 0.5s lên 1.0s
-                    response = ser_cmd.read(512)  # Tăng từ 256 lên 512 bytes
-                    
-                    # Nếu không có dữ liệu, thử đọc thêm
-                    if len(response) == 0:
-                        print("[GET_JOB] No data received, trying again...")
-                        time.sleep(0.5)
-                        response = ser_cmd.read(512)
-                    
-                    print(f"[GET_JOB] Received from machine: {response}")
-                    log("debug", f"[GET_JOB] Received from machine: {response}")
-                finally:
-                    # BẬT LẠI reader thread cho các lệnh khác
-                    print("[GET_JOB] Re-enabling reader thread...")
-                    _reader_thread_enabled.set()  # Bật lại reader thread
-                
-                # Parse segments theo 0x1F như trong bridge
-                segments = response.split(b"\x1F")
-                print(f"[DEBUG] Total segments: {len(segments)}")
-                for i, seg in enumerate(segments):
-                    print(f"[DEBUG] Segment {i}: {seg}")
-                    
-                if len(segments) >= 3:
+                link_err = _sc_link_error()
+                if link_err: return _err(message_id, link_err, not_executed=True)
+                busy_err = _sc_wait_previous_op("GET_JOB")
+                if busy_err: return _err(message_id, busy_err, not_executed=True, deadline=True)
+                tout_cfg = int(config.get("timeouts",{}).get("get_job_ms", 4000))
+                tout = reqctx.clamp_ms(tout_cfg)
+                if tout <= 0: return _err(message_id, "DEADLINE_EXCEEDED: no time left before client deadline", not_executed=True, deadline=True)
+                t0 = time.monotonic()
+                header, body = sc_request_job_segments(message_id, idx, tout)
+                log("debug", f"[GET_JOB] header={header!r} body={body!r} "
+                             f"({int((time.monotonic()-t0)*1000)} ms)")
+
+                segments = [header, body]
+                if body:
                     # Parse body - tìm segment chứa dữ liệu job
                     body_segment = None
                     for i, seg in enumerate(segments):
                         seg_str = seg.decode(errors="replace")
                         if "J 20" in seg_str or seg_str.count("_") > 10:  # segment chứa nhiều _ là body
                             body_segment = seg_str
-                            print(f"[DEBUG] Using segment {i} as body: {seg_str}")
+                            log("debug", f"[GET_JOB] using segment {i} as body: {seg_str!r}")
                             break
                     
                     if not body_segment:
-                        body_segment = segments[2].decode(errors="replace")
-                        print(f"[DEBUG] Fallback to segment 2: {body_segment}")
+                        body_segment = body.decode(errors="replace")
+                        log("debug", f"[GET_JOB] fallback to segment 1: {body_segment!r}")
                     
                     body = body_segment.replace("\r","").strip()
                     tokens = [t.strip() for t in body.split("_")]
-                    # print(f"[DEBUG] Total tokens: {len(tokens)}")
-                    # for i, token in enumerate(tokens):
-                    #     print(f"[DEBUG] Token {i}: '{token}'")
                     
                     def get(idx, default=None):
                         return tokens[idx] if idx < len(tokens) else default
@@ -1567,8 +2286,8 @@ def handle_envelope(envelope):
                     direction_token2 = int(get(2, "0")) if get(2) and get(2).isdigit() else 0
                     direction_token21 = get(21, "")
                     direction_token22 = get(22, "")
-                    print(f"[DEBUG] Direction comparison: token2='{direction_token2}', token21='{direction_token21}', token22='{direction_token22}'")
-                    print(f"[DEBUG] Using Direction = {direction} from token2 (consistent with SET_JOB)")
+                    log("debug", f"[GET_JOB] Direction token2='{direction_token2}', token21='{direction_token21}', "
+                                 f"token22='{direction_token22}' -> {direction} (token2, như SET_JOB)")
                     
                     # CharacterString từ token 23 (loại bỏ \r và quotes thừa)
                     character_string = get(23, "")
@@ -1603,23 +2322,19 @@ def handle_envelope(envelope):
                         "ErrorMessage": ""
                     }
                     
-                    import json
-                    print("[GET_JOB] JSON Response:")
-                    print(json.dumps(reply, ensure_ascii=False, indent=2))
                     log_json("info", reply)
                     
                     return _ok(message_id, reply)
                 else:
                     reply = {
                         "IsError": True,
-                        "ErrorMessage": f"Không đủ dữ liệu (nhận {len(response)} bytes)"
+                        "ErrorMessage": f"Không đủ dữ liệu (nhận {len(header) + len(body)} bytes trong {tout} ms)"
                     }
                     log_json("error", reply)
-                    return _err(message_id, reply["ErrorMessage"])
+                    return _err(message_id, reply["ErrorMessage"], deadline=tout < tout_cfg)
             else:
-                print("[GET_JOB] SOFTWARE_COMMAND serial not available")
                 log("error", "[GET_JOB] SOFTWARE_COMMAND serial not available")
-                return _err(message_id, "SOFTWARE_COMMAND serial not available")
+                return _err(message_id, "SOFTWARE_COMMAND serial not available", not_executed=True)
 
         except Exception as e:
             return _err(message_id, f"GET_JOB error: {e}")
@@ -1629,7 +2344,7 @@ def handle_envelope(envelope):
         idx = int(payload.get("index", 1))
         cmdstr = str(payload.get("commandString","")).strip()
         if not cmdstr: return _err(message_id, "payload.commandString is required")
-        if not _is_ready_now(): return _err(message_id, "NOT_READY")
+        if not _is_ready_now(): return _err(message_id, "NOT_READY", not_executed=True)
         err = _ensure_sc_available_or_err(message_id)
         if err: return err
         try:
@@ -1639,9 +2354,9 @@ def handle_envelope(envelope):
             raw = sc_build_set_sequence(idx, cmdstr)
             result = exec_sc_operation(message_id, "SET_SEQUENCE", raw, "ui", {"index": idx}, wait=True)
             if result.get("ok"):
-                return _ok(message_id, {"index": idx, "Sent": _sent_repr(raw)})
+                return _ok(message_id, {"index": idx, "Sent": _sent_repr(raw), **_op_reply_extras(result)})
             else:
-                return _err(message_id, f"Timeout {result.get('timeoutMs',0)} ms (lastCode={result.get('lastCode')})")
+                return _op_err(message_id, result)
         except Exception as e:
             return _err(message_id, f"SET_SEQUENCE error: {e}")
 
@@ -1652,27 +2367,26 @@ def handle_envelope(envelope):
     # ----------------- START_SEQUENCE -----------------
     if cmd == "START_SEQUENCE":
         idx = int(payload.get("index", 1))
-        if not _is_ready_now(): return _err(message_id, "NOT_READY")
+        if not _is_ready_now(): return _err(message_id, "NOT_READY", not_executed=True)
         err = _ensure_sc_available_or_err(message_id)
         if err: return err
         try:
             raw = sc_build_start_sequence(idx)
             print(f"[START_SEQUENCE] Sending sequence {idx}, waiting for 0x1F completion...")
-            print(f"[START_SEQUENCE] Reader thread enabled: {_reader_thread_enabled.is_set()}")
             result = exec_sc_operation(message_id, "START_SEQUENCE", raw, "ui", {"index": idx}, wait=True)
             if result.get("ok"):
                 print(f"[START_SEQUENCE] Sequence {idx} completed successfully (received 0x1F)")
-                return _ok(message_id, {"index": idx, "Sent": _sent_repr(raw)})
+                return _ok(message_id, {"index": idx, "Sent": _sent_repr(raw), **_op_reply_extras(result)})
             else:
                 print(f"[START_SEQUENCE] Sequence {idx} timed out, lastCode={result.get('lastCode')}")
-                return _err(message_id, f"Timeout {result.get('timeoutMs',0)} ms (lastCode={result.get('lastCode')})")
+                return _op_err(message_id, result)
         except Exception as e:
             return _err(message_id, f"START_SEQUENCE error: {e}")
 
     # ----------------- TOGGLE_ECHO -----------------
     if cmd == "TOGGLE_ECHO":
         echo_enabled = payload.get("echo_enabled", False)
-        if not _is_ready_now(): return _err(message_id, "NOT_READY")
+        if not _is_ready_now(): return _err(message_id, "NOT_READY", not_executed=True)
         err = _ensure_sc_available_or_err(message_id)
         if err: return err
         try:
@@ -1680,26 +2394,27 @@ def handle_envelope(envelope):
            
             result = exec_sc_operation(message_id, "TOGGLE_ECHO", raw, "ui", {"echo_enabled": echo_enabled}, wait=True)
             if result.get("ok"):
+                _sc_echo_state["enabled"] = bool(echo_enabled)
                 echo_status = "enabled" if echo_enabled else "disabled"
-                return _ok(message_id, {"echo_enabled": echo_enabled, "status": f"Echo {echo_status}", "Sent": _sent_repr(raw)})
+                return _ok(message_id, {"echo_enabled": echo_enabled, "status": f"Echo {echo_status}", "Sent": _sent_repr(raw), **_op_reply_extras(result)})
             else:
-                return _err(message_id, f"Timeout {result.get('timeoutMs',0)} ms (lastCode={result.get('lastCode')})")
+                return _op_err(message_id, result)
         except Exception as e:
             return _err(message_id, f"TOGGLE_ECHO error: {e}")
 
     # ----------------- START_JOB -----------------
     if cmd == "START_JOB":
         idx = int(payload.get("index", 1))
-        if not _is_ready_now(): return _err(message_id, "NOT_READY")
+        if not _is_ready_now(): return _err(message_id, "NOT_READY", not_executed=True)
         err = _ensure_sc_available_or_err(message_id)
         if err: return err
         try:
             raw = sc_build_start_job(idx)
             result = exec_sc_operation(message_id, "START_JOB", raw, "ui", {"index": idx}, wait=True)
             if result.get("ok"):
-                return _ok(message_id, {"index": idx, "Sent": _sent_repr(raw)})
+                return _ok(message_id, {"index": idx, "Sent": _sent_repr(raw), **_op_reply_extras(result)})
             else:
-                return _err(message_id, f"Timeout {result.get('timeoutMs',0)} ms (lastCode={result.get('lastCode')})")
+                return _op_err(message_id, result)
         except Exception as e:
             return _err(message_id, f"START_JOB error: {e}")
 
@@ -1707,26 +2422,65 @@ def handle_envelope(envelope):
     if cmd == "GET_READY_STATUS":
         try:
             dev = config["devices"]["BOARD_RELAY"]
-            values = read_holding_registers(dev.get("slave_id",1), dev["read_settings"]["start_address"], dev["read_settings"]["num_registers"])
-            if values is None: return _err(message_id, "Read timeout/CRC error")
+            values = _read_signals_cached("ready_status", ("Ready",), priority="ready")
+            if _read_failed(values): return _err(message_id, _read_error_message(values))
             summary = make_state_summary(values, dev, config, _ts_local())
             return _ok(message_id, {"isReady": bool(summary.get("states",{}).get("Ready",0))})
         except Exception as e:
             return _err(message_id, e)
 
     if cmd == "GET_POSITION":
-        pos_cfg = config.get("app", {}).get("position", {})
-        xi = int(pos_cfg.get("x_index", 0)); yi = int(pos_cfg.get("y_index", 1)); scale = float(pos_cfg.get("scale", 1.0))
         try:
-            dev = config["devices"]["BOARD_RELAY"]
-            values = read_holding_registers(dev.get("slave_id",1), dev["read_settings"]["start_address"], dev["read_settings"]["num_registers"])
-            if values is None: return _err(message_id, "Read timeout/CRC error")
-            x = (values[xi] if 0 <= xi < len(values) else 0) * scale
-            y = (values[yi] if 0 <= yi < len(values) else 0) * scale
-            return _ok(message_id, {"X": x, "Y": y})
+            # X/Y (địa chỉ, kiểu, scale) theo register_map
+            values = _read_signals_cached("position", ("X", "Y"))
+            if _read_failed(values): return _err(message_id, _read_error_message(values))
+            return _ok(message_id, {"X": values["X"], "Y": values["Y"]})
         except Exception as e:
             return _err(message_id, e)
 
+    # ----------------- METRICS -----------------
+    if cmd == "GET_METRICS":
+        try:
+            return _ok(message_id, _collect_metrics())
+        except Exception as e:
+            return _err(message_id, f"GET_METRICS error: {e}")
+
+    if cmd == "GET_SLAVES":
+        # Slave trên bus BOARD_RELAY: giá trị signal mới nhất (slave phụ) + thống kê bus/poll theo slave
+        try:
+            return _ok(message_id, _slaves_status())
+        except Exception as e:
+            return _err(message_id, f"GET_SLAVES error: {e}")
+
+    if cmd == "GET_LINK_STATUS":
+        relay_dev = config["devices"]["BOARD_RELAY"]
+        relay_sid = relay_dev.get("slave_id", 1)
+        return _ok(message_id, {"SOFTWARE_COMMAND": {
+            "dry_run": bool(config["devices"]["SOFTWARE_COMMAND"].get("dry_run", False)),
+            "connected": ser_cmd is not None,
+            **_sc_link.snapshot()},
+            "BOARD_RELAY": {
+            "dry_run": bool(relay_dev.get("dry_run", False)),
+            "connected": ser is not None,
+            "quality": _modbus.quality(relay_sid),
+            "circuit": _relay_breaker(relay_sid).snapshot(),
+            "slaves": {str(sid): br.snapshot() for sid, br in _relay_breakers.items() if sid != relay_sid}}})
+
+    # ----------------- ASYNC OPS -----------------
+    if cmd in ("GET_OP_RESULT", "WAIT_OP"):
+        op_id = str(payload.get("opId") or "")
+        if not op_id: return _err(message_id, "opId is required")
+        if cmd == "WAIT_OP":
+            max_wait = float(config.get("async_ops", {}).get("max_wait_ms", 30000))
+            try: wait_ms = min(max(0.0, float(payload.get("timeoutMs", 5000))), max_wait)
+            except (TypeError, ValueError): return _err(message_id, f"timeoutMs must be a number. Received: {payload.get('timeoutMs')}")
+            wait_ms = reqctx.clamp_ms(wait_ms)  # không chờ quá deadline của envelope
+            op = _async_ops.wait(op_id, wait_ms / 1000.0)
+        else:
+            op = _async_ops.get(op_id)
+        if op is None: return _err(message_id, f"Unknown opId '{op_id}' (expired or never submitted)")
+        return _ok(message_id, op)
+
     # ----------------- LOG LEVEL -----------------
     if cmd == "SET_LOG_LEVEL":
         level = str(payload.get("level","info")).lower()
@@ -1791,12 +2545,189 @@ def handle_envelope(envelope):
 
     return _err(message_id, f"Unknown command '{cmd}'")
 
+# Lệnh không chạm VM2030 / relay: trả lời trên lane "fast" (song song), còn lại vào lane "device" (tuần tự)
+# JOG_UPDATE / JOG_STOP chỉ đổi trạng thái JogStreamer (worker jog tự giữ _device_lock khi gửi): nhả nút
+# không phải chờ sau START_JOB dài
+FAST_LANE_COMMANDS = {"GET_READY_STATUS", "GET_POSITION", "GET_METRICS", "GET_SLAVES", "GET_LINK_STATUS",
+                      "SET_LOG_LEVEL", "SET_DRY_RUN_STATE", "GET_DRY_RUN_STATE", "GET_SEQUENCE",
+                      "GET_OP_RESULT", "JOG_UPDATE", "JOG_STOP"}
+# Lệnh chờ lâu nhưng không chạm thiết bị (WAIT_OP chờ tới max_wait_ms): lane "wait" riêng để không chiếm
+# worker của lane "fast"
+WAIT_LANE_COMMANDS = {"WAIT_OP"}
+# Không giữ _device_lock, không async, không qua idempotency cache
+_NO_DEVICE_COMMANDS = FAST_LANE_COMMANDS | WAIT_LANE_COMMANDS
+# Lệnh đọc: request giống hệt nhau đến đồng thời dùng chung 1 giao dịch thiết bị (single-flight).
+# GET_JOB chạy trên lane "read" (nhiều worker, leader vẫn giữ _device_lock) để các request trùng gặp nhau được
+COALESCED_READ_COMMANDS = {"GET_JOB", "GET_READY_STATUS", "GET_POSITION"}
+READ_LANE_COMMANDS = {"GET_JOB"}
+
+# Lệnh thiết bị chạy tuần tự dù đến từ lane "device" hay từ worker async_ops
+_device_lock = threading.Lock()
+
+def _run_envelope(envelope):
+    """Chạy lệnh trong scope deadline của envelope; lệnh thiết bị giữ _device_lock (chờ lock không quá deadline)."""
+    cmd = str(envelope.get("command") or "").upper().strip()
+    corr = envelope.get("messageId") or str(uuid.uuid4())
+    try:
+        deadline = reqctx.deadline_from_envelope(envelope)
+    except (TypeError, ValueError):
+        return _err(corr, "deadline / timeoutMs must be numbers")
+    if deadline is not None:
+        _deadline_stats["requests"] += 1
+    with reqctx.scope(deadline):
+        if cmd in _NO_DEVICE_COMMANDS:
+            return handle_envelope(envelope)
+        rem = reqctx.remaining_ms()
+        if rem is not None and rem <= 0:
+            _deadline_stats["refused_expired"] += 1
+            return _err(corr, f"DEADLINE_EXCEEDED: {cmd} not started, client deadline already passed", not_executed=True, deadline=True)
+        if not _device_lock.acquire(timeout=-1 if rem is None else rem / 1000.0):
+            _deadline_stats["lane_wait_expired"] += 1
+            return _err(corr, f"DEADLINE_EXCEEDED: {cmd} not started, device lane busy until client deadline", not_executed=True, deadline=True)
+        try:
+            if reqctx.expired():
+                _deadline_stats["refused_expired"] += 1
+                return _err(corr, f"DEADLINE_EXCEEDED: {cmd} not started, client deadline already passed", not_executed=True, deadline=True)
+            return handle_envelope(envelope)
+        finally:
+            _device_lock.release()
+
+_async_ops = AsyncOps(_run_envelope, log=log)  # main tạo lại theo config "async_ops"
+
+def _wants_async(envelope) -> bool:
+    """"async": true ở envelope, hoặc payload.waitComplete = false (tester.py gửi waitComplete)."""
+    if envelope.get("async") is True:
+        return True
+    payload = envelope.get("payload")
+    return isinstance(payload, dict) and payload.get("waitComplete") is False
+
+_zmq_frontend = None  # LanedRouter khi zeromq.frontend.mode = "router"
+
+# Reply theo messageId của lệnh thiết bị: client gửi lại -> trả reply cũ / gắn vào lần chạy đang dở
+_idempotency = IdempotencyCache()  # main tạo lại theo config "idempotency"
+
+_single_flight = SingleFlight()  # main tạo lại theo config "single_flight"
+
+def _coalesce_key(name, payload) -> str:
+    if name == "GET_JOB":
+        try: return f"GET_JOB:{int(payload.get('JobNumber') or payload.get('index') or 1)}"
+        except (TypeError, ValueError): pass
+    return f"{name}:{json.dumps(payload, sort_keys=True, default=str)}"
+
+def _deadline_wait_s(cmd):
+    """Thời gian còn lại tới envelope "deadline" (giây), None nếu không có."""
+    try: return (float(cmd["deadline"]) - time.time() * 1000.0) / 1000.0 if cmd.get("deadline") is not None else None
+    except (TypeError, ValueError): return None
+
+def _reply_cacheable(reply) -> bool:
+    # lỗi "chưa chạy" (NotExecuted: từ chối trước khi gửi thiết bị): không lưu, lần gửi lại được chạy thật
+    return not (reply.get("IsError") and reply.get("NotExecuted"))
+
+def _dispatch(cmd, name):
+    if name not in _NO_DEVICE_COMMANDS and _wants_async(cmd):
+        # trả opId ngay, kết quả lấy qua GET_OP_RESULT / WAIT_OP
+        corr = cmd.get("messageId") or str(uuid.uuid4())
+        try:
+            op = _async_ops.submit(cmd)
+        except queue.Full:
+            return _err(corr, f"BUSY: async queue full ({_async_ops.stats()['capacity']})", not_executed=True)
+        return _ok(corr, {k: op[k] for k in ("opId", "command", "status")})
+    if name in COALESCED_READ_COMMANDS:
+        corr = cmd.get("messageId") or str(uuid.uuid4())
+        payload = cmd.get("payload") if isinstance(cmd.get("payload"), dict) else {}
+        # lỗi do deadline của leader (DeadlineExceeded: not started, DEADLINE_INFEASIBLE, GET_JOB bị kẹp ngắn...)
+        # không phải kết quả của follower; mọi lỗi khác (link down, timeout thật của máy) được chia như reply thường
+        for _ in range(2):
+            reply, shared = _single_flight.do(name, _coalesce_key(name, payload), lambda: _run_envelope(cmd),
+                                              wait_s=_deadline_wait_s(cmd))
+            if reply is None:
+                return _err(corr, f"DEADLINE_EXCEEDED: shared {name} still running at client deadline", not_executed=True, deadline=True)
+            if not (shared and reply.get("IsError") and reply.get("DeadlineExceeded")):
+                return {**reply, "CorrelationId": corr} if shared else reply
+            # chạy lại: các follower cùng key bầu leader mới; lần 2 vẫn vậy thì tự chạy
+            log("debug", f"[SINGLE_FLIGHT] {name}: leader error not shared ({reply.get('ErrorMessage')}), re-running")
+        return _run_envelope(cmd)
+    return _run_envelope(cmd)
+
+def _request_lane(raw: bytes) -> str:
+    try:
+        cmd = json.loads(raw.decode("utf-8"))
+        name = str(cmd.get("command") or "").upper().strip() if isinstance(cmd, dict) else ""
+    except Exception:
+        name = ""
+    if name in FAST_LANE_COMMANDS: return "fast"
+    if name in WAIT_LANE_COMMANDS: return "wait"
+    return "read" if name in READ_LANE_COMMANDS else "device"
+
+def _error_reply_json(raw, message) -> str:
+    corr = str(uuid.uuid4())
+    try: parsed = json.loads(raw.decode("utf-8")) if raw else {}
+    except: parsed = {}
+    if isinstance(parsed, dict) and parsed.get("messageId"): corr = parsed["messageId"]
+    return json.dumps(_err(corr, message), ensure_ascii=False)
+
+def _process_request(raw: bytes, received_at: float = None) -> str:
+    """
+    1 request JSON (bytes) -> reply JSON (str). Dùng chung cho REP và ROUTER front-end.
+    received_at: time.monotonic() lúc front-end nhận (envelope "timeoutMs" tính từ đó).
+    """
+    try:
+        raw_json = raw.decode("utf-8")
+        cmd = json.loads(raw_json)
+        
+        # Log ZMQ request đến Seq với structured data (chỉ khi seq_logging=True)
+        if seq_logger and _HAS_SEQ_LOGGER and config.get("seq_logging", True):
+            log_zmq_request(seq_logger, 
+                           command=cmd.get("command", "unknown"),
+                           message_id=cmd.get("messageId", "unknown"),
+                           payload_size=len(raw_json),
+                           target_device=cmd.get("targetDevice", "unknown"))
+        
+        # Log JSON request từ UI
+        log("warn", f"[CONTROLLER] JSON Request: {raw_json}",
+            RequestType="ZMQOperation", 
+            ZMQRequest=True,
+            Command=cmd.get("command", "unknown"),
+            MessageID=cmd.get("messageId", "unknown"),
+            PayloadSize=len(raw_json),
+            ClientRequest=True)
+        
+        if not isinstance(cmd, dict): cmd = {}
+        name = str(cmd.get("command") or "").upper().strip()
+        if cmd.get("timeoutMs") is not None and cmd.get("deadline") is None:
+            # quy "timeoutMs" về "deadline" tuyệt đối: thời gian chờ trong lane / hàng đợi async được tính vào
+            try:
+                d = reqctx.deadline_from_envelope(cmd, received_at)
+                cmd["deadline"] = time.time() * 1000.0 + (d - time.monotonic()) * 1000.0
+            except (TypeError, ValueError):
+                pass  # _run_envelope trả lỗi
+        if name in _NO_DEVICE_COMMANDS or not cmd.get("messageId"):
+            reply = _dispatch(cmd, name)
+        else:
+            # bản gửi lại chờ bản gốc tối đa tới deadline của chính nó (không có deadline: chờ tới khi xong)
+            reply, status = _idempotency.run(f"{name}:{cmd['messageId']}", lambda: _dispatch(cmd, name),
+                                             store=_reply_cacheable, wait_s=_deadline_wait_s(cmd))
+            if status != MISS:
+                log("info", f"[IDEMPOTENCY] duplicate {name} messageId={cmd['messageId']}: {status}")
+            if reply is None:
+                reply = _err(cmd["messageId"], f"DUPLICATE_IN_FLIGHT: original {name} still running")
+        reply_json = json.dumps(reply, ensure_ascii=False)
+        log("debug", f"RPC handled: {cmd.get('command') or 'unknown'}")
+        return reply_json
+    except Exception as e:
+        log("error", f"RPC error: {e}")
+        return _error_reply_json(raw, str(e))
+
 def zmq_rep_server(stop_event, cfg):
+    zcfg = cfg.get("zeromq",{})
+    fcfg = zcfg.get("frontend", {})
+    if str(fcfg.get("mode", "router")).lower() == "router":
+        return zmq_router_server(stop_event, cfg)
     ctx = zmq.Context.instance()
     sock = ctx.socket(zmq.REP)
-    rep_bind = cfg.get("zeromq",{}).get("rep_bind","tcp://*:5555")
-    sock.RCVTIMEO = int(cfg.get("zeromq",{}).get("rcv_timeout_ms",1000))
-    sock.SNDTIMEO = int(cfg.get("zeromq",{}).get("snd_timeout_ms",1000))
+    rep_bind = zcfg.get("rep_bind","tcp://*:5555")
+    sock.RCVTIMEO = int(zcfg.get("rcv_timeout_ms",1000))
+    sock.SNDTIMEO = int(zcfg.get("snd_timeout_ms",1000))
     sock.bind(rep_bind)
     log("debug", f"[CONTROLLER] REP server bound at {rep_bind}")
     try:
@@ -1808,55 +2739,33 @@ def zmq_rep_server(stop_event, cfg):
                 continue
             except Exception as e:
                 log("error", f"[CONTROLLER] recv error: {e}"); continue
-            try:
-                raw_json = raw.decode("utf-8")
-                cmd = json.loads(raw_json)
-                
-                # Log ZMQ request đến Seq với structured data (chỉ khi seq_logging=True)
-                if seq_logger and _HAS_SEQ_LOGGER and config.get("seq_logging", True):
-                    log_zmq_request(seq_logger, 
-                                   command=cmd.get("command", "unknown"),
-                                   message_id=cmd.get("messageId", "unknown"),
-                                   payload_size=len(raw_json),
-                                   target_device=cmd.get("targetDevice", "unknown"))
-                
-                # Log JSON request từ UI
-                log("warn", f"[CONTROLLER] JSON Request: {raw_json}",
-                    RequestType="ZMQOperation", 
-                    ZMQRequest=True,
-                    Command=cmd.get("command", "unknown"),
-                    MessageID=cmd.get("messageId", "unknown"),
-                    PayloadSize=len(raw_json),
-                    ClientRequest=True)
-                
-                reply = handle_envelope(cmd if isinstance(cmd, dict) else {})
-                reply_json = json.dumps(reply, ensure_ascii=False)
-                
-                # Response được gửi về client (không log trong dry-run)
-                # log("warn", f"[CONTROLLER] Response sent: {reply_json}", 
-                #     RequestType="ZMQOperation",
-                #     ZMQResponse=True, 
-                #     MessageID=cmd.get("messageId", "unknown"),
-                #     IsError=reply.get("IsError", False),
-                #     Command=cmd.get("command", "unknown"),
-                #     ResponseSize=len(reply_json),
-                #     ProcessingSuccess=True)
-                
-                sock.send_string(reply_json)
-                if isinstance(cmd, dict): log("debug", f"RPC handled: {cmd.get('command') or 'unknown'}")
-            except Exception as e:
-                corr = str(uuid.uuid4())
-                try: parsed = json.loads(raw.decode("utf-8")) if raw else {}
-                except: parsed = {}
-                if isinstance(parsed, dict) and parsed.get("messageId"): corr = parsed["messageId"]
-                err = _err(corr, str(e))
-                try: sock.send_string(json.dumps(err, ensure_ascii=False))
-                except: pass
-                log("error", f"RPC error: {e}")
+            reply_json = _process_request(raw, time.monotonic())
+            try: sock.send_string(reply_json)
+            except Exception as e: log("error", f"[CONTROLLER] send error: {e}")
     finally:
         try: sock.close(0)
         except: pass
 
+def zmq_router_server(stop_event, cfg):
+    """
+    ROUTER front-end (zeromq.frontend.mode = "router"): lane "device" 1 worker (lệnh VM2030/relay
+    tuần tự), lane "fast" nhiều worker (FAST_LANE_COMMANDS) -> truy vấn không bị kẹt sau START_JOB,
+    lane "read" (READ_LANE_COMMANDS) nhiều worker để GET_JOB trùng nhau được single-flight gộp lại,
+    lane "wait" (WAIT_LANE_COMMANDS) cho WAIT_OP: client chờ op dài không làm cạn worker lane "fast".
+    Client REQ hiện có dùng được nguyên.
+    """
+    global _zmq_frontend
+    zcfg = cfg.get("zeromq",{})
+    fcfg = zcfg.get("frontend", {})
+    _zmq_frontend = LanedRouter(
+        zcfg.get("rep_bind","tcp://*:5555"), _process_request, _request_lane,
+        {"device": {"workers": 1, "queue": int(fcfg.get("device_queue", 64))},
+         "fast": {"workers": int(fcfg.get("fast_workers", 4)), "queue": int(fcfg.get("fast_queue", 256))},
+         "read": {"workers": int(fcfg.get("read_workers", 4)), "queue": int(fcfg.get("read_queue", 64))},
+         "wait": {"workers": int(fcfg.get("wait_workers", 8)), "queue": int(fcfg.get("wait_queue", 64))}},
+        _error_reply_json, log=log)
+    _zmq_frontend.serve(stop_event)
+
 # -----------------------------
 # Main
 # -----------------------------
@@ -1925,26 +2834,67 @@ if __name__ == "__main__":
             ApplicationEvent="DeviceSetup", Device="BOARD_RELAY", DryRun=True)
         ser = None
     else:
-        if not dev.get("com_port"):
+        endpoint = transport_endpoint(dev)
+        if not endpoint:
             print("BOARD_RELAY chưa có COM. Cấu hình lại rồi chạy tiếp.")
             exit(1)
         try:
-            ser = serial.Serial(dev["com_port"], dev.get("baud_rate",9600), parity=serial.PARITY_NONE,
-                                stopbits=serial.STOPBITS_ONE, timeout=1)
-            log("info", f"Kết nối tới {dev['com_port']} (BOARD_RELAY) thành công.",
+            ser = open_transport("BOARD_RELAY", dev)
+            log("info", f"Kết nối tới {endpoint} (BOARD_RELAY, {transport_type(dev)}) thành công.",
                 ApplicationEvent="DeviceSetup", Device="BOARD_RELAY", 
-                COMPort=dev["com_port"], BaudRate=dev.get("baud_rate",9600),
+                COMPort=endpoint, BaudRate=dev.get("baud_rate",9600),
                 ConnectionSuccess=True)
         except Exception as e:
-            log("error", f"Lỗi mở cổng {dev.get('com_port')}: {e}",
+            log("error", f"Lỗi mở cổng {endpoint}: {e}",
                 ApplicationEvent="DeviceSetup", Device="BOARD_RELAY",
-                COMPort=dev.get('com_port'), ConnectionError=str(e))
+                COMPort=endpoint, ConnectionError=str(e))
             exit(1)
 
     # Open SOFTWARE_COMMAND (VM2030) — optional when dry_run=true
     sc_cfg = config["devices"]["SOFTWARE_COMMAND"]
-    ser_cmd = open_serial_for("SOFTWARE_COMMAND", config) if sc_cfg.get("com_port") else None
-    cmd_queue = Queue()
+    ser_cmd = open_serial_for("SOFTWARE_COMMAND", config) if transport_endpoint(sc_cfg) else None
+    cmd_queue = PriorityTxQueue(sc_cfg.get("tx_queue", {}))
+    rx_cfg = sc_cfg.get("rx_buffer", {})
+    _sc_rx = ScRxPipeline(capacity=int(rx_cfg.get("capacity", 4096)),
+                          max_frames=int(rx_cfg.get("max_frames", 64)))
+    _sc_rx.sink = _sc_on_frame
+    _sc_echo_state["enabled"] = bool(sc_cfg.get("echo_verify", {}).get("assume_echo_on", False))
+    _sc_link = LinkHealth(fail_threshold=int(sc_cfg.get("link_health", {}).get("fail_threshold", 2)))
+    _relay_exec = RelayExecutor(enabled=bool(config.get("relay_async", {}).get("enabled", True)))
+    _ao = config.get("async_ops", {})
+    _async_ops = AsyncOps(_run_envelope, max_results=int(_ao.get("max_results", 1024)),
+                          ttl_ms=float(_ao.get("ttl_ms", 600000)), max_pending=int(_ao.get("max_pending", 64)), log=log)
+    _single_flight = SingleFlight(enabled=bool(config.get("single_flight", {}).get("enabled", True)))
+    _ic = config.get("idempotency", {})
+    _idempotency = IdempotencyCache(max_entries=int(_ic.get("max_entries", 1024)), ttl_ms=float(_ic.get("ttl_ms", 300000)),
+                                    enabled=bool(_ic.get("enabled", True)))
+    _rs = dev.get("read_settings", {})
+    _poll = PollScheduler(idle_ms=float(_rs.get("interval_ms", 500)),
+                          active_ms=float(_rs.get("active_interval_ms", 100)),
+                          active_hold_ms=float(_rs.get("active_hold_ms", 2000)),
+                          backoff_factor=float(_rs.get("backoff_factor", 2.0)),
+                          backoff_max_ms=float(_rs.get("backoff_max_ms", 5000)),
+                          active_fn=lambda: _sc_completions.pending_count() > 0 or _sc_jog.active)
+    _rc = dev.get("relay_coalesce", {})
+    _relay_ctl = RelayController(_relay_ctl_write, channels=RELAY_COUNT,
+                                 window_ms=float(_rc.get("window_ms", 5)) if _rc.get("enabled", True) else 0.0,
+                                 shadow_ttl_ms=float(_rc.get("shadow_ttl_ms", 30000)),
+                                 suppress=bool(_rc.get("enabled", True)))
+    _mt = dev.get("timing", {})
+    _modbus = ModbusTransactor(lambda: ser, ser_lock, int(dev.get("baud_rate", 9600)),
+                               char_bits=int(_mt.get("char_bits", 11)),
+                               response_timeout_ms=float(_mt.get("response_timeout_ms", 200)),
+                               min_gap_ms=float(_mt.get("min_gap_ms", 1.75)),
+                               adaptive=_mt.get("adaptive"))
+    _regmap = RegisterMap.from_config(dev, config.get("app", {}))
+    warm_frame_cache(int(dev.get("slave_id", 1)))
+    for _start, _count in _regmap.plan(_regmap.names()) + tuple(r for g in _regmap.groups for r in _regmap.plan(_regmap.names([g]))):
+        read_holding_frame(int(dev.get("slave_id", 1)), _start, _count)
+    log("info", f"[BOARD_RELAY] register_map: {_regmap.describe()['groups']}")
+    _slaves = _build_slaves(dev, config.get("app", {}))
+    for _name, _sl in _slaves.items():
+        log("info", f"[BOARD_RELAY:{_name}] slave {_sl['slave_id']} poll {_sl['poll'].idle_s * 1000:.0f} ms, "
+                    f"plan {_sl['map'].describe()['full_plan']}")
 
     stop_event = threading.Event()
     last_values = {"values": None}; error_count = {"count": 0}
@@ -1952,15 +2902,21 @@ if __name__ == "__main__":
     # Threads
     t_read_relay = threading.Thread(target=background_read, args=(stop_event,last_values,error_count,dev), daemon=True)
     t_read_relay.start()
+    t_slaves = [threading.Thread(target=slave_poll_loop, args=(stop_event, _name), daemon=True) for _name in _slaves]
+    for _t in t_slaves: _t.start()
 
     t_sc_writer = None
     t_sc_reader = None
+    t_sc_link = None
     if ser_cmd is not None:
         t_sc_writer = threading.Thread(target=software_command_writer, args=(stop_event, ser_cmd, cmd_queue, config), daemon=True)
         t_sc_writer.start()
         # BẬT LẠI reader thread với cơ chế control cho GET_JOB
         t_sc_reader = threading.Thread(target=software_command_reader, args=(stop_event, ser_cmd, config), daemon=True)
         t_sc_reader.start()
+        if sc_cfg.get("link_health", {}).get("enabled", True):
+            t_sc_link = threading.Thread(target=sc_link_monitor, args=(stop_event, config), daemon=True)
+            t_sc_link.start()
 
     t_rep = threading.Thread(target=zmq_rep_server, args=(stop_event, config), daemon=True)
     t_rep.start()
@@ -1970,8 +2926,10 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         log("info","Đang dừng chương trình...")
         stop_event.set()
-        for t in [t_read_relay, t_sc_writer, t_sc_reader, t_rep]:
+        for t in [t_read_relay, t_sc_writer, t_sc_reader, t_sc_link, t_rep, *t_slaves]:
             if t and hasattr(t,"is_alive") and t.is_alive(): t.join(timeout=1)
+        _relay_exec.shutdown(wait=False)
+        _bus.stop()
     finally:
         try:
             if ser: ser.close()
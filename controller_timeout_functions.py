@@ -5,72 +5,80 @@ Các hàm timeout từ controller.py - Documentation và Usage
 
 import time
 import threading
-from typing import Dict, Any, Tuple
+from typing import Dict, Any, Tuple, Optional
+
+from sc_completion import CompletionRegistry, CompletionFuture
+
+# Registry của controller (controller._sc_completions): RX path của controller gọi resolve() khi nhận
+# 0x1F/0x87. Không tạo registry riêng ở đây (không ai resolve -> mọi waiter chờ tới timeout);
+# gọi bind_registry(controller._sc_completions) trước khi dùng các hàm bên dưới.
+completions: Optional[CompletionRegistry] = None
+
+def bind_registry(registry: CompletionRegistry):
+    global completions
+    completions = registry
+
+def _registry() -> CompletionRegistry:
+    if completions is None:
+        raise RuntimeError("completion registry not bound: call bind_registry(controller._sc_completions) first")
+    return completions
 
 # =============================================================================
 # CÁC HÀM TIMEOUT HIỆN TẠI TRONG CONTROLLER
 # =============================================================================
 
-def sc_wait_complete(timeout_ms: int) -> Dict[str, Any]:
+def sc_wait_complete(timeout_ms: int, future: CompletionFuture = None) -> Dict[str, Any]:
     """
-    Đợi completion signal (0x1F) từ VM2030 trong thời gian timeout
+    Đợi completion signal (0x1F/0x87) của một operation trong thời gian timeout.
+    Không polling: waiter block trên future và được đánh thức ngay khi RX path resolve.
     
     Args:
         timeout_ms: Timeout in milliseconds
+        future: Future đã đăng ký bằng completions.register(op_id) TRƯỚC khi gửi lệnh
         
     Returns:
-        {"ok": True, "code": 0x1F} nếu thành công
-        {"ok": False, "code": last_code} nếu timeout
+        {"ok": True, "code": 0x1F, "latencyMs": ...} nếu thành công
+        {"ok": False, "code": None} nếu timeout
         
     Usage:
-        result = sc_wait_complete(20000)  # Đợi 20 giây
+        fut = completions.register("op-123")
+        # send_raw_to_software_command(raw)
+        result = sc_wait_complete(20000, fut)  # Đợi tối đa 20 giây
         if result["ok"]:
             print("Command completed successfully")
         else:
             print(f"Timeout! Last code: {result['code']}")
     """
-    end = time.time() + (timeout_ms/1000.0)
-    last = None
-    while time.time() < end:
-        # with sc_rx_lock:
-        #     last = _last_status_code["code"]
-        # if last == 0x1F:
-        #     return {"ok": True, "code": last}
-        time.sleep(0.02)
-    return {"ok": False, "code": last}
+    if future is None:
+        future = _registry().register(f"wait-{time.monotonic_ns()}")
+    if future.wait(timeout_ms/1000.0):
+        return {"ok": True, "code": future.code, "latencyMs": future.latency_ms()}
+    _registry().cancel(future.op_id)
+    return {"ok": False, "code": None}
 
-def sc_read_until_complete_collect(timeout_ms: int) -> bytes:
+def sc_read_until_complete_collect(timeout_ms: int, future: CompletionFuture = None) -> bytes:
     """
-    Thu thập toàn bộ data từ VM2030 cho đến khi nhận completion signal hoặc timeout
+    Thu thập payload của frame kết thúc bằng completion signal của operation, hoặc timeout
     
     Args:
         timeout_ms: Timeout in milliseconds
+        future: Future đã đăng ký (expected_codes=(0x1F,)) TRƯỚC khi gửi lệnh
         
     Returns:
-        bytes: Data đã nhận (không bao gồm 0x1F completion byte)
+        bytes: Data đã nhận (không bao gồm 0x1F completion byte), b"" nếu timeout
         
     Usage:
-        data = sc_read_until_complete_collect(15000)  # Đợi 15 giây
+        fut = completions.register("get-job-1", (0x1F,))
+        data = sc_read_until_complete_collect(15000, fut)  # Đợi 15 giây
         if data:
             print(f"Received {len(data)} bytes: {data.hex()}")
     """
-    end = time.time() + (timeout_ms/1000.0)
-    # with sc_rx_lock:
-    #     if _last_status_code["code"] == 0x1F:
-    #         data = bytes(_sc_rx_buffer)
-    #         _sc_rx_buffer.clear()
-    #         return data
-    #     while True:
-    #         remaining = end - time.time()
-    #         if remaining <= 0:
-    #             data = bytes(_sc_rx_buffer)
-    #             _sc_rx_buffer.clear()
-    #             return data
-    #         sc_rx_cv.wait(timeout=remaining)
-    #         if _last_status_code["code"] == 0x1F:
-    #             data = bytes(_sc_rx_buffer)
-    #             _sc_rx_buffer.clear()
-    return b""  # Placeholder
+    if future is None:
+        future = _registry().register(f"collect-{time.monotonic_ns()}", (0x1F,))
+    if future.wait(timeout_ms/1000.0):
+        return future.payload
+    _registry().cancel(future.op_id)
+    return b""
 
 def sc_read_two_segments_for_get_job(total_timeout_ms: int) -> Tuple[bytes, bytes]:
     """
@@ -87,14 +95,19 @@ def sc_read_two_segments_for_get_job(total_timeout_ms: int) -> Tuple[bytes, byte
         if header and body:
             print(f"Header: {len(header)} bytes, Body: {len(body)} bytes")
     """
-    # Phân chia timeout: 40% cho segment 1, 60% cho segment 2
+    # Đăng ký 2 future theo thứ tự trước khi gửi: header rồi body
+    f1 = _registry().register(f"get-job-hdr-{time.monotonic_ns()}", (0x1F,))
+    f2 = _registry().register(f"get-job-body-{time.monotonic_ns()}", (0x1F,))
+    # send_raw_to_software_command(sc_build_get_job_info(n))
+    
+    # Phân chia timeout: 40% cho segment 1, phần còn lại cho segment 2
     t1 = max(200, int(total_timeout_ms * 0.4))  # Min 200ms cho segment 1
     t2 = total_timeout_ms - t1
     
-    # segment1 = sc_read_until_complete_collect(t1)
-    # segment2 = sc_read_until_complete_collect(t2)
+    segment1 = sc_read_until_complete_collect(t1, f1)
+    segment2 = sc_read_until_complete_collect(t2, f2)
     
-    return (b"", b"")  # Placeholder
+    return (segment1, segment2)
 
 def exec_sc_operation(op_id: str, command: str, raw: bytes, source: str, 
                      meta: Dict = None, wait: bool = True) -> Dict[str, Any]:
@@ -102,7 +115,7 @@ def exec_sc_operation(op_id: str, command: str, raw: bytes, source: str,
     Thực thi VM2030 operation với timeout và error handling
     
     Args:
-        op_id: Operation ID để tracking
+        op_id: Operation ID để tracking (key của completion future)
         command: Command name (SET_JOB, START_JOB, etc.)
         raw: Raw command bytes
         source: Source của command ("ui", "input_edge", etc.)
@@ -122,7 +135,8 @@ def exec_sc_operation(op_id: str, command: str, raw: bytes, source: str,
     """
     meta = meta or {}
     
-    # Gửi command
+    # Đăng ký future trước khi gửi để không lỡ completion
+    fut = _registry().register(op_id)
     # send_raw_to_software_command(raw)
     
     if not wait:
@@ -133,7 +147,7 @@ def exec_sc_operation(op_id: str, command: str, raw: bytes, source: str,
     tout = 20000  # Default 20 seconds
     
     # Đợi completion
-    res = sc_wait_complete(tout)
+    res = sc_wait_complete(tout, fut)
     
     if res.get("ok"):
         return {"ok": True, "code": res["code"], "timeoutMs": tout}
@@ -260,7 +274,7 @@ def example_timeout_usage():
     
     # 3. Wait completion với custom timeout
     print("\n3. Wait Completion:")
-    completion = sc_wait_complete(10000)  # 10 seconds
+    completion = sc_wait_complete(10000, _registry().register("example-003"))  # 10 seconds
     if completion["ok"]:
         print(f"Completed with code: 0x{completion['code']:02X}")
     else:
@@ -318,4 +332,6 @@ def create_timeout_monitor(operation_name: str, timeout_ms: int):
     }
 
 if __name__ == "__main__":
+    import controller
+    bind_registry(controller._sc_completions)
     example_timeout_usage()
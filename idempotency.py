@@ -0,0 +1,108 @@
+# idempotency.py
+"""
+Cache reply theo messageId cho request bị client gửi lại (retry sau khi mất mạng / timeout phía UI)
+- Lần đầu: chạy fn(), lưu reply (nếu store(reply) = True) -> lần gửi lại trả reply đã lưu ngay,
+  không chạy lại SET_JOB / START_JOB
+- Bản gửi lại đến khi bản gốc còn đang chạy: gắn vào lần chạy đó (chờ cùng kết quả), không chạy lần 2
+- LRU + TTL: tối đa max_entries reply, mỗi reply sống ttl_ms; entry đang chạy không bị loại
+- Reply không lưu (store = False, vd. lệnh bị từ chối trước khi chạy): xoá entry để lần gửi lại chạy thật
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Callable, Optional, Tuple
+
+MISS, HIT, ATTACHED = "miss", "hit", "attached"
+
+
+class _Entry:
+    __slots__ = ("reply", "done_at", "event", "hits")
+
+    def __init__(self):
+        self.reply = None
+        self.done_at: Optional[float] = None
+        self.event = threading.Event()
+        self.hits = 0
+
+
+class IdempotencyCache:
+    def __init__(self, max_entries: int = 1024, ttl_ms: float = 300000, enabled: bool = True):
+        self.enabled = bool(enabled)
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_s = max(0.001, float(ttl_ms) / 1000.0)
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self.misses = 0
+        self.hits = 0
+        self.attached = 0
+        self.attach_timeouts = 0
+        self.not_stored = 0
+        self.evicted = 0
+
+    def run(self, key: Optional[str], fn: Callable[[], Any], store: Callable[[Any], bool] = lambda r: True,
+            wait_s: Optional[float] = None) -> Tuple[Any, str]:
+        """
+        (reply, MISS|HIT|ATTACHED). key rỗng / cache tắt: luôn chạy fn().
+        wait_s: thời gian tối đa bản gửi lại chờ bản gốc đang chạy; hết thì reply = None.
+        """
+        if not self.enabled or not key:
+            return fn(), MISS
+        with self._lock:
+            self._evict()
+            entry = self._entries.get(key)
+            owner = entry is None
+            if owner:
+                entry = self._entries[key] = _Entry()
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                entry.hits += 1
+                if entry.done_at is not None:
+                    self.hits += 1
+                    return entry.reply, HIT
+                self.attached += 1
+        if not owner:
+            if not entry.event.wait(wait_s):
+                with self._lock:
+                    self.attach_timeouts += 1
+                return None, ATTACHED
+            return entry.reply, ATTACHED
+
+        reply = None
+        try:
+            reply = fn()
+            return reply, MISS
+        finally:
+            with self._lock:
+                entry.reply, entry.done_at = reply, time.monotonic()
+                if reply is None or not store(reply):
+                    self.not_stored += 1
+                    if self._entries.get(key) is entry:
+                        del self._entries[key]
+            entry.event.set()
+
+    def _evict(self):
+        # gọi trong _lock
+        now = time.monotonic()
+        for key in [k for k, e in self._entries.items() if e.done_at is not None and now - e.done_at > self.ttl_s]:
+            del self._entries[key]
+            self.evicted += 1
+        if len(self._entries) >= self.max_entries:
+            for key in [k for k, e in self._entries.items() if e.done_at is not None]:
+                del self._entries[key]
+                self.evicted += 1
+                if len(self._entries) < self.max_entries:
+                    break
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.misses + self.hits + self.attached
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries), "max_entries": self.max_entries, "ttl_ms": int(self.ttl_s * 1000),
+                "in_flight": sum(1 for e in self._entries.values() if e.done_at is None),
+                "misses": self.misses, "hits": self.hits, "attached": self.attached,
+                "hit_ratio": round((self.hits + self.attached) / lookups, 4) if lookups else None,
+                "attach_timeouts": self.attach_timeouts, "not_stored": self.not_stored, "evicted": self.evicted,
+            }
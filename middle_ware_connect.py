@@ -5,6 +5,7 @@ import json
 import os
 import threading
 from queue import Queue
+from modbus_rtu import crc_ok, read_holding_frame, read_holding_response_len, parse_registers, relay_frame
 from software_command_handler import SoftwareCommandHandler
 
 def get_available_ports():
@@ -117,19 +118,6 @@ except Exception as e:
 # Định danh Slave ID
 SLAVE_ID = 1
 
-# Hàm tính CRC16 Modbus
-def calculate_crc(data):
-	crc = 0xFFFF
-	for pos in data:
-		crc ^= pos
-		for _ in range(8):
-			if crc & 0x0001:
-				crc >>= 1
-				crc ^= 0xA001
-			else:
-				crc >>= 1
-	return crc.to_bytes(2, byteorder="little")
-
 # Hàm đọc holding registers (Function code 03)
 def read_holding_registers(slave_id, start_addr, num_registers):
     """
@@ -141,38 +129,31 @@ def read_holding_registers(slave_id, start_addr, num_registers):
     """
     try:
         # Tạo lệnh Modbus RTU để đọc holding registers
-        data = [slave_id, 0x03, start_addr >> 8, start_addr & 0xFF, num_registers >> 8, num_registers & 0xFF]
-        data += list(calculate_crc(data))
+        data = read_holding_frame(slave_id, start_addr, num_registers)
         
         # Xóa buffer nhận
         ser.reset_input_buffer()
         
         # Gửi lệnh
-        ser.write(bytearray(data))
+        ser.write(data)
         
         # Đợi và đọc phản hồi
         time.sleep(0.1)
         
         # Tính toán số byte cần đọc (response = slave_id + func_code + byte_count + data + 2 bytes CRC)
-        expected_bytes = 3 + (num_registers * 2) + 2
+        expected_bytes = read_holding_response_len(num_registers)
         response = ser.read(expected_bytes)
         
         if len(response) != expected_bytes:
             return None
         
         # Kiểm tra CRC
-        received_crc = response[-2:]
-        calculated_crc = calculate_crc(response[:-2])
-        if received_crc != calculated_crc:
+        if not crc_ok(response):
             return None
         
         # Phân tích dữ liệu
-        values = []
-        for i in range(3, len(response)-2, 2):
-            value = (response[i] << 8) | response[i+1]
-            values.append(value)
-        
-        return values
+        values = parse_registers(response, num_registers)
+        return list(values) if values is not None else None
     except Exception:
         return None
 
@@ -185,10 +166,9 @@ def control_single_relay(slave_id, relay_addr, value):
     :param value: Giá trị relay (1: bật, 2: tắt)
     """
     # Tạo lệnh Modbus RTU cho một relay (chỉ truyền 1 giá trị)
-    data = [slave_id, 0x10, 0x00, relay_addr, 0x00, 1, 2, value, 0x00]
-    data += list(calculate_crc(data))
+    data = relay_frame(slave_id, relay_addr, value)
     # print(f"Gửi lệnh relay {relay_addr} {'BẬT' if value == 1 else 'TẮT'}")
-    ser.write(bytearray(data))
+    ser.write(data)
     time.sleep(0.1)  # Chờ thiết bị xử lý
 
 def process_command(command_json, device_config):
@@ -0,0 +1,323 @@
+# modbus_link.py
+"""
+Transaction engine cho Modbus RTU (BOARD_RELAY)
+- Thời gian 1 ký tự và khoảng nghỉ giữa 2 frame (t3.5) tính từ baud_rate
+  (theo spec: baud > 19200 thì t3.5 cố định 1.75 ms)
+- Mỗi transaction: chờ đủ t3.5 kể từ lần truyền trước -> ghi request -> đọc đúng đến khi
+  đủ frame (độ dài tính trước) hoặc phát hiện exception frame (5 byte), không sleep cố định
+- Deadline = thời gian truyền request + turnaround của slave + thời gian truyền response
+- Histogram RTT (write xong -> nhận đủ frame) để theo dõi latency thực tế
+- Chất lượng link theo slave (cửa sổ N transaction gần nhất): CRC lỗi, frame thiếu, timeout,
+  exception; khi bật adaptive thì tự chỉnh trong giới hạn cấu hình:
+    * turnaround timeout = p99 turnaround đo được x factor + margin (line sạch -> timeout ngắn)
+    * số lần retry: theo tỉ lệ frame hỏng (CRC/thiếu); slave im lặng hoàn toàn thì không retry
+    * khoảng nghỉ thêm giữa các frame khi line nhiễu
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, Optional, Callable
+
+from modbus_rtu import crc_ok
+
+EXCEPTION_FRAME_LEN = 5
+RTT_BUCKETS_MS = (2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500, 1000)
+
+
+class RttHistogram:
+    def __init__(self, buckets=RTT_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.n = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def add(self, ms: float):
+        i = 0
+        while i < len(self.buckets) and ms > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.n += 1
+        self.total += ms
+        self.min = ms if self.min is None else min(self.min, ms)
+        self.max = ms if self.max is None else max(self.max, ms)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Cận trên của bucket chứa percentile q (0..1)."""
+        if not self.n:
+            return None
+        target = q * self.n
+        acc = 0
+        for i, c in enumerate(self.counts):
+            acc += c
+            if acc >= target:
+                return float(self.buckets[i]) if i < len(self.buckets) else self.max
+        return self.max
+
+    def snapshot(self) -> Dict[str, Any]:
+        labels = [f"<={b}" for b in self.buckets] + [f">{self.buckets[-1]}"]
+        return {
+            "count": self.n,
+            "min_ms": round(self.min, 3) if self.min is not None else None,
+            "avg_ms": round(self.total / self.n, 3) if self.n else None,
+            "max_ms": round(self.max, 3) if self.max is not None else None,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "buckets": {k: c for k, c in zip(labels, self.counts) if c},
+        }
+
+
+ADAPTIVE_DEFAULTS = {
+    "enabled": True, "window": 64, "min_samples": 10,
+    "min_retries": 0, "max_retries": 3, "error_rate_for_max_retries": 0.2,
+    "timeout_min_ms": 30, "timeout_max_ms": 1000, "timeout_factor": 3.0, "timeout_margin_ms": 10,
+    "max_extra_gap_ms": 5.0, "silent_after": 3,
+}
+
+OUTCOMES = ("ok", "crc", "short", "timeout")
+_NO_ATTR = object()  # port không có thuộc tính timeout (khác với timeout = None: chờ vô hạn)
+
+
+def _quantile(sorted_vals, q: float) -> float:
+    return sorted_vals[min(len(sorted_vals) - 1, int(q * len(sorted_vals)))]
+
+
+class LinkQuality:
+    """Cửa sổ trượt kết quả + turnaround của 1 slave."""
+
+    def __init__(self, window: int):
+        self.outcomes = deque(maxlen=window)
+        self.turnaround_ms = deque(maxlen=window)
+        self.consecutive_timeouts = 0
+        self.totals = {o: 0 for o in OUTCOMES}
+        self.exceptions = 0
+
+    def add(self, outcome: str, turnaround_ms: Optional[float]):
+        self.outcomes.append(outcome)
+        self.totals[outcome] += 1
+        self.consecutive_timeouts = self.consecutive_timeouts + 1 if outcome == "timeout" else 0
+        if turnaround_ms is not None:
+            self.turnaround_ms.append(turnaround_ms)
+
+    def rate(self, *kinds) -> float:
+        if not self.outcomes:
+            return 0.0
+        return sum(1 for o in self.outcomes if o in kinds) / len(self.outcomes)
+
+
+class ModbusTransactor:
+    """
+    port_getter() trả về port hiện tại (serial.Serial hoặc transport trong transports.py), có thể
+    đổi khi reconnect. lock: lock dùng chung của bus.
+    """
+
+    def __init__(self, port_getter: Callable[[], Any], lock: threading.Lock, baud_rate: int = 9600,
+                 char_bits: int = 11, response_timeout_ms: float = 200.0, min_gap_ms: float = 1.75,
+                 adaptive: Optional[Dict[str, Any]] = None):
+        self._port = port_getter
+        self.adaptive = {**ADAPTIVE_DEFAULTS, **(adaptive or {})}
+        self._quality: Dict[int, LinkQuality] = {}
+        self._lock = lock
+        self.char_bits = int(char_bits)
+        self.response_timeout_s = float(response_timeout_ms) / 1000.0
+        self.min_gap_s = float(min_gap_ms) / 1000.0
+        self.set_baud(baud_rate)
+        self._bus_free_at = 0.0
+        self._stats_lock = threading.Lock()
+        self.rtt = RttHistogram()
+        self.transactions = 0
+        self.timeouts = 0
+        self.exceptions = 0
+        self.short_frames = 0
+        self.crc_errors = 0
+        self.gap_wait_ms_total = 0.0
+
+    def set_baud(self, baud_rate: int):
+        self.baud_rate = max(1, int(baud_rate))
+        self.char_time_s = self.char_bits / self.baud_rate
+        self.t3_5_s = self.min_gap_s if self.baud_rate > 19200 else 3.5 * self.char_time_s
+
+    def wire_time_s(self, n_bytes: int) -> float:
+        return n_bytes * self.char_time_s
+
+    def _read_until(self, port, n: int, deadline: float) -> bytes:
+        buf = b""
+        while len(buf) < n:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            port.timeout = remaining
+            buf += port.read(n - len(buf))
+        return buf
+
+    # --- tuning theo chất lượng link ---
+    def _q(self, slave: int) -> LinkQuality:
+        q = self._quality.get(slave)
+        if q is None:
+            q = self._quality[slave] = LinkQuality(int(self.adaptive["window"]))
+        return q
+
+    def turnaround_timeout_s(self, slave: int) -> float:
+        """Timeout chờ slave trả lời: cấu hình cố định, hoặc theo p99 turnaround đo được (adaptive)."""
+        a = self.adaptive
+        with self._stats_lock:
+            q = self._quality.get(slave)
+            samples = sorted(q.turnaround_ms) if q is not None else []
+        if not a["enabled"] or len(samples) < int(a["min_samples"]):
+            return self.response_timeout_s
+        ms = _quantile(samples, 0.99) * float(a["timeout_factor"]) + float(a["timeout_margin_ms"])
+        return min(max(ms, float(a["timeout_min_ms"])), float(a["timeout_max_ms"])) / 1000.0
+
+    def retries_for(self, slave: int, default: int = 2) -> int:
+        """
+        Số lần gửi lại khi frame hỏng. Không adaptive: default. Adaptive: min_retries khi line sạch,
+        tăng tuyến tính theo tỉ lệ CRC/frame thiếu tới max_retries; slave im lặng liên tiếp
+        (silent_after timeout) -> min_retries (gửi lại chỉ tốn thêm timeout).
+        """
+        a = self.adaptive
+        if not a["enabled"]:
+            return default
+        with self._stats_lock:
+            q = self._quality.get(slave)
+            if q is None or len(q.outcomes) < int(a["min_samples"]):
+                return max(int(a["min_retries"]), min(default, int(a["max_retries"])))
+            if q.consecutive_timeouts >= int(a["silent_after"]):
+                return int(a["min_retries"])
+            bad = q.rate("crc", "short", "timeout")
+        lo, hi = int(a["min_retries"]), int(a["max_retries"])
+        full = float(a["error_rate_for_max_retries"])
+        frac = 1.0 if full <= 0 else min(1.0, bad / full)
+        return lo + int(round((hi - lo) * frac)) if bad > 0 else lo
+
+    def extra_gap_s(self, slave: int) -> float:
+        """Nghỉ thêm sau t3.5 khi line nhiễu (CRC/frame thiếu), tỉ lệ với mức nhiễu."""
+        a = self.adaptive
+        if not a["enabled"]:
+            return 0.0
+        with self._stats_lock:
+            q = self._quality.get(slave)
+            noisy = q.rate("crc", "short") if q is not None else 0.0
+        full = float(a["error_rate_for_max_retries"]) or 1.0
+        return min(1.0, noisy / full) * float(a["max_extra_gap_ms"]) / 1000.0
+
+    def quality(self, slave: int) -> str:
+        """"good" | "degraded" | "down" | "unknown" theo cửa sổ gần nhất."""
+        with self._stats_lock:
+            q = self._quality.get(slave)
+            if q is None or not q.outcomes:
+                return "unknown"
+            if q.consecutive_timeouts >= int(self.adaptive["silent_after"]):
+                return "down"
+            return "degraded" if q.rate("crc", "short", "timeout") >= 0.05 else "good"
+
+    def transact(self, request: bytes, expected_len: int, response_timeout_s: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Trả về {"resp": bytes, "complete": bool, "exception": bool, "crc_ok": bool, "rtt_ms": float|None}.
+        Lỗi I/O của port được raise lên như trước (caller xử lý serial.SerialException...).
+        """
+        slave = request[0]
+        turnaround = self.turnaround_timeout_s(slave) if response_timeout_s is None else response_timeout_s
+        with self._lock:
+            port = self._port()
+            if port is None:
+                raise IOError("Serial connection not available")
+            gap = self._bus_free_at + self.extra_gap_s(slave) - time.monotonic()
+            if gap > 0:
+                time.sleep(gap)
+            old_timeout = getattr(port, "timeout", _NO_ATTR)
+            try:
+                port.reset_input_buffer()
+                port.write(request)
+                t_sent = time.monotonic()
+                deadline = t_sent + self.wire_time_s(len(request)) + turnaround + self.wire_time_s(expected_len)
+                head = self._read_until(port, min(EXCEPTION_FRAME_LEN, expected_len), deadline)
+                is_exc = len(head) >= 2 and bool(head[1] & 0x80)
+                if is_exc or len(head) < min(EXCEPTION_FRAME_LEN, expected_len):
+                    resp = head
+                else:
+                    resp = head + self._read_until(port, expected_len - len(head), deadline)
+                t_done = time.monotonic()
+            finally:
+                # luôn khôi phục, kể cả None (blocking) - nếu không port giữ timeout ngắn của _read_until
+                if old_timeout is not _NO_ATTR:
+                    port.timeout = old_timeout
+            self._bus_free_at = time.monotonic() + self.t3_5_s
+        complete = (len(resp) >= EXCEPTION_FRAME_LEN) if is_exc else (len(resp) == expected_len)
+        good_crc = complete and crc_ok(resp[:EXCEPTION_FRAME_LEN] if is_exc else resp)
+        rtt_ms = (t_done - t_sent) * 1000.0
+        if good_crc:
+            outcome = "ok"
+        elif complete:
+            outcome = "crc"
+        else:
+            outcome = "short" if resp else "timeout"
+        turnaround_ms = None
+        if good_crc:
+            wire = self.wire_time_s(len(request)) + self.wire_time_s(len(resp))
+            turnaround_ms = max(0.0, rtt_ms - wire * 1000.0)
+        with self._stats_lock:
+            self.transactions += 1
+            if gap > 0:
+                self.gap_wait_ms_total += gap * 1000.0
+            if is_exc and good_crc:
+                self.exceptions += 1
+            if good_crc:
+                self.rtt.add(rtt_ms)
+            elif complete:
+                self.crc_errors += 1
+            elif resp:
+                self.short_frames += 1
+            else:
+                self.timeouts += 1
+            q = self._q(slave)
+            q.add(outcome, turnaround_ms)
+            if is_exc and good_crc:
+                q.exceptions += 1
+        return {"resp": resp, "complete": complete, "exception": is_exc, "crc_ok": good_crc,
+                "rtt_ms": round(rtt_ms, 3)}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                "baud_rate": self.baud_rate,
+                "char_time_ms": round(self.char_time_s * 1000.0, 4),
+                "t3_5_ms": round(self.t3_5_s * 1000.0, 3),
+                "response_timeout_ms": round(self.response_timeout_s * 1000.0, 1),
+                "transactions": self.transactions,
+                "timeouts": self.timeouts,
+                "short_frames": self.short_frames,
+                "crc_errors": self.crc_errors,
+                "exceptions": self.exceptions,
+                "gap_wait_ms_total": round(self.gap_wait_ms_total, 3),
+                "rtt": self.rtt.snapshot(),
+                "adaptive": bool(self.adaptive["enabled"]),
+                "slaves": {str(sid): self._slave_stats(sid, q) for sid, q in self._quality.items()},
+            }
+
+    def _slave_stats(self, slave: int, q: LinkQuality) -> Dict[str, Any]:
+        # gọi trong _stats_lock; các hàm tuning tự lấy lock nên tính trước ở đây
+        ta = sorted(q.turnaround_ms)
+        return {
+            "window": len(q.outcomes),
+            "error_rate": round(q.rate("crc", "short", "timeout"), 4),
+            "crc_rate": round(q.rate("crc"), 4),
+            "short_rate": round(q.rate("short"), 4),
+            "timeout_rate": round(q.rate("timeout"), 4),
+            "consecutive_timeouts": q.consecutive_timeouts,
+            "totals": dict(q.totals),
+            "exceptions": q.exceptions,
+            "turnaround_p50_ms": round(_quantile(ta, 0.5), 3) if ta else None,
+            "turnaround_p99_ms": round(_quantile(ta, 0.99), 3) if ta else None,
+        }
+
+    def tuning(self) -> Dict[str, Any]:
+        """Giá trị đang áp dụng theo slave: timeout, retries, extra gap, quality."""
+        with self._stats_lock:
+            slaves = list(self._quality)
+        return {str(s): {"timeout_ms": round(self.turnaround_timeout_s(s) * 1000.0, 3),
+                         "retries": self.retries_for(s),
+                         "extra_gap_ms": round(self.extra_gap_s(s) * 1000.0, 3),
+                         "quality": self.quality(s)} for s in slaves}
@@ -0,0 +1,206 @@
+# modbus_rtu.py
+"""
+Modbus RTU codec dùng chung (controller.py, v2_controller.py, middle_ware_connect.py, test_controller.py)
+- CRC16 (poly 0xA001) tra bảng 256 phần tử, hỗ trợ tính tăng dần (Crc16 / crc16(data, crc))
+- calculate_crc(data) giữ nguyên kết quả như bản cũ: 2 byte little-endian
+- Frame request được build sẵn và cache: FC16 cho 12 relay x các mã trạng thái, FC03 poll
+- Parse response trên bytes/memoryview bằng struct.unpack_from (không copy, không vòng lặp Python)
+
+Chạy trực tiếp để benchmark:  python modbus_rtu.py
+"""
+
+import struct
+from functools import lru_cache
+from typing import Optional, Tuple
+
+FC_READ_HOLDING = 0x03
+FC_WRITE_MULTIPLE = 0x10
+
+RELAY_COUNT = 12
+RELAY_STATES = (1, 2, 3, 4, 5)  # 1=OPEN/ON, 2=CLOSE/OFF, 3=TOGGLE, 4=LATCH, 5=MOMENTARY
+
+EXCEPTION_NAMES = {
+    0x01: "Illegal Function", 0x02: "Illegal Data Address", 0x03: "Illegal Data Value",
+    0x04: "Slave Device Failure", 0x05: "Acknowledge", 0x06: "Slave Device Busy",
+    0x07: "Negative Acknowledge", 0x08: "Memory Parity Error",
+}
+
+
+def _make_table():
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return tuple(table)
+
+_CRC_TABLE = _make_table()
+
+
+def crc16(data, crc: int = 0xFFFF) -> int:
+    """CRC16 Modbus của data (bytes/bytearray/memoryview/list int). Truyền crc trước đó để tính tiếp."""
+    table = _CRC_TABLE
+    for b in data:
+        crc = (crc >> 8) ^ table[(crc ^ b) & 0xFF]
+    return crc
+
+
+def calculate_crc(data) -> bytes:
+    """Tương thích bản cũ: CRC16 dạng 2 byte little-endian."""
+    return crc16(data).to_bytes(2, byteorder="little")
+
+
+def crc_ok(frame) -> bool:
+    """frame gồm cả 2 byte CRC cuối. CRC của (data + CRC đúng) luôn bằng 0."""
+    return len(frame) >= 4 and crc16(frame) == 0
+
+
+class Crc16:
+    """CRC tăng dần khi frame đến theo nhiều chunk."""
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0xFFFF
+
+    def update(self, data) -> "Crc16":
+        self.value = crc16(data, self.value)
+        return self
+
+    def ok(self) -> bool:
+        """True nếu các chunk đã update (kể cả 2 byte CRC) tạo thành frame hợp lệ."""
+        return self.value == 0
+
+    def digest(self) -> bytes:
+        return self.value.to_bytes(2, byteorder="little")
+
+
+def with_crc(body) -> bytes:
+    body = bytes(body)
+    return body + calculate_crc(body)
+
+
+# -----------------------------
+# Request frames (cache)
+# -----------------------------
+@lru_cache(maxsize=None)
+def read_holding_frame(slave_id: int, start_addr: int, num_registers: int) -> bytes:
+    """FC03 request."""
+    return with_crc(struct.pack(">BBHH", slave_id, FC_READ_HOLDING, start_addr, num_registers))
+
+
+@lru_cache(maxsize=None)
+def write_relays_frame(slave_id: int, start_relay: int, state_codes: Tuple[int, ...]) -> bytes:
+    """
+    FC16 ghi các thanh ghi liên tiếp từ start_relay; mỗi thanh ghi = [code, 0x00]
+    (lệnh nằm byte cao, byte thấp = 0x00 theo tài liệu board).
+    """
+    qty = len(state_codes)
+    body = struct.pack(">BBHHB", slave_id, FC_WRITE_MULTIPLE, start_relay, qty, qty * 2)
+    body += bytes(b for code in state_codes for b in (code, 0x00))
+    return with_crc(body)
+
+
+def relay_frame(slave_id: int, relay_addr: int, state_value: int) -> bytes:
+    """FC16 cho 1 relay (dùng cache)."""
+    return write_relays_frame(slave_id, relay_addr, (state_value,))
+
+
+def warm_frame_cache(slave_id: int, poll_start: Optional[int] = None, poll_count: Optional[int] = None) -> int:
+    """Build sẵn frame cho 12 relay x RELAY_STATES (+ frame poll FC03). Trả về số frame đã cache."""
+    for relay in range(1, RELAY_COUNT + 1):
+        for state in RELAY_STATES:
+            relay_frame(slave_id, relay, state)
+    if poll_start is not None and poll_count:
+        read_holding_frame(slave_id, poll_start, poll_count)
+    return write_relays_frame.cache_info().currsize + read_holding_frame.cache_info().currsize
+
+
+# -----------------------------
+# Response parsing
+# -----------------------------
+def read_holding_response_len(num_registers: int) -> int:
+    return 3 + num_registers * 2 + 2
+
+
+def parse_exception(resp) -> Optional[int]:
+    """Exception code nếu resp là exception frame hợp lệ (5 byte, CRC đúng), ngược lại None."""
+    if len(resp) >= 5 and (resp[1] & 0x80) and crc16(memoryview(resp)[:5]) == 0:
+        return resp[2]
+    return None
+
+
+def exception_message(code: int) -> str:
+    return f"Modbus exception: {EXCEPTION_NAMES.get(code, f'0x{code:02X}')} ({code})"
+
+
+def parse_registers(resp, num_registers: int) -> Optional[Tuple[int, ...]]:
+    """
+    Parse response FC03 (đã đủ độ dài, đã kiểm CRC). Trả tuple giá trị thanh ghi, hoặc None nếu
+    byte count không khớp.
+    """
+    if resp[2] != num_registers * 2:
+        return None
+    return struct.unpack_from(f">{num_registers}H", resp, 3)
+
+
+def fc16_echo_ok(resp, slave_id: int, start_addr: int, quantity: int) -> bool:
+    """Echo FC16 chuẩn 8 byte: slave, 0x10, addr, qty (CRC kiểm riêng)."""
+    return (len(resp) == 8 and resp[0] == slave_id and resp[1] == FC_WRITE_MULTIPLE
+            and struct.unpack_from(">HH", resp, 2) == (start_addr, quantity))
+
+
+def fc16_echo_detail(resp) -> dict:
+    addr, qty = struct.unpack_from(">HH", resp, 2)
+    return {"slave": resp[0], "function": resp[1], "address": addr, "quantity": qty}
+
+
+# -----------------------------
+# Micro-benchmark
+# -----------------------------
+def _crc_bitwise(data) -> bytes:
+    crc = 0xFFFF
+    for pos in data:
+        crc ^= pos
+        for _ in range(8):
+            if crc & 0x0001: crc >>= 1; crc ^= 0xA001
+            else: crc >>= 1
+    return crc.to_bytes(2, byteorder="little")
+
+
+def _bench():
+    import timeit
+    n = 20000
+    req = [1, 0x10, 0x00, 3, 0x00, 0x01, 0x02, 1, 0x00]
+    resp = bytes([1, 3, 16]) + bytes(range(16))
+    resp += calculate_crc(resp)
+    assert _crc_bitwise(req) == calculate_crc(req) and crc_ok(resp)
+
+    def per(stmt):
+        return timeit.timeit(stmt, number=n) / n * 1e6
+
+    def old_frame():
+        frame = [1, 0x10, 0x00, 3, 0x00, 0x01, 0x02, 1, 0x00]
+        frame += list(_crc_bitwise(frame))
+        return bytearray(frame)
+
+    def old_parse():
+        if resp[-2:] != _crc_bitwise(resp[:-2]):
+            return None
+        return [(resp[i] << 8) | resp[i + 1] for i in range(3, len(resp) - 2, 2)]
+
+    rows = [
+        ("crc 9B bitwise (old)", per(lambda: _crc_bitwise(req))),
+        ("crc 9B table", per(lambda: calculate_crc(req))),
+        ("relay frame build (old)", per(old_frame)),
+        ("relay frame (cached)", per(lambda: relay_frame(1, 3, 1))),
+        ("FC03 21B parse (old)", per(old_parse)),
+        ("FC03 21B parse (codec)", per(lambda: crc_ok(resp) and parse_registers(resp, 8))),
+    ]
+    for name, us in rows:
+        print(f"{name:26s} {us:8.3f} us/frame")
+    print(f"cached frames: {warm_frame_cache(1, 129, 8)}")
+
+
+if __name__ == "__main__":
+    _bench()
@@ -0,0 +1,200 @@
+# modbus_scheduler.py
+"""
+Bộ lập lịch transaction cho bus RS485 dùng chung (BOARD_RELAY)
+- Một thread duy nhất sở hữu bus, chạy job theo lớp ưu tiên:
+    actuation (ghi relay) > ready (gating Ready trước khi chạy lệnh) > poll (đọc trạng thái/vị trí)
+  trong cùng một lớp: FIFO
+- Job đọc có `key` (vd. ("fc03", slave, addr, count)): nếu đã có job cùng key đang chờ thì request
+  mới dùng chung kết quả của job đó (job chạy sau cả hai request nên kết quả đủ mới) thay vì
+  xếp thêm một lần đọc; request lớp cao hơn nâng ưu tiên của job đang chờ
+- Nhiều slave trên cùng bus: trong mỗi lớp, job được chia theo lane (slave id) và lấy xoay vòng
+  giữa các lane -> slave chậm / hay timeout không chiếm bus của slave khác
+- Thống kê theo lớp: độ sâu, thời gian chờ trong hàng, thời gian chạy, số job gộp;
+  theo lane: số transaction, lỗi (is_error), latency, throughput
+"""
+
+import threading
+import time
+from collections import deque, OrderedDict
+from concurrent.futures import Future
+from typing import Dict, Any, Optional, Hashable, Callable
+
+CLASSES = ("actuation", "ready", "poll")
+
+
+class _Job:
+    __slots__ = ("cls", "fn", "args", "key", "lane", "future", "enqueued_at")
+
+    def __init__(self, cls, fn, args, key, lane):
+        self.cls = cls
+        self.fn = fn
+        self.args = args
+        self.key = key
+        self.lane = lane
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class ModbusScheduler:
+    def __init__(self, name: str = "modbus-bus", is_error: Optional[Callable[[Any], bool]] = None):
+        """is_error(result) -> True nếu kết quả job là lỗi (để đếm lỗi theo lane)."""
+        self.name = name
+        self._is_error = is_error
+        self._cv = threading.Condition(threading.Lock())
+        self._queues = {c: OrderedDict() for c in CLASSES}  # lớp -> lane -> deque job
+        self._by_key: Dict[Hashable, _Job] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._stop = False
+        self._st = {c: {"submitted": 0, "executed": 0, "coalesced": 0, "upgraded": 0, "wait_total_ms": 0.0,
+                        "wait_max_ms": 0.0, "run_total_ms": 0.0, "run_max_ms": 0.0} for c in CLASSES}
+        self._lane_st: Dict[Hashable, Dict[str, Any]] = {}
+
+    def in_worker(self) -> bool:
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop = False
+            self._thread = threading.Thread(target=self._worker, name=self.name, daemon=True)
+            self._thread.start()
+
+    def _enqueue(self, job: _Job):
+        self._queues[job.cls].setdefault(job.lane, deque()).append(job)
+
+    def _dequeue(self, job: _Job):
+        lanes = self._queues[job.cls]
+        q = lanes[job.lane]
+        q.remove(job)
+        if not q:
+            del lanes[job.lane]
+
+    def submit(self, cls: str, fn, *args, key: Hashable = None, lane: Hashable = None) -> Future:
+        if cls not in self._queues:
+            raise ValueError(f"Unknown Modbus priority class '{cls}'")
+        with self._cv:
+            self._ensure_started()
+            st = self._st[cls]
+            st["submitted"] += 1
+            if key is not None:
+                job = self._by_key.get(key)
+                if job is not None:
+                    st["coalesced"] += 1
+                    if CLASSES.index(cls) < CLASSES.index(job.cls):
+                        self._dequeue(job)
+                        job.cls = cls
+                        self._enqueue(job)
+                        st["upgraded"] += 1
+                    return job.future
+            job = _Job(cls, fn, args, key, lane)
+            self._enqueue(job)
+            if key is not None:
+                self._by_key[key] = job
+            self._cv.notify()
+            return job.future
+
+    def call(self, cls: str, fn, *args, key: Hashable = None, lane: Hashable = None):
+        """Chạy fn trên bus thread và chờ kết quả. Gọi từ chính bus thread thì chạy trực tiếp."""
+        if self.in_worker():
+            return fn(*args)
+        return self.submit(cls, fn, *args, key=key, lane=lane).result()
+
+    def _next_job(self) -> Optional[_Job]:
+        for c in CLASSES:
+            lanes = self._queues[c]
+            if lanes:
+                # xoay vòng: lấy job đầu của lane đứng đầu rồi chuyển lane đó xuống cuối
+                lane, q = next(iter(lanes.items()))
+                job = q.popleft()
+                if q:
+                    lanes.move_to_end(lane)
+                else:
+                    del lanes[lane]
+                if job.key is not None and self._by_key.get(job.key) is job:
+                    del self._by_key[job.key]
+                return job
+        return None
+
+    def _worker(self):
+        while True:
+            with self._cv:
+                job = self._next_job()
+                while job is None:
+                    if self._stop:
+                        return
+                    self._cv.wait()
+                    job = self._next_job()
+            t0 = time.monotonic()
+            wait_ms = (t0 - job.enqueued_at) * 1000.0
+            failed = False
+            try:
+                result = job.fn(*job.args)
+                failed = bool(self._is_error and self._is_error(result))
+                job.future.set_result(result)
+            except BaseException as e:
+                failed = True
+                job.future.set_exception(e)
+            t1 = time.monotonic()
+            run_ms = (t1 - t0) * 1000.0
+            with self._cv:
+                ls = self._lane_st.get(job.lane)
+                if ls is None:
+                    ls = self._lane_st[job.lane] = {"transactions": 0, "errors": 0, "run_total_ms": 0.0,
+                                                    "run_max_ms": 0.0, "first_at": t0, "last_at": t1}
+                ls["transactions"] += 1
+                ls["errors"] += failed
+                ls["run_total_ms"] += run_ms
+                ls["run_max_ms"] = max(ls["run_max_ms"], run_ms)
+                ls["last_at"] = t1
+                st = self._st[job.cls]
+                st["executed"] += 1
+                st["wait_total_ms"] += wait_ms
+                st["run_total_ms"] += run_ms
+                if wait_ms > st["wait_max_ms"]:
+                    st["wait_max_ms"] = wait_ms
+                if run_ms > st["run_max_ms"]:
+                    st["run_max_ms"] = run_ms
+
+    def stop(self):
+        with self._cv:
+            self._stop = True
+            self._cv.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cv:
+            out = {}
+            for c in CLASSES:
+                st = self._st[c]
+                n = st["executed"]
+                out[c] = {
+                    "depth": sum(len(q) for q in self._queues[c].values()),
+                    "submitted": st["submitted"],
+                    "executed": n,
+                    "coalesced": st["coalesced"],
+                    "upgraded": st["upgraded"],
+                    "wait_avg_ms": round(st["wait_total_ms"] / n, 3) if n else 0.0,
+                    "wait_max_ms": round(st["wait_max_ms"], 3),
+                    "run_avg_ms": round(st["run_total_ms"] / n, 3) if n else 0.0,
+                    "run_max_ms": round(st["run_max_ms"], 3),
+                }
+            return out
+
+    def lane_stats(self) -> Dict[str, Any]:
+        """Theo lane (slave): transaction, lỗi, latency (thời gian chiếm bus), throughput, tỉ lệ chiếm bus."""
+        with self._cv:
+            now = time.monotonic()
+            total = sum(ls["run_total_ms"] for ls in self._lane_st.values())
+            out = {}
+            for lane, ls in self._lane_st.items():
+                n = ls["transactions"]
+                span = now - ls["first_at"]
+                out[str(lane)] = {
+                    "transactions": n,
+                    "errors": ls["errors"],
+                    "error_ratio": round(ls["errors"] / n, 4) if n else 0.0,
+                    "latency_avg_ms": round(ls["run_total_ms"] / n, 3) if n else None,
+                    "latency_max_ms": round(ls["run_max_ms"], 3),
+                    "throughput_per_s": round(n / span, 3) if span > 0 else None,
+                    "bus_share": round(ls["run_total_ms"] / total, 4) if total else None,
+                    "depth": sum(len(lanes.get(lane, ())) for lanes in self._queues.values()),
+                }
+            return out
@@ -0,0 +1,77 @@
+# modbus_snapshot.py
+"""
+Snapshot các signal BOARD_RELAY (theo register_map) do background_read publish
+- Mỗi lần đọc FC03 thành công (poll hoặc đọc fallback) cập nhật giá trị + timestamp của từng signal
+  (nhóm fast/slow được poll với nhịp khác nhau nên tuổi tính theo signal)
+- Consumer (ready gate, GET_READY_STATUS, GET_POSITION) đọc các signal cần với max_age_ms riêng:
+  signal nào cũng đủ mới thì trả ngay, không ra bus; có signal quá cũ / chưa có thì mới đọc đồng bộ
+  qua reader(names)
+- Thống kê theo consumer: hit / miss, hit ratio, tuổi snapshot khi hit (avg/max)
+"""
+
+import threading
+import time
+from typing import Dict, Any, Callable, Iterable
+
+
+class RegisterSnapshot:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values: Dict[str, Any] = {}
+        self._at: Dict[str, float] = {}  # monotonic theo signal
+        self.source = None
+        self.publishes = 0
+        self._st: Dict[str, Dict[str, float]] = {}
+
+    def publish(self, signals, source: str = "poll"):
+        if not isinstance(signals, dict) or "error" in signals:
+            return
+        now = time.monotonic()
+        with self._lock:
+            for name, value in signals.items():
+                self._values[name] = value
+                self._at[name] = now
+            self.source = source
+            self.publishes += 1
+
+    def get(self, consumer: str, max_age_ms: float, names: Iterable[str], reader: Callable[[tuple], Any]):
+        """
+        {name: value} từ snapshot nếu mọi signal có tuổi <= max_age_ms, ngược lại kết quả reader(names)
+        ({name: value} hoặc error dict như read_holding_registers). max_age_ms <= 0: luôn đọc mới.
+        """
+        names = tuple(names)
+        with self._lock:
+            st = self._st.setdefault(consumer, {"hits": 0, "misses": 0, "age_total_ms": 0.0, "age_max_ms": 0.0})
+            if max_age_ms > 0 and all(n in self._at for n in names):
+                now = time.monotonic()
+                age = max((now - self._at[n]) * 1000.0 for n in names) if names else 0.0
+                if age <= max_age_ms:
+                    st["hits"] += 1
+                    st["age_total_ms"] += age
+                    if age > st["age_max_ms"]:
+                        st["age_max_ms"] = age
+                    return {n: self._values[n] for n in names}
+            st["misses"] += 1
+        values = reader(names)
+        self.publish(values, source=consumer)
+        return values
+
+    def values(self) -> Dict[str, Any]:
+        """Giá trị mới nhất của mọi signal (không tính hit/miss)."""
+        with self._lock:
+            return dict(self._values)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            consumers = {}
+            for name, st in self._st.items():
+                n = st["hits"] + st["misses"]
+                consumers[name] = {
+                    "hits": st["hits"], "misses": st["misses"],
+                    "hit_ratio": round(st["hits"] / n, 4) if n else None,
+                    "hit_age_avg_ms": round(st["age_total_ms"] / st["hits"], 3) if st["hits"] else None,
+                    "hit_age_max_ms": round(st["age_max_ms"], 3),
+                }
+            return {"age_ms": {n: round((now - t) * 1000.0, 3) for n, t in self._at.items()},
+                    "source": self.source, "publishes": self.publishes, "consumers": consumers}
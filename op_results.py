@@ -0,0 +1,138 @@
+# op_results.py
+"""
+Operation bất đồng bộ cho ZMQ front-end
+- submit(envelope): xếp lệnh vào hàng đợi, trả opId ngay; 1 worker chạy tuần tự run_fn(envelope)
+  (lệnh thiết bị vẫn nối tiếp nhau như khi chạy đồng bộ)
+- get(opId) / wait(opId, timeout_s): trạng thái queued -> running -> done, kèm reply của lệnh khi xong
+- Bảng kết quả có giới hạn: op đã xong bị loại khi quá ttl_ms hoặc khi vượt max_results (cũ nhất
+  trước); op chưa xong không bao giờ bị loại. Hàng đợi đầy (max_pending) -> submit raise queue.Full
+"""
+
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Any, Callable, Optional
+
+QUEUED, RUNNING, DONE = "queued", "running", "done"
+
+
+class _Op:
+    __slots__ = ("op_id", "message_id", "command", "envelope", "status", "reply",
+                 "submitted_at", "started_at", "finished_at", "event")
+
+    def __init__(self, op_id: str, envelope: Dict[str, Any]):
+        self.op_id = op_id
+        self.message_id = envelope.get("messageId")
+        self.command = str(envelope.get("command") or "").upper().strip()
+        self.envelope = envelope
+        self.status = QUEUED
+        self.reply: Optional[Dict[str, Any]] = None
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.event = threading.Event()
+
+    def describe(self) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            "opId": self.op_id,
+            "messageId": self.message_id,
+            "command": self.command,
+            "status": self.status,
+            "queuedMs": int(((self.started_at or now) - self.submitted_at) * 1000),
+            "runMs": int(((self.finished_at or now) - self.started_at) * 1000) if self.started_at else None,
+            "reply": self.reply,
+        }
+
+
+class AsyncOps:
+    def __init__(self, run_fn: Callable[[Dict[str, Any]], Dict[str, Any]], max_results: int = 1024,
+                 ttl_ms: float = 600000, max_pending: int = 64, log: Optional[Callable[[str, str], None]] = None):
+        self._run = run_fn
+        self.max_results = max(1, int(max_results))
+        self.ttl_s = max(1.0, float(ttl_ms) / 1000.0)
+        self._log = log or (lambda level, msg: None)
+        self._q: "queue.Queue" = queue.Queue(maxsize=max(1, int(max_pending)))
+        self._ops: "OrderedDict[str, _Op]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.evicted = 0
+        self.lookups_missing = 0
+
+    def submit(self, envelope: Dict[str, Any]) -> Dict[str, Any]:
+        op = _Op(uuid.uuid4().hex, envelope)
+        with self._lock:
+            self._evict()
+            try:
+                self._q.put_nowait(op)
+            except queue.Full:
+                self.rejected += 1
+                raise
+            self._ops[op.op_id] = op
+            self.submitted += 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._worker, name="async-ops", daemon=True)
+                self._thread.start()
+            return op.describe()
+
+    def _worker(self):
+        while True:
+            op = self._q.get()
+            op.status, op.started_at = RUNNING, time.time()
+            try:
+                reply = self._run(op.envelope)
+            except Exception as e:
+                self._log("error", f"[ASYNC_OP] {op.command} ({op.op_id}) error: {e}")
+                reply = {"CorrelationId": op.message_id, "IsError": True, "ErrorMessage": str(e), "Message": {}}
+            with self._lock:
+                op.reply, op.finished_at, op.status = reply, time.time(), DONE
+                op.envelope = None
+                self.completed += 1
+            op.event.set()
+
+    def _evict(self):
+        # gọi trong _lock; OrderedDict theo thứ tự submit nên op cũ nhất ở đầu
+        now = time.time()
+        done = [o for o in self._ops.values() if o.status == DONE]
+        over = max(0, len(self._ops) - self.max_results + 1)
+        for o in done:
+            if now - o.finished_at > self.ttl_s or over > 0:
+                del self._ops[o.op_id]
+                self.evicted += 1
+                over -= 1
+
+    def get(self, op_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            op = self._ops.get(op_id)
+            if op is None:
+                self.lookups_missing += 1
+                return None
+            return op.describe()
+
+    def wait(self, op_id: str, timeout_s: float) -> Optional[Dict[str, Any]]:
+        """Chờ op xong tối đa timeout_s rồi trả trạng thái (có thể vẫn queued/running)."""
+        with self._lock:
+            op = self._ops.get(op_id)
+        if op is None:
+            return self.get(op_id)
+        op.event.wait(max(0.0, timeout_s))
+        with self._lock:
+            return op.describe()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            by_status = {QUEUED: 0, RUNNING: 0, DONE: 0}
+            for o in self._ops.values():
+                by_status[o.status] += 1
+            return {
+                "pending": self._q.qsize(), "capacity": self._q.maxsize,
+                "results": len(self._ops), "max_results": self.max_results, "ttl_ms": int(self.ttl_s * 1000),
+                "by_status": by_status,
+                "submitted": self.submitted, "completed": self.completed, "rejected": self.rejected,
+                "evicted": self.evicted, "lookups_missing": self.lookups_missing,
+            }
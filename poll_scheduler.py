@@ -0,0 +1,134 @@
+# poll_scheduler.py
+"""
+Lịch poll BOARD_RELAY theo deadline trên đồng hồ monotonic (không trôi)
+- Deadline kế tiếp = deadline trước + chu kỳ, không phụ thuộc thời gian đọc; trễ quá 1 chu kỳ thì
+  tính là missed và bắt nhịp lại từ hiện tại (không poll dồn)
+- Hai nhịp: active (có op đang chạy / đang chờ cạnh Ready trong active_hold_ms sau op) và idle
+- kick(): có hoạt động mới -> tính lại deadline theo nhịp active ngay, không chờ hết chu kỳ idle
+- Lỗi liên tiếp: chu kỳ nhân backoff_factor mỗi lần, tối đa backoff_max_ms; đọc OK thì về nhịp thường
+- Thống kê: chu kỳ đạt được, jitter (thời điểm bắt đầu thực tế - deadline), số deadline bị lỡ
+"""
+
+import threading
+import time
+from typing import Dict, Any, Optional, Callable
+
+
+class PollScheduler:
+    def __init__(self, idle_ms: float = 500.0, active_ms: float = 100.0, active_hold_ms: float = 2000.0,
+                 backoff_factor: float = 2.0, backoff_max_ms: float = 5000.0,
+                 active_fn: Optional[Callable[[], bool]] = None):
+        self.idle_s = max(0.001, float(idle_ms) / 1000.0)
+        self.active_s = max(0.001, float(active_ms) / 1000.0)
+        self.active_hold_s = max(0.0, float(active_hold_ms) / 1000.0)
+        self.backoff_factor = max(1.0, float(backoff_factor))
+        self.backoff_max_s = float(backoff_max_ms) / 1000.0
+        self._active_fn = active_fn
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._anchor: Optional[float] = None  # deadline của lần poll trước
+        self._last_start: Optional[float] = None
+        self._active_until = 0.0
+        self.consecutive_errors = 0
+        self.cycles = 0
+        self.missed = 0
+        self.kicks = 0
+        self.period_total_s = 0.0
+        self.period_n = 0
+        self.period_last_s: Optional[float] = None
+        self.jitter_total_s = 0.0
+        self.jitter_max_s = 0.0
+        self.jitter_n = 0
+        self.mode = "idle"
+
+    # --- trạng thái ---
+    def kick(self):
+        """Có hoạt động (op bắt đầu): chuyển sang nhịp active và đánh thức poller nếu đang ngủ idle."""
+        with self._lock:
+            self._active_until = max(self._active_until, time.monotonic() + self.active_hold_s)
+            self.kicks += 1
+        self._wake.set()
+
+    def _is_active(self, now: float) -> bool:
+        busy = False
+        if self._active_fn is not None:
+            try:
+                busy = bool(self._active_fn())
+            except Exception:
+                busy = False
+        if busy:
+            self._active_until = max(self._active_until, now + self.active_hold_s)
+        return busy or now < self._active_until
+
+    def period_s(self, now: Optional[float] = None) -> float:
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            active = self._is_active(now)
+            self.mode = "active" if active else "idle"
+            base = self.active_s if active else self.idle_s
+            if self.consecutive_errors:
+                self.mode = "backoff"
+                base = min(max(self.backoff_max_s, base),
+                           base * (self.backoff_factor ** self.consecutive_errors))
+            return base
+
+    def record(self, ok: bool):
+        with self._lock:
+            self.consecutive_errors = 0 if ok else self.consecutive_errors + 1
+
+    # --- vòng lặp ---
+    def wait_next(self, stop_event: threading.Event) -> bool:
+        """
+        Ngủ tới deadline kế tiếp rồi trả True (gọi ngay trước mỗi lần đọc; lần đầu trả về ngay).
+        Trả False nếu stop_event được set.
+        """
+        while True:
+            now = time.monotonic()
+            deadline = now if self._anchor is None else self._anchor + self.period_s(now)
+            if deadline <= now:
+                break
+            if stop_event.is_set():
+                return False
+            self._wake.clear()
+            # dậy sớm khi kick (deadline tính lại theo nhịp active), tối đa 50 ms để thấy stop_event
+            self._wake.wait(min(deadline - now, 0.05))
+        if stop_event.is_set():
+            return False
+        start = time.monotonic()
+        with self._lock:
+            if self._anchor is None:
+                self._anchor = start
+            else:
+                late = start - deadline
+                if late > deadline - self._anchor:
+                    self.missed += 1
+                    self._anchor = start  # bắt nhịp lại từ hiện tại, không poll dồn
+                else:
+                    self.jitter_total_s += late
+                    self.jitter_max_s = max(self.jitter_max_s, late)
+                    self.jitter_n += 1
+                    self._anchor = deadline  # neo theo deadline -> trễ không tích luỹ
+                p = start - self._last_start
+                self.period_last_s = p
+                self.period_total_s += p
+                self.period_n += 1
+            self._last_start = start
+            self.cycles += 1
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            n = self.cycles
+            return {
+                "mode": self.mode,
+                "idle_ms": round(self.idle_s * 1000.0, 3),
+                "active_ms": round(self.active_s * 1000.0, 3),
+                "cycles": n,
+                "missed_deadlines": self.missed,
+                "kicks": self.kicks,
+                "consecutive_errors": self.consecutive_errors,
+                "period_avg_ms": round(self.period_total_s / self.period_n * 1000.0, 3) if self.period_n else None,
+                "period_last_ms": round(self.period_last_s * 1000.0, 3) if self.period_last_s is not None else None,
+                "jitter_avg_ms": round(self.jitter_total_s / self.jitter_n * 1000.0, 3) if self.jitter_n else None,
+                "jitter_max_ms": round(self.jitter_max_s * 1000.0, 3),
+            }
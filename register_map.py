@@ -0,0 +1,126 @@
+# register_map.py
+"""
+Register map khai báo cho BOARD_RELAY + planner đọc FC03 tối thiểu
+- Mỗi signal: address, type (u16/i16/u32/i32/bool), scale, group (nhóm poll, vd. fast/slow)
+- Mỗi group có "every": poll mỗi N chu kỳ (fast=1: Ready/Home/Reset; slow=5: position)
+- plan(names): gom các thanh ghi cần đọc thành ít lần đọc nhất; hai khoảng cách nhau <= max_gap
+  thanh ghi thì đọc chung (đọc thừa 2*gap byte rẻ hơn 1 transaction mới: 8 byte request +
+  5 byte header/CRC + turnaround), mỗi lần tối đa 125 thanh ghi (giới hạn FC03)
+- Không có register_map.signals trong config -> dựng từ cấu hình cũ (read_settings.start_address
+  + index 0/1/2 cho Ready/Home/Reset, app.position.x_index/y_index/scale)
+"""
+
+import struct
+from functools import lru_cache
+from typing import Dict, Any, List, Tuple, Iterable, Optional
+
+TYPES = {"u16": (1, ">H"), "i16": (1, ">h"), "u32": (2, ">I"), "i32": (2, ">i"), "bool": (1, ">H")}
+FC03_MAX_REGISTERS = 125
+
+DEFAULT_GROUPS = {"fast": {"every": 1}, "slow": {"every": 5}}
+
+
+class Signal:
+    __slots__ = ("name", "address", "type", "width", "fmt", "scale", "group")
+
+    def __init__(self, name: str, address: int, type: str = "u16", scale: float = 1.0, group: str = "fast"):
+        if type not in TYPES:
+            raise ValueError(f"Signal '{name}': unknown type '{type}' (expected one of {', '.join(TYPES)})")
+        self.name = name
+        self.address = int(address)
+        self.type = type
+        self.width, self.fmt = TYPES[type]
+        self.scale = float(scale)
+        self.group = group
+
+    def decode(self, regs):
+        raw = struct.unpack(self.fmt, struct.pack(f">{self.width}H", *regs))[0]
+        if self.type == "bool":
+            return 1 if raw else 0
+        return raw * self.scale if self.scale != 1.0 else raw
+
+    def describe(self) -> Dict[str, Any]:
+        return {"address": self.address, "type": self.type, "scale": self.scale, "group": self.group}
+
+
+class RegisterMap:
+    def __init__(self, signals: Dict[str, Dict[str, Any]], groups: Optional[Dict[str, Dict[str, Any]]] = None,
+                 max_gap: int = 6, max_count: int = FC03_MAX_REGISTERS):
+        self.signals = {name: Signal(name, **spec) for name, spec in signals.items()}
+        self.groups = {g: max(1, int((spec or {}).get("every", 1))) for g, spec in (groups or DEFAULT_GROUPS).items()}
+        for s in self.signals.values():
+            self.groups.setdefault(s.group, 1)
+        self.max_gap = max(0, int(max_gap))
+        self.max_count = max(1, min(int(max_count), FC03_MAX_REGISTERS))
+        self._plan = lru_cache(maxsize=64)(self._plan_uncached)
+
+    @classmethod
+    def from_config(cls, dev_cfg: Dict[str, Any], app_cfg: Optional[Dict[str, Any]] = None) -> "RegisterMap":
+        rm = dev_cfg.get("register_map") or {}
+        signals = rm.get("signals")
+        if not signals:
+            start = int(dev_cfg.get("read_settings", {}).get("start_address", 129))
+            pos = (app_cfg or {}).get("position", {})
+            scale = float(pos.get("scale", 1.0))
+            signals = {
+                "Ready": {"address": start + 0, "type": "bool", "group": "fast"},
+                "Home": {"address": start + 1, "type": "bool", "group": "fast"},
+                "Reset": {"address": start + 2, "type": "bool", "group": "fast"},
+                "X": {"address": start + int(pos.get("x_index", 0)), "type": "u16", "scale": scale, "group": "slow"},
+                "Y": {"address": start + int(pos.get("y_index", 1)), "type": "u16", "scale": scale, "group": "slow"},
+            }
+        return cls(signals, rm.get("groups"), max_gap=int(rm.get("max_gap_registers", 6)))
+
+    def names(self, groups: Optional[Iterable[str]] = None) -> Tuple[str, ...]:
+        if groups is None:
+            return tuple(self.signals)
+        groups = set(groups)
+        return tuple(n for n, s in self.signals.items() if s.group in groups)
+
+    def groups_due(self, cycle: int) -> Tuple[str, ...]:
+        return tuple(g for g, every in self.groups.items() if cycle % every == 0)
+
+    def plan(self, names: Iterable[str]) -> Tuple[Tuple[int, int], ...]:
+        """((start, count), ...) tối thiểu để đọc các signal trong names."""
+        return self._plan(frozenset(names))
+
+    def _plan_uncached(self, names: frozenset) -> Tuple[Tuple[int, int], ...]:
+        unknown = names - set(self.signals)
+        if unknown:
+            raise KeyError(f"Unknown register signal(s): {', '.join(sorted(unknown))}")
+        spans = sorted((self.signals[n].address, self.signals[n].address + self.signals[n].width) for n in names)
+        reads: List[List[int]] = []  # [start, end)
+        for lo, hi in spans:
+            if reads:
+                start, end = reads[-1]
+                if lo - end <= self.max_gap and max(end, hi) - start <= self.max_count:
+                    reads[-1][1] = max(end, hi)
+                    continue
+            reads.append([lo, hi])
+        return tuple((s, e - s) for s, e in reads)
+
+    def decode(self, names: Iterable[str], reads: Dict[Tuple[int, int], Any]) -> Dict[str, Any]:
+        """reads: {(start, count): values} đúng theo plan(names)."""
+        out = {}
+        for n in names:
+            sig = self.signals[n]
+            for (start, count), values in reads.items():
+                off = sig.address - start
+                if 0 <= off and off + sig.width <= count:
+                    out[n] = sig.decode(values[off:off + sig.width])
+                    break
+        return out
+
+    def registers_per_cycle(self, cycle: int) -> int:
+        return sum(c for _, c in self.plan(self.names(self.groups_due(cycle))))
+
+    def describe(self) -> Dict[str, Any]:
+        every = max(self.groups.values()) if self.groups else 1
+        full = self.plan(self.names())
+        return {
+            "signals": {n: s.describe() for n, s in self.signals.items()},
+            "groups": {g: {"every": e, "plan": [list(r) for r in self.plan(self.names([g]))]} for g, e in self.groups.items()},
+            "full_plan": [list(r) for r in full],
+            "max_gap_registers": self.max_gap,
+            "registers_per_cycle_avg": round(sum(self.registers_per_cycle(c) for c in range(every)) / every, 3),
+        }
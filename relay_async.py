@@ -0,0 +1,145 @@
+# relay_async.py
+"""
+Relay actuation bất đồng bộ cho BOARD_RELAY
+- Một worker duy nhất (single-thread executor) -> các lệnh FC16 vẫn ra bus đúng thứ tự gửi
+- exec_sc_operation gửi lệnh VM2030 ngay, relay DOING/FINISH chạy song song trên worker
+- Mỗi operation có một RelayBatch riêng (thay cho list lỗi global): khi trả reply, batch báo
+  action nào đã xong (kèm lỗi) và action nào còn pending, không chờ thêm
+- savedMs: thời gian relay I/O đã được bỏ khỏi critical path của operation (chỉ tính action đã xong)
+- fn của action có thể trả về Future (vd. RelayController.request): worker chỉ xếp request rồi
+  chạy tiếp, action xong khi Future xong (chế độ đồng bộ thì chờ luôn)
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future, wait as _wait_futures
+from typing import Dict, Any, List, Optional
+
+
+class RelayAction:
+    def __init__(self, name: str):
+        self.name = name
+        self.submitted_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.errors: List[str] = []
+        self.future: Future = Future()  # xong khi action xong (kể cả khi fn trả về Future)
+
+    def run_ms(self) -> Optional[float]:
+        if self.started_at is None:
+            return None
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        return round((end - self.started_at) * 1000.0, 3)
+
+    def describe(self) -> Dict[str, Any]:
+        if self.finished_at is None:
+            return {"name": self.name, "pending": True, "running": self.started_at is not None}
+        d = {"name": self.name, "ok": not self.errors, "ms": self.run_ms()}
+        if self.errors:
+            d["errors"] = list(self.errors)
+        return d
+
+
+class RelayBatch:
+    """Các relay action của một operation."""
+
+    def __init__(self, executor: "RelayExecutor"):
+        self._ex = executor
+        self.actions: List[RelayAction] = []
+
+    def submit(self, name: str, fn, *args) -> RelayAction:
+        action = self._ex.submit(name, fn, *args)
+        self.actions.append(action)
+        return action
+
+    def errors(self) -> List[str]:
+        return [e for a in self.actions if a.finished_at is not None for e in a.errors]
+
+    def report(self, join_ms: int = 0) -> Dict[str, Any]:
+        """Kết quả tại thời điểm reply. join_ms > 0: chờ tối đa join_ms cho các action còn pending."""
+        if join_ms > 0:
+            _wait_futures([a.future for a in self.actions], timeout=join_ms / 1000.0)
+        done = [a.describe() for a in self.actions if a.finished_at is not None]
+        pending = [a.describe() for a in self.actions if a.finished_at is None]
+        saved = sum(a.run_ms() or 0.0 for a in self.actions if a.finished_at is not None) if self._ex.enabled else 0.0
+        return {"done": done, "pending": pending, "errors": self.errors(), "savedMs": round(saved, 3)}
+
+
+class RelayExecutor:
+    """
+    enabled=False: chạy action ngay trên thread gọi (hành vi cũ, đồng bộ).
+    fn của action trả về list lỗi (rỗng = OK).
+    """
+
+    def __init__(self, enabled: bool = True, name: str = "relay"):
+        self.enabled = bool(enabled)
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name) if self.enabled else None
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.saved_ms_total = 0.0
+        self.queue_wait_max_ms = 0.0
+        self.inflight = 0
+
+    def _run(self, action: RelayAction, fn, args):
+        action.started_at = time.monotonic()
+        try:
+            res = fn(*args)
+        except Exception as e:
+            self._finish(action, [f"{action.name}: {e}"])
+            return
+        if isinstance(res, Future):
+            if self._pool is None:
+                self._finish_from(action, res)  # đồng bộ: chờ ngay trên thread gọi
+            else:
+                res.add_done_callback(lambda f: self._finish_from(action, f))
+        else:
+            self._finish(action, list(res or []))
+
+    def _finish_from(self, action: RelayAction, fut: Future):
+        try:
+            errors = list(fut.result() or [])
+        except Exception as e:
+            errors = [f"{action.name}: {e}"]
+        self._finish(action, errors)
+
+    def _finish(self, action: RelayAction, errors: List[str]):
+        action.errors = errors
+        action.finished_at = time.monotonic()
+        waited = (action.started_at - action.submitted_at) * 1000.0
+        with self._lock:
+            self.inflight -= 1
+            self.completed += 1
+            if action.errors:
+                self.failed += 1
+            if self.enabled:
+                self.saved_ms_total += (action.finished_at - action.started_at) * 1000.0
+            if waited > self.queue_wait_max_ms:
+                self.queue_wait_max_ms = waited
+        action.future.set_result(None)
+
+    def submit(self, name: str, fn, *args) -> RelayAction:
+        action = RelayAction(name)
+        with self._lock:
+            self.submitted += 1
+            self.inflight += 1
+        if self._pool is None:
+            self._run(action, fn, args)
+        else:
+            self._pool.submit(self._run, action, fn, args)
+        return action
+
+    def batch(self) -> RelayBatch:
+        return RelayBatch(self)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"enabled": self.enabled, "submitted": self.submitted, "completed": self.completed,
+                    "failed": self.failed, "inflight": self.inflight,
+                    "saved_ms_total": round(self.saved_ms_total, 3),
+                    "queue_wait_max_ms": round(self.queue_wait_max_ms, 3)}
+
+    def shutdown(self, wait: bool = True):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
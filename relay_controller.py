@@ -0,0 +1,193 @@
+# relay_controller.py
+"""
+Relay controller cho BOARD_RELAY (12 kênh) với shadow state
+- Giữ trạng thái đã ghi thành công của từng kênh (shadow), có TTL: quá TTL coi như chưa biết
+- request({kênh: code}) không block: các thay đổi gửi trong cùng cửa sổ window_ms được gộp
+  (thay đổi sau của cùng kênh thắng), bỏ các kênh đã đúng trạng thái, rồi ghi bằng MỘT frame FC16
+  liên tục; kênh nằm giữa các kênh đổi được điền bằng trạng thái shadow nếu đã biết
+- Chỉ code 1 (ON/OPEN) và 2 (OFF/CLOSE) là idempotent; code 3/4/5 luôn được ghi và làm shadow
+  của kênh đó thành "chưa biết"
+- Future của mỗi request trả về list lỗi (rỗng = OK), cùng quy ước với relay_async
+"""
+
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, Any, List, Optional, Callable
+
+IDEMPOTENT_CODES = (1, 2)
+
+
+class RelayController:
+    def __init__(self, write_fn: Callable[[int, List[int]], Dict[str, Any]], channels: int = 12,
+                 window_ms: float = 5.0, shadow_ttl_ms: float = 30000.0, suppress: bool = True):
+        """
+        write_fn(start_channel, codes) -> result dict {"ok", "error"} (vd. control_multi_relays).
+        suppress=False: vẫn gộp theo cửa sổ nhưng luôn ghi mọi kênh được yêu cầu (không tin shadow).
+        """
+        self._write = write_fn
+        self.suppress = bool(suppress)
+        self.channels = int(channels)
+        self.window_s = max(0.0, float(window_ms) / 1000.0)
+        self.shadow_ttl_s = float(shadow_ttl_ms) / 1000.0
+        self._cv = threading.Condition(threading.Lock())
+        self._pending: List[tuple] = []  # (changes, future, t_request, label)
+        self._shadow: Dict[int, tuple] = {}  # ch -> (code, ts)
+        self._thread: Optional[threading.Thread] = None
+        self.requests = 0
+        self.changes_requested = 0
+        self.changes_suppressed = 0
+        self.requests_suppressed = 0
+        self.frames_written = 0
+        self.frames_failed = 0
+        self.batches = 0
+        self.latency_total_ms = 0.0
+        self.latency_max_ms = 0.0
+        self.latency_last_ms: Optional[float] = None
+        self.completed = 0
+
+    # --- public ---
+    def request(self, changes: Dict[int, int], label: Optional[str] = None) -> Future:
+        """Xếp thay đổi {kênh: code}; future -> list lỗi (mỗi lỗi có tiền tố label nếu có)."""
+        fut = Future()
+        changes = {int(ch): int(code) for ch, code in changes.items()}
+        for ch in changes:
+            if not (1 <= ch <= self.channels):
+                fut.set_result([f"Relay channel {ch} out of range 1..{self.channels}"])
+                return fut
+        with self._cv:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._flusher, name="relay-ctl", daemon=True)
+                self._thread.start()
+            self._pending.append((changes, fut, time.monotonic(), label))
+            self.requests += 1
+            self.changes_requested += len(changes)
+            self._cv.notify()
+        return fut
+
+    def set(self, changes: Dict[int, int], timeout_s: Optional[float] = None) -> Dict[str, Any]:
+        """Bản đồng bộ, trả về result dict giống control_*: {"ok", "error"?}."""
+        if self._thread is not None and threading.current_thread() is self._thread:
+            raise RuntimeError("RelayController.set() called from the flusher thread")
+        errors = self.request(changes).result(timeout_s)
+        return {"ok": True} if not errors else {"ok": False, "error": "; ".join(errors)}
+
+    def invalidate(self, channels=None):
+        """Quên shadow (vd. sau reconnect / board reset)."""
+        with self._cv:
+            if channels is None:
+                self._shadow.clear()
+            else:
+                for ch in channels:
+                    self._shadow.pop(int(ch), None)
+
+    # --- flusher ---
+    def _known(self, ch: int, now: float) -> Optional[int]:
+        entry = self._shadow.get(ch)
+        if entry is None or (self.shadow_ttl_s > 0 and now - entry[1] > self.shadow_ttl_s):
+            return None
+        return entry[0]
+
+    def _flusher(self):
+        while True:
+            with self._cv:
+                while not self._pending:
+                    self._cv.wait()
+                first_at = self._pending[0][2]
+            delay = first_at + self.window_s - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            with self._cv:
+                batch, self._pending = self._pending, []
+            self._flush(batch)
+
+    def _plan(self, merged: Dict[int, int], now: float) -> List[tuple]:
+        """Chia các kênh cần ghi thành các run liên tục: [(start, [codes])]."""
+        need = sorted(ch for ch, code in merged.items()
+                      if not self.suppress or code not in IDEMPOTENT_CODES or self._known(ch, now) != code)
+        runs = []
+        for ch in need:
+            if runs:
+                start, codes = runs[-1]
+                end = start + len(codes) - 1
+                gap = range(end + 1, ch)
+                fill = [self._known(g, now) for g in gap]
+                if all(f in IDEMPOTENT_CODES for f in fill):
+                    codes.extend(fill)
+                    codes.append(merged[ch])
+                    continue
+            runs.append((ch, [merged[ch]]))
+        return runs
+
+    def _flush(self, batch):
+        now = time.monotonic()
+        merged: Dict[int, int] = {}
+        for changes, _, _, _ in batch:
+            merged.update(changes)
+        with self._cv:
+            runs = self._plan(merged, now)
+            self.batches += 1
+            self.changes_suppressed += len(merged) - sum(1 for ch in merged if any(s <= ch < s + len(c) for s, c in runs))
+        run_errors: Dict[int, List[str]] = {}
+        for start, codes in runs:
+            try:
+                res = self._write(start, codes)
+            except Exception as e:
+                res = {"ok": False, "error": str(e)}
+            with self._cv:
+                self.frames_written += 1
+                ts = time.monotonic()
+                for i, code in enumerate(codes):
+                    ch = start + i
+                    if res.get("ok") and code in IDEMPOTENT_CODES:
+                        self._shadow[ch] = (code, ts)
+                    else:
+                        self._shadow.pop(ch, None)
+                if not res.get("ok"):
+                    self.frames_failed += 1
+                    span = f"R{start}" if len(codes) == 1 else f"R{start}..R{start + len(codes) - 1}"
+                    msg = f"{span} write failed: {res.get('error')}"
+                    for i in range(len(codes)):
+                        run_errors.setdefault(start + i, []).append(msg)
+        done = time.monotonic()
+        for changes, fut, t_req, label in batch:
+            errors = []
+            for ch in changes:
+                for e in run_errors.get(ch, []):
+                    e = f"{label}: {e}" if label else e
+                    if e not in errors:
+                        errors.append(e)
+            written = any(any(s <= ch < s + len(c) for s, c in runs) for ch in changes)
+            lat = (done - t_req) * 1000.0
+            with self._cv:
+                self.completed += 1
+                if not written:
+                    self.requests_suppressed += 1
+                self.latency_total_ms += lat
+                self.latency_max_ms = max(self.latency_max_ms, lat)
+                self.latency_last_ms = lat
+            fut.set_result(errors)
+
+    def shadow(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._cv:
+            return {f"R{ch}": self._known(ch, now) for ch in range(1, self.channels + 1)}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cv:
+            return {
+                "requests": self.requests,
+                "changes_requested": self.changes_requested,
+                "changes_suppressed": self.changes_suppressed,
+                "requests_suppressed": self.requests_suppressed,
+                "batches": self.batches,
+                "frames_written": self.frames_written,
+                "frames_failed": self.frames_failed,
+                "frames_saved": max(0, self.completed - self.frames_written),
+                "suppress": self.suppress,
+                "window_ms": round(self.window_s * 1000.0, 3),
+                "latency_avg_ms": round(self.latency_total_ms / self.completed, 3) if self.completed else None,
+                "latency_max_ms": round(self.latency_max_ms, 3),
+                "latency_last_ms": round(self.latency_last_ms, 3) if self.latency_last_ms is not None else None,
+                "pending": len(self._pending),
+            }
@@ -0,0 +1,61 @@
+# request_context.py
+"""
+Deadline của request hiện tại (thread-local)
+- Client gửi "deadline" (epoch ms, tuyệt đối) hoặc "timeoutMs" (ngân sách tính từ lúc front-end
+  nhận request) trong envelope; controller quy về deadline monotonic và mở scope(deadline) khi
+  chạy lệnh
+- Code chờ thiết bị (completion VM2030, GET_JOB, lock lane device) kẹp timeout của mình bằng
+  clamp_ms(): không chờ quá lúc client đã bỏ đi
+- Không có deadline: clamp_ms() trả nguyên timeout, remaining_ms() = None (hành vi như cũ)
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+_local = threading.local()
+
+
+def deadline_from_envelope(envelope, received_at: Optional[float] = None) -> Optional[float]:
+    """
+    Deadline monotonic từ envelope, None nếu client không gửi.
+    received_at: time.monotonic() lúc front-end nhận request (timeoutMs tính từ đó).
+    """
+    now = time.monotonic()
+    if envelope.get("deadline") is not None:
+        # epoch ms phía client -> monotonic phía server (lệch đồng hồ là trách nhiệm client)
+        return now + (float(envelope["deadline"]) - time.time() * 1000.0) / 1000.0
+    if envelope.get("timeoutMs") is not None:
+        return (received_at if received_at is not None else now) + float(envelope["timeoutMs"]) / 1000.0
+    return None
+
+
+@contextmanager
+def scope(deadline: Optional[float]):
+    prev = getattr(_local, "deadline", None)
+    _local.deadline = deadline
+    try:
+        yield
+    finally:
+        _local.deadline = prev
+
+
+def deadline() -> Optional[float]:
+    return getattr(_local, "deadline", None)
+
+
+def remaining_ms() -> Optional[int]:
+    d = deadline()
+    return None if d is None else max(0, int((d - time.monotonic()) * 1000))
+
+
+def clamp_ms(timeout_ms) -> int:
+    """min(timeout_ms, thời gian còn lại tới deadline)."""
+    rem = remaining_ms()
+    return int(timeout_ms) if rem is None else min(int(timeout_ms), rem)
+
+
+def expired() -> bool:
+    rem = remaining_ms()
+    return rem is not None and rem <= 0
@@ -0,0 +1,216 @@
+# sc_completion.py
+"""
+Completion registry cho VM2030
+- Mỗi operation đăng ký một CompletionFuture theo op_id TRƯỚC khi gửi lệnh
+- RX path gọi resolve() ngay khi nhận 0x1F/0x87 -> waiter được đánh thức tức thì
+- Completion được gán cho operation GỬI sớm nhất đang chờ (VM2030 xử lý lệnh tuần tự),
+  nên một operation không thể "ăn" completion code của operation khác, kể cả khi lane
+  emergency của TX queue cho lệnh sau vượt lên trước
+- expected_codes[0] là code "chính" của op (vd. 0x87 cho RESET): khi có nhiều op đang chờ,
+  code được ưu tiên gán cho op nhận nó làm code chính
+- Completion tới muộn của frame đã gửi mà op không còn chờ (gửi lại sau sub-timeout, op bị bỏ theo
+  deadline client) được absorb(): nuốt đúng số completion còn nợ (tới khi hết ttl) thay vì gán nhầm
+  cho op gửi sau; wait_orphans() cho phép chặn lệnh kế tiếp tới khi các completion đó về
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+DEFAULT_EXPECTED_CODES = (0x1F, 0x87)  # 0x1F for normal commands, 0x87 for RESET
+
+
+class CompletionFuture:
+    def __init__(self, op_id: str, expected_codes=DEFAULT_EXPECTED_CODES):
+        self.op_id = op_id
+        self.expected_codes = tuple(expected_codes)
+        self.created_at = time.monotonic()
+        self.code: Optional[int] = None
+        self.payload: bytes = b""
+        self.resolved_at: Optional[float] = None
+        self.sent_seq: Optional[int] = None
+        self.cancelled = False
+        self._event = threading.Event()
+
+    def done(self) -> bool:
+        return self._event.is_set()
+
+    def set_result(self, code: int, payload: bytes = b"", ts: Optional[float] = None):
+        self.code = code
+        self.payload = payload
+        self.resolved_at = ts if ts is not None else time.monotonic()
+        self._event.set()
+
+    def cancel(self):
+        self.cancelled = True
+        self._event.set()
+
+    def wait(self, timeout_s: Optional[float]) -> bool:
+        """True nếu đã nhận completion (không tính trường hợp bị cancel)."""
+        self._event.wait(timeout_s)
+        return self.code is not None
+
+    def latency_ms(self) -> Optional[float]:
+        if self.resolved_at is None:
+            return None
+        return round((self.resolved_at - self.created_at) * 1000.0, 3)
+
+
+class CompletionRegistry:
+    """Thread-safe. Giữ các future đang chờ theo thứ tự đăng ký."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending: "OrderedDict[str, CompletionFuture]" = OrderedDict()
+        self.registered = 0
+        self.resolved = 0
+        self.cancelled = 0
+        self.unsolicited = 0
+        self.last_unsolicited: Optional[Dict[str, Any]] = None
+        self._send_seq = 0
+        self._orphans: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()  # op_id -> {count, code, expires}
+        self._orphans_cv = threading.Condition(self._lock)
+        self.absorbed = 0
+        self.orphans_expired = 0
+
+    def register(self, op_id: str, expected_codes=DEFAULT_EXPECTED_CODES) -> CompletionFuture:
+        fut = CompletionFuture(op_id, expected_codes)
+        with self._lock:
+            old = self._pending.pop(op_id, None)
+            if old is not None:
+                old.cancel()
+                self.cancelled += 1
+            self._pending[op_id] = fut
+            self.registered += 1
+        return fut
+
+    def cancel(self, op_id: str) -> bool:
+        with self._lock:
+            fut = self._pending.pop(op_id, None)
+            if fut is None:
+                return False
+            self.cancelled += 1
+        fut.cancel()
+        return True
+
+    def mark_sent(self, op_id: str) -> bool:
+        """
+        Writer gọi ngay trước khi ghi frame của op_id ra cổng. Op gửi lại (cùng future) giữ thứ tự
+        của lần gửi đầu: completion của lần gửi nào về trước cũng thuộc op này.
+        """
+        with self._lock:
+            fut = self._pending.get(op_id)
+            if fut is None:
+                return False
+            if fut.sent_seq is None:
+                self._send_seq += 1
+                fut.sent_seq = self._send_seq
+            return True
+
+    # --- completion còn nợ của frame đã gửi ---
+    def absorb(self, op_id: str, count: int, code: int, ttl_s: float):
+        """Nuốt tối đa count completion (code chính của op) trong ttl_s tới, trước mọi future đang chờ."""
+        if count <= 0:
+            return
+        with self._lock:
+            o = self._orphans.get(op_id)
+            if o is None:
+                o = self._orphans[op_id] = {"count": 0, "code": code, "expires": 0.0}
+            o["count"] += int(count)
+            o["expires"] = max(o["expires"], time.monotonic() + max(0.0, ttl_s))
+
+    def _expire_orphans(self, now: float):
+        # gọi trong _lock
+        for op_id in [k for k, o in self._orphans.items() if o["expires"] <= now]:
+            del self._orphans[op_id]
+            self.orphans_expired += 1
+            self._orphans_cv.notify_all()
+
+    def wait_orphans(self, timeout_s: Optional[float]) -> bool:
+        """Chờ tới khi không còn completion nợ (về đủ hoặc hết ttl). False nếu hết timeout_s trước."""
+        end = None if timeout_s is None else time.monotonic() + max(0.0, timeout_s)
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                self._expire_orphans(now)
+                if not self._orphans:
+                    return True
+                wake = min(o["expires"] for o in self._orphans.values())
+                if end is not None:
+                    if now >= end:
+                        return False
+                    wake = min(wake, end)
+                self._orphans_cv.wait(max(0.001, wake - now))
+
+    def orphans(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            return {k: {"count": o["count"], "code": f"0x{o['code']:02X}", "expiresInMs": int((o["expires"] - now) * 1000)}
+                    for k, o in self._orphans.items()}
+
+    def _candidates(self):
+        # Op đã gửi theo thứ tự gửi; op chưa qua writer (dry-run) theo thứ tự đăng ký
+        sent = sorted((f for f in self._pending.values() if f.sent_seq is not None), key=lambda f: f.sent_seq)
+        unsent = [f for f in self._pending.values() if f.sent_seq is None]
+        return sent + unsent
+
+    def resolve(self, code: int, payload: bytes = b"", ts: Optional[float] = None) -> Optional[CompletionFuture]:
+        """Gán completion cho future gửi sớm nhất chấp nhận code này. Trả về future đó (hoặc None)."""
+        with self._lock:
+            self._expire_orphans(time.monotonic())
+            for op_id, o in self._orphans.items():
+                # frame đã gửi trước mọi op đang chờ -> completion này là của nó
+                if o["code"] == code:
+                    o["count"] -= 1
+                    if o["count"] <= 0:
+                        del self._orphans[op_id]
+                        self._orphans_cv.notify_all()
+                    self.absorbed += 1
+                    # future "đã xong" của op cũ: frame có người nhận, không waiter nào bị đánh thức
+                    fut = CompletionFuture(op_id, (code,))
+                    break
+            else:
+                target = None
+                candidates = self._candidates()
+                for fut in candidates:
+                    if fut.expected_codes and fut.expected_codes[0] == code:
+                        target = fut.op_id
+                        break
+                if target is None:
+                    for fut in candidates:
+                        if code in fut.expected_codes:
+                            target = fut.op_id
+                            break
+                if target is None:
+                    self.unsolicited += 1
+                    self.last_unsolicited = {"code": f"0x{code:02X}", "len": len(payload)}
+                    return None
+                fut = self._pending.pop(target)
+                self.resolved += 1
+        fut.set_result(code, payload, ts)
+        return fut
+
+    def pending_count(self) -> int:
+        """Op đang chờ + op còn nợ completion (máy coi như còn bận)."""
+        with self._lock:
+            self._expire_orphans(time.monotonic())
+            return len(self._pending) + len(self._orphans)
+
+    def pending_ids(self):
+        with self._lock:
+            return list(self._pending.keys())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "registered": self.registered,
+                "resolved": self.resolved,
+                "cancelled": self.cancelled,
+                "unsolicited": self.unsolicited,
+                "last_unsolicited": self.last_unsolicited,
+                "orphans": len(self._orphans),
+                "absorbed": self.absorbed,
+                "orphans_expired": self.orphans_expired,
+            }
@@ -0,0 +1,170 @@
+# sc_jog.py
+"""
+Jog streaming cho MOVE_AXIS (VM2030)
+- JOG_START mở session, JOG_UPDATE chỉ ghi target mới nhất của trục (latest-wins), không chờ máy
+- Worker thread gửi %P_X/%P_Y kế tiếp ngay sau khi lệnh trước có completion; các target bị
+  ghi đè trước khi kịp gửi được đếm là "coalesced"
+- Không có relay side-effect (do send_fn quyết định), watchdog tự dừng session khi không có
+  JOG_UPDATE trong idle_timeout_ms (mất tín hiệu nhả nút)
+"""
+
+import threading
+import time
+import uuid
+from typing import Dict, Any, Optional, Callable
+
+AXES = ("X", "Y")
+
+
+class JogStreamer:
+    def __init__(self, send_fn: Callable[[str, float], Dict[str, Any]], idle_timeout_ms: int = 5000):
+        """send_fn(axis, value) -> result dict của exec_sc_operation (chờ completion)."""
+        self._send = send_fn
+        self.idle_timeout_ms = int(idle_timeout_ms)
+        self._cv = threading.Condition(threading.Lock())
+        self._pending: Dict[str, Optional[float]] = {a: None for a in AXES}
+        self._next_axis = 0
+        self._thread: Optional[threading.Thread] = None
+        self._busy = False
+        self.session: Optional[str] = None
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.started_at: Optional[float] = None
+        self.stopped_at: Optional[float] = None
+        self.last_update_at: Optional[float] = None
+        self.stop_reason: Optional[str] = None
+        self.updates = 0
+        self.coalesced = 0
+        self.moves_sent = 0
+        self.moves_failed = 0
+        self.move_ms_total = 0.0
+        self.move_ms_max = 0.0
+        self.last_sent: Dict[str, Optional[float]] = {a: None for a in AXES}
+        self.last_error: Optional[str] = None
+
+    @property
+    def active(self) -> bool:
+        return self.session is not None
+
+    @property
+    def stopping(self) -> bool:
+        """Session đã dừng nhưng worker cũ còn đang gửi dở (join trong stop() hết thời gian)."""
+        t = self._thread
+        return self.session is None and t is not None and t.is_alive()
+
+    def start(self) -> str:
+        with self._cv:
+            if self.session is not None:
+                return self.session
+            if self._thread is not None and self._thread.is_alive():
+                # worker cũ còn chạy (đang chờ completion / flush) -> không tạo worker thứ hai dùng chung _pending
+                raise RuntimeError("JOG previous session still stopping (worker busy), retry later")
+            self._reset_stats()
+            self._pending = {a: None for a in AXES}
+            self.session = uuid.uuid4().hex[:8]
+            self.started_at = self.last_update_at = time.monotonic()
+            self._thread = threading.Thread(target=self._worker, args=(self.session,), daemon=True)
+            self._thread.start()
+            return self.session
+
+    def update(self, axis: str, value: float) -> bool:
+        """Ghi target mới nhất. Trả True nếu đã ghi đè một target chưa gửi (coalesced)."""
+        with self._cv:
+            if self.session is None:
+                raise RuntimeError("JOG not started")
+            coalesced = self._pending[axis] is not None
+            if coalesced:
+                self.coalesced += 1
+            self._pending[axis] = float(value)
+            self.updates += 1
+            self.last_update_at = time.monotonic()
+            self._cv.notify_all()
+            return coalesced
+
+    def stop(self, flush: bool = True, timeout_s: float = 5.0, reason: str = "stop") -> Dict[str, Any]:
+        """Dừng session. flush=True: gửi nốt target đang chờ trước khi dừng."""
+        with self._cv:
+            if self.session is None:
+                return self.stats()
+            if not flush:
+                dropped = sum(1 for v in self._pending.values() if v is not None)
+                self.coalesced += dropped
+                self._pending = {a: None for a in AXES}
+            self.session = None
+            self.stop_reason = reason
+            self._cv.notify_all()
+            t = self._thread
+        if t is not None and t is not threading.current_thread():
+            t.join(timeout_s)
+        return self.stats()
+
+    def _take_next(self):
+        for i in range(len(AXES)):
+            axis = AXES[(self._next_axis + i) % len(AXES)]
+            value = self._pending[axis]
+            if value is not None:
+                self._pending[axis] = None
+                self._next_axis = (AXES.index(axis) + 1) % len(AXES)
+                return axis, value
+        return None
+
+    def _worker(self, session: str):
+        while True:
+            with self._cv:
+                while True:
+                    nxt = self._take_next()
+                    if nxt is not None:
+                        break
+                    if self.session != session:
+                        self.stopped_at = time.monotonic()
+                        self._busy = False
+                        return
+                    idle = (time.monotonic() - self.last_update_at) * 1000.0
+                    if self.idle_timeout_ms > 0 and idle >= self.idle_timeout_ms:
+                        self.session = None
+                        self.stop_reason = f"idle {self.idle_timeout_ms} ms"
+                        continue
+                    self._busy = False
+                    wait_s = (self.idle_timeout_ms - idle) / 1000.0 if self.idle_timeout_ms > 0 else None
+                    self._cv.wait(wait_s)
+                self._busy = True
+            axis, value = nxt
+            t0 = time.monotonic()
+            try:
+                res = self._send(axis, value)
+            except Exception as e:
+                res = {"ok": False, "error": str(e)}
+            dt = (time.monotonic() - t0) * 1000.0
+            with self._cv:
+                self.moves_sent += 1
+                self.move_ms_total += dt
+                self.move_ms_max = max(self.move_ms_max, dt)
+                if res.get("ok"):
+                    self.last_sent[axis] = value
+                else:
+                    self.moves_failed += 1
+                    self.last_error = res.get("error") or f"timeout {res.get('timeoutMs')} ms"
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cv:
+            end = self.stopped_at if (self.session is None and self.stopped_at) else time.monotonic()
+            dur = (end - self.started_at) if self.started_at else 0.0
+            return {
+                "active": self.session is not None,
+                "session": self.session,
+                "busy": self._busy,
+                "stopping": self.session is None and self._thread is not None and self._thread.is_alive(),
+                "durationMs": int(dur * 1000),
+                "updates": self.updates,
+                "movesSent": self.moves_sent,
+                "movesFailed": self.moves_failed,
+                "coalesced": self.coalesced,
+                "pending": {a: v for a, v in self._pending.items() if v is not None},
+                "lastSent": dict(self.last_sent),
+                "updateRateHz": round(self.moves_sent / dur, 2) if dur > 0 else 0.0,
+                "moveAvgMs": round(self.move_ms_total / self.moves_sent, 3) if self.moves_sent else None,
+                "moveMaxMs": round(self.move_ms_max, 3),
+                "stopReason": self.stop_reason,
+                "lastError": self.last_error,
+            }
@@ -0,0 +1,139 @@
+# sc_link_health.py
+"""
+Theo dõi tình trạng link SOFTWARE_COMMAND (VM2030)
+- RX silence: thời gian kể từ byte cuối cùng nhận được
+- RTT của probe (gửi lệnh vô hại lúc rảnh, chờ 0x1F)
+- State: unknown -> up / down. Khi down, exec_sc_operation từ chối ngay thay vì chờ ui_op_timeout_ms
+"""
+
+import threading
+import time
+from typing import Dict, Any, Optional
+
+
+class LinkHealth:
+    def __init__(self, fail_threshold: int = 2, rtt_alpha: float = 0.2):
+        self._lock = threading.Lock()
+        self.fail_threshold = max(1, int(fail_threshold))
+        self.rtt_alpha = float(rtt_alpha)
+        self.state = "unknown"
+        self.down_reason: Optional[str] = None
+        self.state_since = time.monotonic()
+        self.last_rx: Optional[float] = None
+        self.last_tx: Optional[float] = None
+        self.consecutive_failures = 0
+        self.transitions = 0
+        self.probes_sent = 0
+        self.probes_ok = 0
+        self.probes_failed = 0
+        self.rejected_ops = 0
+        self.rtt_last_ms: Optional[float] = None
+        self.rtt_ewma_ms: Optional[float] = None
+        self.rtt_min_ms: Optional[float] = None
+        self.rtt_max_ms: Optional[float] = None
+
+    def _set_state(self, state: str, reason: Optional[str] = None) -> bool:
+        if state == self.state:
+            if reason:
+                self.down_reason = reason
+            return False
+        self.state = state
+        self.down_reason = reason if state == "down" else None
+        self.state_since = time.monotonic()
+        self.transitions += 1
+        return True
+
+    # --- events ---
+    def on_rx(self, ts: Optional[float] = None) -> bool:
+        """Có byte từ máy -> link sống. Trả True nếu state vừa đổi."""
+        with self._lock:
+            self.last_rx = time.monotonic() if ts is None else ts
+            self.consecutive_failures = 0
+            return self._set_state("up")
+
+    def on_tx(self, ts: Optional[float] = None):
+        with self._lock:
+            self.last_tx = time.monotonic() if ts is None else ts
+
+    def on_probe_sent(self):
+        with self._lock:
+            self.probes_sent += 1
+
+    def on_probe_ok(self, rtt_ms: float) -> bool:
+        with self._lock:
+            self.probes_ok += 1
+            self.consecutive_failures = 0
+            self.rtt_last_ms = round(rtt_ms, 3)
+            if self.rtt_ewma_ms is None:
+                self.rtt_ewma_ms = rtt_ms
+            else:
+                self.rtt_ewma_ms += self.rtt_alpha * (rtt_ms - self.rtt_ewma_ms)
+            self.rtt_min_ms = rtt_ms if self.rtt_min_ms is None else min(self.rtt_min_ms, rtt_ms)
+            self.rtt_max_ms = rtt_ms if self.rtt_max_ms is None else max(self.rtt_max_ms, rtt_ms)
+            return self._set_state("up")
+
+    def on_probe_fail(self, reason: str) -> bool:
+        with self._lock:
+            self.probes_failed += 1
+            return self._fail(reason)
+
+    def on_op_timeout(self, reason: str) -> bool:
+        """Operation timeout mà không có byte nào về -> tính như một lần probe thất bại."""
+        with self._lock:
+            return self._fail(reason)
+
+    def on_port_error(self, reason: str) -> bool:
+        with self._lock:
+            self.consecutive_failures = self.fail_threshold
+            return self._set_state("down", reason)
+
+    def _fail(self, reason: str) -> bool:
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.fail_threshold:
+            return self._set_state("down", reason)
+        return False
+
+    # --- queries ---
+    def is_down(self) -> bool:
+        with self._lock:
+            return self.state == "down"
+
+    def reject(self) -> str:
+        """Ghi nhận một op bị từ chối, trả về message lỗi chi tiết."""
+        with self._lock:
+            self.rejected_ops += 1
+            silence = self._silence_ms()
+            down_for = int((time.monotonic() - self.state_since) * 1000)
+            return (f"LINK_DOWN: VM2030 unreachable ({self.down_reason}); "
+                    f"down for {down_for} ms, rx silence {silence if silence is not None else 'n/a'} ms")
+
+    def _silence_ms(self) -> Optional[int]:
+        if self.last_rx is None:
+            return None
+        return int((time.monotonic() - self.last_rx) * 1000)
+
+    def idle_ms(self) -> Optional[int]:
+        """Thời gian kể từ lần TX/RX gần nhất."""
+        with self._lock:
+            last = max([t for t in (self.last_rx, self.last_tx) if t is not None], default=None)
+            return None if last is None else int((time.monotonic() - last) * 1000)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "reason": self.down_reason,
+                "stateForMs": int((time.monotonic() - self.state_since) * 1000),
+                "rxSilenceMs": self._silence_ms(),
+                "consecutiveFailures": self.consecutive_failures,
+                "failThreshold": self.fail_threshold,
+                "rttLastMs": self.rtt_last_ms,
+                "rttEwmaMs": round(self.rtt_ewma_ms, 3) if self.rtt_ewma_ms is not None else None,
+                "rttMinMs": round(self.rtt_min_ms, 3) if self.rtt_min_ms is not None else None,
+                "rttMaxMs": round(self.rtt_max_ms, 3) if self.rtt_max_ms is not None else None,
+                "probesSent": self.probes_sent,
+                "probesOk": self.probes_ok,
+                "probesFailed": self.probes_failed,
+                "rejectedOps": self.rejected_ops,
+                "transitions": self.transitions,
+            }
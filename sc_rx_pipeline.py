@@ -0,0 +1,246 @@
+# sc_rx_pipeline.py
+"""
+RX pipeline cho SOFTWARE_COMMAND (VM2030)
+- Nhận từng chunk (drain in_waiting) thay vì đọc từng byte
+- Buffer phần dữ liệu chưa hoàn chỉnh có giới hạn (ring buffer, bỏ byte cũ nhất khi tràn)
+- Tách frame theo delimiter 0x1F (normal complete) / 0x87 (reset complete)
+- Frame hoàn chỉnh được giao cho `sink` (vd. completion registry); frame không có ai nhận
+  được đẩy vào hàng đợi có giới hạn
+"""
+
+import re
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple
+
+COMPLETE_NORMAL = 0x1F
+COMPLETE_RESET  = 0x87
+COMPLETION_CODES = (COMPLETE_NORMAL, COMPLETE_RESET)
+
+# Frame = (payload, code, ts_monotonic)
+Frame = Tuple[bytes, int, float]
+
+
+class RxRingBuffer:
+    """
+    Buffer byte có dung lượng cố định. Khi ghi vượt dung lượng, các byte cũ nhất bị bỏ
+    và được tính vào overflow.
+    """
+
+    def __init__(self, capacity: int = 4096):
+        self.capacity = max(1, int(capacity))
+        self._buf = bytearray()
+        self.overflow_bytes = 0
+        self.overflow_events = 0
+        self.high_water = 0
+
+    def __len__(self):
+        return len(self._buf)
+
+    def write(self, data) -> int:
+        """Ghi data, trả về số byte bị bỏ do tràn."""
+        self._buf += data
+        over = len(self._buf) - self.capacity
+        if over > 0:
+            del self._buf[:over]
+            self.overflow_bytes += over
+            self.overflow_events += 1
+        else:
+            over = 0
+        if len(self._buf) > self.high_water:
+            self.high_water = len(self._buf)
+        return over
+
+    def take(self) -> bytes:
+        """Lấy toàn bộ nội dung và làm rỗng buffer."""
+        data = bytes(self._buf)
+        self._buf.clear()
+        return data
+
+    def peek(self) -> bytes:
+        return bytes(self._buf)
+
+    def clear(self):
+        self._buf.clear()
+
+
+class EchoMatcher:
+    """
+    So khớp echo của VM2030 với frame vừa gửi. Pipeline đưa các byte nhận được sau thời điểm
+    gửi (mark_sent) vào feed(); kết quả: "matched" | "mismatch" (chờ ở waiter là "missing").
+    """
+
+    def __init__(self, expected: bytes):
+        self.expected = bytes(expected)
+        self.pos = 0
+        self.state = "waiting"
+        self.mismatch_at: Optional[int] = None
+        self.received = bytearray()
+        self.sent_at: Optional[float] = None
+        self.done_at: Optional[float] = None
+        self.sent_event = threading.Event()
+        self.done_event = threading.Event()
+
+    def mark_sent(self, ts: Optional[float] = None):
+        self.sent_at = time.monotonic() if ts is None else ts
+        self.sent_event.set()
+
+    def feed(self, chunk: bytes, ts: Optional[float] = None) -> int:
+        """Trả về số byte của chunk đã dùng cho echo."""
+        if self.state != "waiting":
+            return 0
+        need = len(self.expected) - self.pos
+        part = chunk[:need]
+        self.received += part
+        exp = self.expected[self.pos:self.pos + len(part)]
+        if part != exp:
+            i = next(k for k in range(len(part)) if part[k] != exp[k])
+            self.mismatch_at = self.pos + i
+            self._finish("mismatch", ts)
+        else:
+            self.pos += len(part)
+            if self.pos >= len(self.expected):
+                self._finish("matched", ts)
+        return len(part)
+
+    def _finish(self, state: str, ts: Optional[float]):
+        self.state = state
+        self.done_at = time.monotonic() if ts is None else ts
+        self.done_event.set()
+
+    def elapsed_ms(self) -> Optional[float]:
+        if self.sent_at is None:
+            return None
+        end = self.done_at if self.done_at is not None else time.monotonic()
+        return round((end - self.sent_at) * 1000.0, 3)
+
+    def describe(self) -> Dict[str, Any]:
+        d = {"state": self.state, "expected": self.expected.hex(" ").upper(),
+             "received": bytes(self.received).hex(" ").upper(), "elapsedMs": self.elapsed_ms()}
+        if self.mismatch_at is not None:
+            d["mismatchAt"] = self.mismatch_at
+        return d
+
+
+class ScRxPipeline:
+    """
+    Tách frame theo delimiter một cách incremental trên từng chunk.
+    Việc tìm delimiter dùng regex (chạy ở tầng C), không có vòng lặp Python theo từng byte.
+
+    sink(payload, code, ts) -> bool: được gọi cho mỗi frame hoàn chỉnh; trả True nếu đã
+    nhận frame, khi đó frame không được đưa vào hàng đợi `frames`.
+
+    Không tự lock: caller (reader thread / waiter) giữ sc_rx_lock khi gọi.
+    """
+
+    def __init__(self, capacity: int = 4096, max_frames: int = 64, delimiters=COMPLETION_CODES):
+        self.delimiters = tuple(int(d) & 0xFF for d in delimiters)
+        self._delim_re = re.compile(b"[" + b"".join(re.escape(bytes([d])) for d in self.delimiters) + b"]")
+        self.partial = RxRingBuffer(capacity)
+        self.frames = deque()
+        self.max_frames = max(1, int(max_frames))
+        self.bytes_in = 0
+        self.chunks_in = 0
+        self.max_chunk = 0
+        self.frames_total = 0
+        self.frames_by_code: Dict[int, int] = {}
+        self.frames_dropped = 0
+        self.last_rx_ts: Optional[float] = None
+        self.sink = None
+        self.frames_claimed = 0
+        self.echo: Optional[EchoMatcher] = None
+
+    def feed(self, chunk: bytes, ts: Optional[float] = None) -> List[Frame]:
+        """
+        Đưa một chunk vào pipeline. Trả về list frame vừa hoàn chỉnh trong chunk này.
+        """
+        if not chunk:
+            return []
+        ts = time.monotonic() if ts is None else ts
+        n = len(chunk)
+        self.bytes_in += n
+        self.chunks_in += 1
+        if n > self.max_chunk:
+            self.max_chunk = n
+        self.last_rx_ts = ts
+
+        if self.echo is not None and self.echo.sent_at is not None:
+            # Lệnh gửi đi không chứa delimiter -> bỏ qua completion byte của lệnh trước
+            self.echo.feed(self._delim_re.sub(b"", chunk), ts)
+            if self.echo.state != "waiting":
+                self.echo = None
+
+        done = []
+        pos = 0
+        for m in self._delim_re.finditer(chunk):
+            end = m.start()
+            if len(self.partial):
+                self.partial.write(chunk[pos:end])
+                payload = self.partial.take()
+            else:
+                payload = bytes(chunk[pos:end])
+                if len(payload) > self.partial.capacity:
+                    # Frame dài hơn dung lượng buffer -> giữ phần cuối như ring buffer
+                    over = len(payload) - self.partial.capacity
+                    payload = payload[over:]
+                    self.partial.overflow_bytes += over
+                    self.partial.overflow_events += 1
+            code = chunk[end]
+            done.append((payload, code, ts))
+            pos = end + 1
+        if pos < n:
+            self.partial.write(chunk[pos:])
+
+        for frame in done:
+            self.frames_total += 1
+            code = frame[1]
+            self.frames_by_code[code] = self.frames_by_code.get(code, 0) + 1
+            if self.sink is not None and self.sink(*frame):
+                self.frames_claimed += 1
+            else:
+                self._push(frame)
+        return done
+
+    def _push(self, frame: Frame):
+        if len(self.frames) >= self.max_frames:
+            self.frames.popleft()
+            self.frames_dropped += 1
+        self.frames.append(frame)
+
+    def pop_frame(self, codes=None) -> Optional[Frame]:
+        """Lấy frame cũ nhất (có code thuộc `codes` nếu chỉ định)."""
+        if codes is None:
+            return self.frames.popleft() if self.frames else None
+        for i, frame in enumerate(self.frames):
+            if frame[1] in codes:
+                del self.frames[i]
+                return frame
+        return None
+
+    def pending_bytes(self) -> bytes:
+        """Dữ liệu đã nhận nhưng chưa gặp delimiter."""
+        return self.partial.peek()
+
+    def clear(self):
+        self.partial.clear()
+        self.frames.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "bytes_in": self.bytes_in,
+            "chunks_in": self.chunks_in,
+            "avg_chunk": round(self.bytes_in / self.chunks_in, 2) if self.chunks_in else 0,
+            "max_chunk": self.max_chunk,
+            "frames_total": self.frames_total,
+            "frames_by_code": {f"0x{k:02X}": v for k, v in sorted(self.frames_by_code.items())},
+            "frames_claimed": self.frames_claimed,
+            "frames_queued": len(self.frames),
+            "frames_dropped": self.frames_dropped,
+            "partial_bytes": len(self.partial),
+            "partial_capacity": self.partial.capacity,
+            "partial_high_water": self.partial.high_water,
+            "overflow_bytes": self.partial.overflow_bytes,
+            "overflow_events": self.partial.overflow_events,
+            "last_rx_age_ms": int((time.monotonic() - self.last_rx_ts) * 1000) if self.last_rx_ts else None,
+        }
@@ -0,0 +1,108 @@
+# sc_tx_queue.py
+"""
+Hàng đợi TX có giới hạn, nhiều lane ưu tiên cho SOFTWARE_COMMAND
+- Lane "emergency" (RESET, HOME từ cạnh PLC) luôn được lấy ra trước lane "normal"
+- Mỗi lane có dung lượng riêng: producer nhận TxQueueFull ngay lập tức khi lane đầy
+- Thống kê độ sâu và thời gian chờ theo lane
+"""
+
+import queue
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, Tuple
+
+LANES = ("emergency", "normal")
+
+
+class TxQueueFull(Exception):
+    """Lane TX đã đầy (backpressure)."""
+
+
+class PriorityTxQueue:
+    def __init__(self, capacities: Dict[str, int] = None, lanes=LANES):
+        capacities = capacities or {}
+        self.lanes = tuple(lanes)
+        self._cv = threading.Condition(threading.Lock())
+        self._q = {lane: deque() for lane in self.lanes}
+        self._cap = {lane: max(1, int(capacities.get(lane, 8 if lane == "emergency" else 32))) for lane in self.lanes}
+        self._st = {lane: {"enqueued": 0, "dequeued": 0, "rejected": 0, "wait_total_ms": 0.0,
+                           "wait_max_ms": 0.0, "high_water": 0} for lane in self.lanes}
+
+    def put(self, item, lane: str = "normal"):
+        if lane not in self._q:
+            raise ValueError(f"Unknown TX lane '{lane}'")
+        with self._cv:
+            q = self._q[lane]
+            if len(q) >= self._cap[lane]:
+                self._st[lane]["rejected"] += 1
+                raise TxQueueFull(f"TX lane '{lane}' full ({self._cap[lane]} frames)")
+            q.append((time.monotonic(), item))
+            st = self._st[lane]
+            st["enqueued"] += 1
+            if len(q) > st["high_water"]:
+                st["high_water"] = len(q)
+            self._cv.notify_all()
+
+    def get(self, timeout: float = None) -> Tuple[Any, str, float]:
+        """Trả về (item, lane, waited_ms). Raise queue.Empty khi hết timeout."""
+        end = None if timeout is None else time.monotonic() + timeout
+        with self._cv:
+            while True:
+                for lane in self.lanes:
+                    q = self._q[lane]
+                    if q:
+                        ts, item = q.popleft()
+                        waited = (time.monotonic() - ts) * 1000.0
+                        st = self._st[lane]
+                        st["dequeued"] += 1
+                        st["wait_total_ms"] += waited
+                        if waited > st["wait_max_ms"]:
+                            st["wait_max_ms"] = waited
+                        return item, lane, waited
+                if end is None:
+                    self._cv.wait()
+                else:
+                    remaining = end - time.monotonic()
+                    if remaining <= 0:
+                        raise queue.Empty
+                    self._cv.wait(remaining)
+
+    def wait_lane(self, lane: str, timeout: float) -> bool:
+        """Chờ tới khi lane có frame hoặc hết timeout. True nếu lane có frame."""
+        end = time.monotonic() + timeout
+        with self._cv:
+            while not self._q[lane]:
+                remaining = end - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cv.wait(remaining)
+            return True
+
+    def is_full(self, lane: str = "normal") -> bool:
+        with self._cv:
+            return len(self._q[lane]) >= self._cap[lane]
+
+    def qsize(self) -> int:
+        with self._cv:
+            return sum(len(q) for q in self._q.values())
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cv:
+            out = {}
+            for lane in self.lanes:
+                st = self._st[lane]
+                out[lane] = {
+                    "depth": len(self._q[lane]),
+                    "capacity": self._cap[lane],
+                    "high_water": st["high_water"],
+                    "enqueued": st["enqueued"],
+                    "dequeued": st["dequeued"],
+                    "rejected": st["rejected"],
+                    "wait_avg_ms": round(st["wait_total_ms"] / st["dequeued"], 3) if st["dequeued"] else 0.0,
+                    "wait_max_ms": round(st["wait_max_ms"], 3),
+                }
+            return out
@@ -0,0 +1,89 @@
+# single_flight.py
+"""
+Single-flight cho lệnh đọc giống hệt nhau đến đồng thời (nhiều HMI poll GET_JOB cùng index,
+GET_READY_STATUS, GET_POSITION)
+- Request đầu tiên theo key là leader: chạy fn() (giao dịch thiết bị thật)
+- Request cùng key đến khi leader đang chạy là follower: chờ và nhận chung kết quả, không tạo
+  giao dịch thứ hai; leader xong thì key được xoá (không cache kết quả sau đó)
+- Thống kê theo label (tên lệnh): leader, follower (số lần dedup), hold time của leader (avg/max),
+  số follower lớn nhất trên một lần chạy, follower hết thời gian chờ
+"""
+
+import threading
+import time
+from typing import Dict, Any, Callable, Optional, Tuple
+
+
+class _Call:
+    __slots__ = ("event", "result", "error", "followers")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.followers = 0
+
+
+class SingleFlight:
+    def __init__(self, enabled: bool = True):
+        self.enabled = bool(enabled)
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._st: Dict[str, Dict[str, float]] = {}
+
+    def do(self, label: str, key: str, fn: Callable[[], Any], wait_s: Optional[float] = None) -> Tuple[Any, bool]:
+        """
+        (kết quả, shared). shared = True: kết quả của leader khác. Exception của fn() được raise
+        lại cho mọi follower. wait_s: follower chờ tối đa; hết thì (None, True).
+        """
+        if not self.enabled:
+            return fn(), False
+        with self._lock:
+            st = self._st.setdefault(label, {"leaders": 0, "followers": 0, "hold_total_ms": 0.0, "hold_max_ms": 0.0,
+                                             "max_followers": 0, "follower_timeouts": 0})
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                st["leaders"] += 1
+            else:
+                call.followers += 1
+                st["followers"] += 1
+        if not leader:
+            if not call.event.wait(wait_s):
+                with self._lock:
+                    st["follower_timeouts"] += 1
+                return None, True
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        t0 = time.monotonic()
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            hold_ms = (time.monotonic() - t0) * 1000.0
+            with self._lock:
+                del self._calls[key]
+                st["hold_total_ms"] += hold_ms
+                st["hold_max_ms"] = max(st["hold_max_ms"], hold_ms)
+                st["max_followers"] = max(st["max_followers"], call.followers)
+            call.event.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out = {}
+            for label, st in self._st.items():
+                total = st["leaders"] + st["followers"]
+                out[label] = {
+                    "leaders": st["leaders"], "deduplicated": st["followers"],
+                    "dedup_ratio": round(st["followers"] / total, 4) if total else None,
+                    "hold_avg_ms": round(st["hold_total_ms"] / st["leaders"], 3) if st["leaders"] else None,
+                    "hold_max_ms": round(st["hold_max_ms"], 3),
+                    "max_followers": st["max_followers"], "follower_timeouts": st["follower_timeouts"],
+                }
+            return {"enabled": self.enabled, "in_flight": len(self._calls), "commands": out}
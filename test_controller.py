@@ -5,6 +5,8 @@ import json
 import os
 import threading
 from queue import Queue
+from modbus_rtu import (crc_ok, read_holding_frame, read_holding_response_len, parse_registers,
+                        relay_frame, parse_exception, exception_message)
 
 # -----------------------------
 # Globals
@@ -243,19 +245,6 @@ def _fmt_ascii(bs):
 # Modbus Utilities
 # -----------------------------
 
-def calculate_crc(data):
-    """Hàm tính CRC16 Modbus, trả về bytes (little-endian)."""
-    crc = 0xFFFF
-    for pos in data:
-        crc ^= pos
-        for _ in range(8):
-            if crc & 0x0001:
-                crc >>= 1
-                crc ^= 0xA001
-            else:
-                crc >>= 1
-    return crc.to_bytes(2, byteorder="little")
-
 def read_holding_registers(slave_id, start_addr, num_registers):
     """
     Đọc giá trị từ holding registers (FC=03) từ thiết bị BOARD_RELAY qua 'ser' global.
@@ -263,27 +252,21 @@ def read_holding_registers(slave_id, start_addr, num_registers):
     """
     global ser
     try:
-        data = [slave_id, 0x03, start_addr >> 8, start_addr & 0xFF, num_registers >> 8, num_registers & 0xFF]
-        data += list(calculate_crc(data))
+        data = read_holding_frame(slave_id, start_addr, num_registers)
         ser.reset_input_buffer()
-        ser.write(bytearray(data))
+        ser.write(data)
         time.sleep(0.1)
-        expected_bytes = 3 + (num_registers * 2) + 2
+        expected_bytes = read_holding_response_len(num_registers)
         response = ser.read(expected_bytes)
 
         if len(response) != expected_bytes:
             return None
 
-        received_crc = response[-2:]
-        calculated_crc = calculate_crc(response[:-2])
-        if received_crc != calculated_crc:
+        if not crc_ok(response):
             return None
 
-        values = []
-        for i in range(3, len(response)-2, 2):
-            value = (response[i] << 8) | response[i+1]
-            values.append(value)
-        return values
+        values = parse_registers(response, num_registers)
+        return list(values) if values is not None else None
     except Exception:
         return None
 
@@ -302,24 +285,12 @@ def control_single_relay(slave_id, relay_addr, state_value, retries=2, tx_delay_
     # Khung yêu cầu: [slave, 0x10, addr_hi, addr_lo, qty_hi, qty_lo, bytecnt, data_hi, data_lo] + CRC
     # Ở đây ghi 1 thanh ghi tại địa chỉ 0x00NN (NN=relay_addr), qty=1, bytecnt=2, data=[state_value, 0x00]
     # NOTE: Nếu board cần hi/lo đảo (0x0001), đổi 2 byte cuối thành [0x00, state_value].
-    frame = [slave_id, 0x10, 0x00, relay_addr, 0x00, 0x01, 0x02, state_value, 0x00]
-    frame += list(calculate_crc(frame))
-
-    ex_map = {
-        0x01: "Illegal Function",
-        0x02: "Illegal Data Address",
-        0x03: "Illegal Data Value",
-        0x04: "Slave Device Failure",
-        0x05: "Acknowledge",
-        0x06: "Slave Device Busy",
-        0x07: "Negative Acknowledge",
-        0x08: "Memory Parity Error"
-    }
+    frame = relay_frame(slave_id, relay_addr, state_value)
 
     for attempt in range(retries + 1):
         try:
             ser.reset_input_buffer()
-            ser.write(bytearray(frame))
+            ser.write(frame)
             time.sleep(tx_delay_s)
 
             # Chuẩn FC16: 8 byte echo; Exception: 5 byte
@@ -330,23 +301,19 @@ def control_single_relay(slave_id, relay_addr, state_value, retries=2, tx_delay_
             # Exception?
             if len(resp) >= 5 and (resp[1] & 0x80):
                 ex_resp = resp[:5]
-                r_crc = ex_resp[-2:]
-                calc_crc = calculate_crc(ex_resp[:-2])
-                if r_crc != calc_crc:
+                ex_code = parse_exception(ex_resp)
+                if ex_code is None:
                     if attempt < retries:
                         continue
                     return {"ok": False, "error": "CRC sai trong exception response", "detail": {"raw": ex_resp.hex()}}
-                ex_code = ex_resp[2]
                 return {
                     "ok": False,
-                    "error": f"Modbus exception: {ex_map.get(ex_code, f'0x{ex_code:02X}')} ({ex_code})",
+                    "error": exception_message(ex_code),
                     "detail": {"raw": ex_resp.hex()}
                 }
 
             if len(resp) == 8:
-                r_crc = resp[-2:]
-                calc_crc = calculate_crc(resp[:-2])
-                if r_crc != calc_crc:
+                if not crc_ok(resp):
                     if attempt < retries:
                         continue
                     return {"ok": False, "error": "CRC sai (phản hồi FC16)", "detail": {"raw": resp.hex()}}
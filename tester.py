@@ -52,18 +52,19 @@ class Bus:
     def send(self, command, payload=None, timeout_ms=None):
         """Send one REQ message and wait for REP within timeout."""
         mid = str(uuid.uuid4())
+        tout = timeout_ms if timeout_ms is not None else self.timeout_ms
         msg = {
             "messageId": mid,
             "timestamp": iso_now(),
             "targetDevice": self.target,
             "command": str(command),
-            "payload": payload or {}
+            "payload": payload or {},
+            "timeoutMs": tout  # controller không giữ lane device quá thời gian client còn chờ
         }
         out = json.dumps(msg, ensure_ascii=False)
         print(f"\n[REQ →] {out}")
         self.req.send_string(out)
 
-        tout = timeout_ms if timeout_ms is not None else self.timeout_ms
         socks = dict(self.req_poller.poll(tout))
         if socks.get(self.req) != zmq.POLLIN:
             raise TimeoutError(f"Timeout waiting REP for '{command}' ({tout} ms)")
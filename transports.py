@@ -0,0 +1,407 @@
+# transports.py
+"""
+Transport layer cho BOARD_RELAY / SOFTWARE_COMMAND
+- Giao diện giống serial.Serial (duck typing): read(n), write(data), in_waiting,
+  reset_input_buffer(), close(), is_open -> code hiện tại dùng được mà không sửa
+- Backend:
+    "serial"  : pyserial (mặc định, COM port như trước)
+    "posix"   : file descriptor non-blocking + termios (tty/pty trên Linux, không qua pyserial)
+    "tcp"     : socket TCP raw (serial device server kiểu ser2net raw mode)
+    "rfc2217" : Telnet RFC2217 qua serial.serial_for_url (đổi baud/flow control từ xa)
+- Mỗi backend có timeout (read/write/connect) và buffering riêng, cấu hình ở devices.<KEY>.transport
+- Lỗi được raise dưới dạng serial.SerialException / serial.SerialTimeoutException để các
+  handler hiện có vẫn bắt được
+"""
+
+import os
+import select
+import socket
+import struct
+import time
+from typing import Dict, Any, Optional
+
+import serial
+
+try:
+    import termios
+    import fcntl
+    _HAS_TERMIOS = True
+except ImportError:  # Windows
+    _HAS_TERMIOS = False
+
+NETWORK_TYPES = ("tcp", "rfc2217")
+
+
+class TransportError(serial.SerialException):
+    """Lỗi I/O hoặc mất kết nối của transport."""
+
+
+class TransportTimeout(serial.SerialTimeoutException):
+    """Ghi không xong trong write_timeout_s."""
+
+
+class _Stats:
+    def __init__(self):
+        self.bytes_rx = 0
+        self.bytes_tx = 0
+        self.reads = 0
+        self.writes = 0
+        self.read_timeouts = 0
+        self.opened_at = time.monotonic()
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"bytes_rx": self.bytes_rx, "bytes_tx": self.bytes_tx, "reads": self.reads,
+                "writes": self.writes, "read_timeouts": self.read_timeouts,
+                "uptime_s": round(time.monotonic() - self.opened_at, 1)}
+
+
+class SerialTransport:
+    """pyserial (serial.Serial hoặc serial_for_url)."""
+    kind = "serial"
+
+    def __init__(self, port: str, baudrate: int = 9600, xonxoff: bool = False,
+                 read_timeout_s: Optional[float] = 1.0, write_timeout_s: Optional[float] = None,
+                 rx_buffer_bytes: Optional[int] = None, url: bool = False):
+        kw = dict(baudrate=baudrate, parity=serial.PARITY_NONE, stopbits=serial.STOPBITS_ONE,
+                  timeout=read_timeout_s, write_timeout=write_timeout_s, xonxoff=xonxoff)
+        self._s = serial.serial_for_url(port, **kw) if url else serial.Serial(port, **kw)
+        if rx_buffer_bytes and hasattr(self._s, "set_buffer_size"):  # chỉ có trên Windows
+            self._s.set_buffer_size(rx_size=int(rx_buffer_bytes))
+        self.name = port
+        self.stats = _Stats()
+
+    @property
+    def in_waiting(self) -> int:
+        return self._s.in_waiting
+
+    @property
+    def timeout(self) -> Optional[float]:
+        return self._s.timeout
+
+    @timeout.setter
+    def timeout(self, value: Optional[float]):
+        self._s.timeout = value
+
+    @property
+    def is_open(self) -> bool:
+        return self._s.is_open
+
+    def read(self, size: int = 1) -> bytes:
+        data = self._s.read(size)
+        self.stats.reads += 1
+        self.stats.bytes_rx += len(data)
+        if len(data) < size:
+            self.stats.read_timeouts += 1
+        return data
+
+    def write(self, data) -> int:
+        n = self._s.write(data)
+        self.stats.writes += 1
+        self.stats.bytes_tx += n or 0
+        return n
+
+    def reset_input_buffer(self):
+        self._s.reset_input_buffer()
+
+    def close(self):
+        self._s.close()
+
+    def describe(self) -> Dict[str, Any]:
+        return {"type": self.kind, "endpoint": self.name, "open": self.is_open, **self.stats.as_dict()}
+
+
+class Rfc2217Transport(SerialTransport):
+    kind = "rfc2217"
+
+    def __init__(self, host: str, port: int, **kw):
+        super().__init__(f"rfc2217://{host}:{int(port)}", url=True, **kw)
+
+
+class PosixFdTransport:
+    """
+    tty/pty mở trực tiếp bằng os.open(O_NONBLOCK) + termios raw 8N1.
+    read() dùng select() cho timeout, in_waiting dùng ioctl(FIONREAD).
+    """
+    kind = "posix"
+
+    def __init__(self, path: str, baudrate: int = 9600, xonxoff: bool = False,
+                 read_timeout_s: Optional[float] = 1.0, write_timeout_s: Optional[float] = None,
+                 rx_chunk_bytes: int = 4096):
+        if not _HAS_TERMIOS:
+            raise TransportError("posix transport requires termios (Linux/Unix)")
+        self.name = path
+        self.timeout = read_timeout_s
+        self.write_timeout = write_timeout_s
+        self.rx_chunk = max(1, int(rx_chunk_bytes))
+        self.stats = _Stats()
+        self._fd = os.open(path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        try:
+            self._configure(int(baudrate), bool(xonxoff))
+        except Exception:
+            os.close(self._fd)
+            raise
+
+    def _configure(self, baudrate: int, xonxoff: bool):
+        speed = getattr(termios, f"B{baudrate}", None)
+        if speed is None:
+            raise TransportError(f"unsupported baud rate {baudrate}")
+        iflag, oflag, cflag, lflag, _, _, cc = termios.tcgetattr(self._fd)
+        iflag &= ~(termios.IGNBRK | termios.BRKINT | termios.PARMRK | termios.ISTRIP | termios.INLCR |
+                   termios.IGNCR | termios.ICRNL | termios.IXON | termios.IXOFF | termios.IXANY | termios.INPCK)
+        if xonxoff:
+            iflag |= termios.IXON | termios.IXOFF
+        oflag &= ~termios.OPOST
+        lflag &= ~(termios.ECHO | termios.ECHONL | termios.ICANON | termios.ISIG | termios.IEXTEN)
+        cflag &= ~(termios.CSIZE | termios.PARENB | termios.CSTOPB | getattr(termios, "CRTSCTS", 0))
+        cflag |= termios.CS8 | termios.CREAD | termios.CLOCAL
+        cc[termios.VMIN] = 0
+        cc[termios.VTIME] = 0
+        termios.tcsetattr(self._fd, termios.TCSANOW, [iflag, oflag, cflag, lflag, speed, speed, cc])
+
+    @property
+    def is_open(self) -> bool:
+        return self._fd is not None
+
+    @property
+    def in_waiting(self) -> int:
+        self._check_open()
+        return struct.unpack("I", fcntl.ioctl(self._fd, termios.FIONREAD, b"\0\0\0\0"))[0]
+
+    def _check_open(self):
+        if self._fd is None:
+            raise TransportError(f"{self.name} is closed")
+
+    def read(self, size: int = 1) -> bytes:
+        self._check_open()
+        buf = bytearray()
+        end = None if self.timeout is None else time.monotonic() + self.timeout
+        while len(buf) < size:
+            try:
+                chunk = os.read(self._fd, min(size - len(buf), self.rx_chunk))
+            except BlockingIOError:
+                chunk = None
+            except OSError as e:
+                raise TransportError(f"{self.name}: {e}") from e
+            if chunk:
+                buf += chunk
+                continue
+            # VMIN=0/VTIME=0: tty trả b"" khi chưa có dữ liệu; hangup báo bằng EIO ở trên
+            remaining = None if end is None else end - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                self.stats.read_timeouts += 1
+                break
+            select.select([self._fd], [], [], remaining)
+        self.stats.reads += 1
+        self.stats.bytes_rx += len(buf)
+        return bytes(buf)
+
+    def write(self, data) -> int:
+        self._check_open()
+        view = memoryview(bytes(data))
+        end = None if self.write_timeout is None else time.monotonic() + self.write_timeout
+        while view:
+            try:
+                n = os.write(self._fd, view)
+                view = view[n:]
+                continue
+            except BlockingIOError:
+                pass
+            except OSError as e:
+                raise TransportError(f"{self.name}: {e}") from e
+            remaining = None if end is None else end - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise TransportTimeout(f"{self.name}: write timeout")
+            select.select([], [self._fd], [], remaining)
+        self.stats.writes += 1
+        self.stats.bytes_tx += len(data)
+        return len(data)
+
+    def reset_input_buffer(self):
+        self._check_open()
+        termios.tcflush(self._fd, termios.TCIFLUSH)
+
+    def close(self):
+        if self._fd is not None:
+            try:
+                os.close(self._fd)
+            finally:
+                self._fd = None
+
+    def describe(self) -> Dict[str, Any]:
+        return {"type": self.kind, "endpoint": self.name, "open": self.is_open, **self.stats.as_dict()}
+
+
+class TcpTransport:
+    """
+    Socket TCP raw tới serial device server (ser2net raw, Moxa TCP server...).
+    Socket non-blocking; dữ liệu nhận được gom vào buffer user-space để in_waiting/read(n)
+    có cùng ngữ nghĩa như pyserial.
+    """
+    kind = "tcp"
+
+    def __init__(self, host: str, port: int, read_timeout_s: Optional[float] = 1.0,
+                 write_timeout_s: Optional[float] = 1.0, connect_timeout_s: float = 3.0,
+                 rx_buffer_bytes: Optional[int] = None, rx_chunk_bytes: int = 4096, nodelay: bool = True):
+        self.name = f"{host}:{int(port)}"
+        self.timeout = read_timeout_s
+        self.write_timeout = write_timeout_s
+        self.rx_chunk = max(1, int(rx_chunk_bytes))
+        self.stats = _Stats()
+        self._rx = bytearray()
+        self._eof = False
+        try:
+            self._sock = socket.create_connection((host, int(port)), timeout=connect_timeout_s)
+        except OSError as e:
+            raise TransportError(f"connect {self.name}: {e}") from e
+        if nodelay:
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if rx_buffer_bytes:
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, int(rx_buffer_bytes))
+        self._sock.setblocking(False)
+
+    @property
+    def is_open(self) -> bool:
+        return self._sock is not None
+
+    def _check_open(self):
+        if self._sock is None:
+            raise TransportError(f"{self.name} is closed")
+
+    def _pull(self):
+        """Đọc hết dữ liệu đang có trong socket vào buffer (không block)."""
+        while not self._eof:
+            try:
+                data = self._sock.recv(self.rx_chunk)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                raise TransportError(f"{self.name}: {e}") from e
+            if not data:
+                self._eof = True
+                return
+            self._rx += data
+            if len(data) < self.rx_chunk:
+                return
+
+    def _take(self, size: int) -> bytes:
+        data = bytes(self._rx[:size])
+        del self._rx[:size]
+        return data
+
+    @property
+    def in_waiting(self) -> int:
+        self._check_open()
+        self._pull()
+        if self._eof and not self._rx:
+            raise TransportError(f"{self.name}: connection closed by peer")
+        return len(self._rx)
+
+    def read(self, size: int = 1) -> bytes:
+        self._check_open()
+        end = None if self.timeout is None else time.monotonic() + self.timeout
+        while len(self._rx) < size:
+            self._pull()
+            if len(self._rx) >= size:
+                break
+            if self._eof:
+                if not self._rx:
+                    raise TransportError(f"{self.name}: connection closed by peer")
+                break
+            remaining = None if end is None else end - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                self.stats.read_timeouts += 1
+                break
+            select.select([self._sock], [], [], remaining)
+        data = self._take(size)
+        self.stats.reads += 1
+        self.stats.bytes_rx += len(data)
+        return data
+
+    def write(self, data) -> int:
+        self._check_open()
+        view = memoryview(bytes(data))
+        end = None if self.write_timeout is None else time.monotonic() + self.write_timeout
+        while view:
+            try:
+                n = self._sock.send(view)
+                view = view[n:]
+                continue
+            except (BlockingIOError, InterruptedError):
+                pass
+            except OSError as e:
+                raise TransportError(f"{self.name}: {e}") from e
+            remaining = None if end is None else end - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise TransportTimeout(f"{self.name}: write timeout")
+            select.select([], [self._sock], [], remaining)
+        self.stats.writes += 1
+        self.stats.bytes_tx += len(data)
+        return len(data)
+
+    def reset_input_buffer(self):
+        self._check_open()
+        self._pull()
+        self._rx.clear()
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            finally:
+                self._sock = None
+
+    def describe(self) -> Dict[str, Any]:
+        return {"type": self.kind, "endpoint": self.name, "open": self.is_open,
+                "buffered": len(self._rx), **self.stats.as_dict()}
+
+
+def transport_type(dev_cfg: dict) -> str:
+    return str((dev_cfg.get("transport") or {}).get("type", "serial")).lower()
+
+def is_network_transport(dev_cfg: dict) -> bool:
+    """tcp / rfc2217 không cần chọn COM port."""
+    return transport_type(dev_cfg) in NETWORK_TYPES
+
+def transport_endpoint(dev_cfg: dict) -> Optional[str]:
+    t = dev_cfg.get("transport") or {}
+    if transport_type(dev_cfg) in NETWORK_TYPES:
+        return f"{t.get('host')}:{t.get('port')}" if t.get("host") and t.get("port") else None
+    return t.get("path") or dev_cfg.get("com_port")
+
+def open_transport(device_key: str, dev_cfg: dict):
+    """
+    Mở transport theo devices.<KEY>.transport. Raise serial.SerialException khi lỗi.
+    xonxoff mặc định chỉ bật cho SOFTWARE_COMMAND (giống trước đây).
+    """
+    t = dev_cfg.get("transport") or {}
+    kind = transport_type(dev_cfg)
+    baud = int(dev_cfg.get("baud_rate", 9600))
+    xonxoff = bool(dev_cfg.get("xonxoff", True)) if device_key == "SOFTWARE_COMMAND" else False
+    rt = t.get("read_timeout_s", 1.0)
+    # BOARD_RELAY: mặc định 1 s như trước (adapter USB-RS485 treo không được chặn bus thread mãi mãi)
+    wt = t.get("write_timeout_s", 1.0 if device_key == "BOARD_RELAY" else None)
+    if kind == "serial":
+        port = t.get("path") or dev_cfg.get("com_port")
+        if not port:
+            raise TransportError(f"[{device_key}] no com_port configured")
+        return SerialTransport(port, baud, xonxoff=xonxoff, read_timeout_s=rt, write_timeout_s=wt,
+                               rx_buffer_bytes=t.get("rx_buffer_bytes"))
+    if kind == "posix":
+        path = t.get("path") or dev_cfg.get("com_port")
+        if not path:
+            raise TransportError(f"[{device_key}] no tty path configured")
+        return PosixFdTransport(path, baud, xonxoff=xonxoff, read_timeout_s=rt, write_timeout_s=wt,
+                                rx_chunk_bytes=t.get("rx_chunk_bytes", 4096))
+    if kind in NETWORK_TYPES:
+        host, port = t.get("host"), t.get("port")
+        if not host or not port:
+            raise TransportError(f"[{device_key}] transport '{kind}' requires host and port")
+        if kind == "tcp":
+            return TcpTransport(host, port, read_timeout_s=rt, write_timeout_s=wt if wt is not None else 1.0,
+                                connect_timeout_s=float(t.get("connect_timeout_s", 3.0)),
+                                rx_buffer_bytes=t.get("rx_buffer_bytes"),
+                                rx_chunk_bytes=t.get("rx_chunk_bytes", 4096),
+                                nodelay=bool(t.get("nodelay", True)))
+        return Rfc2217Transport(host, port, baudrate=baud, xonxoff=xonxoff,
+                                read_timeout_s=rt, write_timeout_s=wt)
+    raise TransportError(f"[{device_key}] unknown transport type '{kind}'")
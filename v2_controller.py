@@ -15,6 +15,8 @@ from queue import Queue
 from datetime import datetime, timezone
 import zmq
 import random  
+from modbus_rtu import (crc_ok, read_holding_frame, read_holding_response_len, parse_registers,
+                        relay_frame, parse_exception, exception_message, fc16_echo_ok, fc16_echo_detail)
 
 # -----------------------------
 # Files & Globals
@@ -263,30 +265,18 @@ def open_serial_for(device_key, cfg):
 # -----------------------------
 # Modbus (BOARD_RELAY)
 # -----------------------------
-def calculate_crc(data):
-    crc = 0xFFFF
-    for pos in data:
-        crc ^= pos
-        for _ in range(8):
-            if crc & 0x0001: crc >>= 1; crc ^= 0xA001
-            else: crc >>= 1
-    return crc.to_bytes(2, byteorder="little")
-
 def read_holding_registers(slave_id, start_addr, num_registers):
     global ser
     try:
-        data = [slave_id, 0x03, start_addr>>8, start_addr&0xFF, num_registers>>8, num_registers&0xFF]
-        data += list(calculate_crc(data))
+        data = read_holding_frame(slave_id, start_addr, num_registers)
         with ser_lock:
-            ser.reset_input_buffer(); ser.write(bytearray(data)); time.sleep(0.1)
-            expected = 3 + num_registers*2 + 2
+            ser.reset_input_buffer(); ser.write(data); time.sleep(0.1)
+            expected = read_holding_response_len(num_registers)
             response = ser.read(expected)
         if len(response) != expected: return None
-        if response[-2:] != calculate_crc(response[:-2]): return None
-        vals=[]
-        for i in range(3, len(response)-2, 2):
-            vals.append((response[i]<<8)|response[i+1])
-        return vals
+        if not crc_ok(response): return None
+        vals = parse_registers(response, num_registers)
+        return list(vals) if vals is not None else None
     except: return None
 
 def control_single_relay(slave_id, relay_addr, state_value, retries=2, tx_delay_s=0.02):
@@ -296,31 +286,28 @@ def control_single_relay(slave_id, relay_addr, state_value, retries=2, tx_delay_
     global ser
     if not (1 <= relay_addr <= 12):
         return {"ok": False, "error": "Địa chỉ relay phải 1..12"}
-    frame = [slave_id, 0x10, 0x00, relay_addr, 0x00, 0x01, 0x02, state_value, 0x00]
-    frame += list(calculate_crc(frame))
-    ex_map = {0x01:"Illegal Function",0x02:"Illegal Data Address",0x03:"Illegal Data Value",0x04:"Slave Device Failure",0x05:"Acknowledge",0x06:"Slave Device Busy",0x07:"Negative Acknowledge",0x08:"Memory Parity Error"}
+    frame = relay_frame(slave_id, relay_addr, state_value)
     for attempt in range(retries + 1):
         try:
             with ser_lock:
                 ser.reset_input_buffer()
-                ser.write(bytearray(frame))
+                ser.write(frame)
                 time.sleep(tx_delay_s)
                 resp = ser.read(8)
                 if len(resp) == 0: resp = ser.read(8)
             if len(resp) >= 5 and (resp[1] & 0x80):
                 ex_resp = resp[:5]
-                if ex_resp[-2:] != calculate_crc(ex_resp[:-2]):
+                ex_code = parse_exception(ex_resp)
+                if ex_code is None:
                     if attempt < retries: continue
                     return {"ok": False, "error": "CRC sai (exception)", "detail": {"raw": ex_resp.hex()}}
-                ex_code = ex_resp[2]
-                return {"ok": False, "error": f"Modbus exception: {ex_map.get(ex_code, f'0x{ex_code:02X}')} ({ex_code})", "detail": {"raw": ex_resp.hex()}}
+                return {"ok": False, "error": exception_message(ex_code), "detail": {"raw": ex_resp.hex()}}
             if len(resp) == 8:
-                if resp[-2:] != calculate_crc(resp[:-2]):
+                if not crc_ok(resp):
                     if attempt < retries: continue
                     return {"ok": False, "error": "CRC sai (FC16)", "detail": {"raw": resp.hex()}}
-                ok = (resp[0]==slave_id) and (resp[1]==0x10) and (resp[2]==0x00 and resp[3]==relay_addr) and (resp[4]==0x00 and resp[5]==0x01)
-                if ok:
-                    return {"ok": True, "detail": {"slave": resp[0], "function": resp[1], "address": (resp[2]<<8)|resp[3], "quantity": (resp[4]<<8)|resp[5]}}
+                if fc16_echo_ok(resp, slave_id, relay_addr, 1):
+                    return {"ok": True, "detail": fc16_echo_detail(resp)}
                 else:
                     return {"ok": False, "error": "Echo không khớp", "detail": {"raw": resp.hex()}}
             if attempt < retries: continue
@@ -0,0 +1,172 @@
+# zmq_frontend.py
+"""
+Front-end ZeroMQ ROUTER + worker pool theo lane
+- Một thread sở hữu socket ROUTER (zmq socket không thread-safe): nhận request, phân lane, xếp
+  vào hàng đợi của lane; worker trả reply qua inproc PUSH -> front-end gửi lại đúng client
+  (envelope identity + delimiter rỗng giữ nguyên nên client REQ cũ vẫn dùng được)
+- Lane "device": 1 worker -> các lệnh chạm VM2030/relay chạy tuần tự như trước
+- Lane "fast": nhiều worker -> lệnh đọc/cấu hình trả lời ngay cả khi START_JOB đang chờ 0x1F
+- Hàng đợi lane đầy: trả lỗi BUSY ngay thay vì treo client
+- Thống kê theo lane: số worker, đang chạy (max), độ sâu hàng đợi (max), thời gian chờ / xử lý
+"""
+
+import queue
+import threading
+import time
+import uuid
+from typing import Dict, Any, Callable, Optional
+
+import zmq
+
+
+class _Lane:
+    def __init__(self, name: str, workers: int, max_queue: int):
+        self.name = name
+        self.workers = max(1, int(workers))
+        self.q: "queue.Queue" = queue.Queue(maxsize=max(1, int(max_queue)))
+        self.lock = threading.Lock()
+        self.busy = 0
+        self.busy_max = 0
+        self.depth_max = 0
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.failed = 0
+        self.wait_total_ms = 0.0
+        self.wait_max_ms = 0.0
+        self.service_total_ms = 0.0
+        self.service_max_ms = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            n = self.completed
+            return {
+                "workers": self.workers,
+                "busy": self.busy, "busy_max": self.busy_max,
+                "depth": self.q.qsize(), "depth_max": self.depth_max, "capacity": self.q.maxsize,
+                "submitted": self.submitted, "completed": n, "rejected": self.rejected, "failed": self.failed,
+                "wait_avg_ms": round(self.wait_total_ms / n, 3) if n else None,
+                "wait_max_ms": round(self.wait_max_ms, 3),
+                "service_avg_ms": round(self.service_total_ms / n, 3) if n else None,
+                "service_max_ms": round(self.service_max_ms, 3),
+            }
+
+
+class LanedRouter:
+    """
+    handler(raw: bytes, received_at: float) -> bytes|str: xử lý 1 request (chạy trên worker của lane);
+        received_at = time.monotonic() lúc ROUTER nhận request.
+    classify(raw: bytes) -> tên lane.
+    error_reply(raw, message) -> bytes|str: reply lỗi (hàng đợi lane đầy, handler raise).
+    """
+
+    def __init__(self, bind: str, handler: Callable[[bytes, float], Any], classify: Callable[[bytes], str],
+                 lanes: Dict[str, Dict[str, Any]], error_reply: Callable[[bytes, str], Any],
+                 ctx: Optional[zmq.Context] = None, log: Optional[Callable[[str, str], None]] = None):
+        self.bind = bind
+        self._handler = handler
+        self._classify = classify
+        self._error_reply = error_reply
+        self._ctx = ctx or zmq.Context.instance()
+        self._log = log or (lambda level, msg: None)
+        self.lanes = {name: _Lane(name, spec.get("workers", 1), spec.get("queue", 64)) for name, spec in lanes.items()}
+        self._inproc = f"inproc://zmq-frontend-{uuid.uuid4().hex[:8]}"
+
+    @staticmethod
+    def _encode(reply) -> bytes:
+        return reply if isinstance(reply, bytes) else str(reply).encode("utf-8")
+
+    def _worker(self, lane: _Lane, stop_event: threading.Event):
+        push = self._ctx.socket(zmq.PUSH)
+        push.connect(self._inproc)
+        try:
+            while not stop_event.is_set():
+                try:
+                    envelope, raw, enq_at = lane.q.get(timeout=0.2)
+                except queue.Empty:
+                    continue
+                t0 = time.monotonic()
+                with lane.lock:
+                    lane.busy += 1
+                    lane.busy_max = max(lane.busy_max, lane.busy)
+                failed = False
+                try:
+                    reply = self._encode(self._handler(raw, enq_at))
+                except Exception as e:
+                    failed = True
+                    self._log("error", f"[ZMQ] lane {lane.name} handler error: {e}")
+                    reply = self._encode(self._error_reply(raw, f"handler error: {e}"))
+                t1 = time.monotonic()
+                push.send_multipart(envelope + [reply])
+                wait_ms = (t0 - enq_at) * 1000.0
+                run_ms = (t1 - t0) * 1000.0
+                with lane.lock:
+                    lane.busy -= 1
+                    lane.completed += 1
+                    lane.failed += failed
+                    lane.wait_total_ms += wait_ms
+                    lane.wait_max_ms = max(lane.wait_max_ms, wait_ms)
+                    lane.service_total_ms += run_ms
+                    lane.service_max_ms = max(lane.service_max_ms, run_ms)
+        finally:
+            push.close(linger=0)
+
+    def serve(self, stop_event: threading.Event):
+        router = self._ctx.socket(zmq.ROUTER)
+        pull = self._ctx.socket(zmq.PULL)
+        pull.bind(self._inproc)
+        router.bind(self.bind)
+        threads = []
+        for lane in self.lanes.values():
+            for i in range(lane.workers):
+                t = threading.Thread(target=self._worker, args=(lane, stop_event), name=f"zmq-{lane.name}-{i}", daemon=True)
+                t.start()
+                threads.append(t)
+        poller = zmq.Poller()
+        poller.register(router, zmq.POLLIN)
+        poller.register(pull, zmq.POLLIN)
+        self._log("debug", f"[CONTROLLER] ROUTER front-end bound at {self.bind} "
+                           f"(lanes: {', '.join(f'{n}x{l.workers}' for n, l in self.lanes.items())})")
+        try:
+            while not stop_event.is_set():
+                events = dict(poller.poll(200))
+                if pull in events:
+                    while True:
+                        try:
+                            router.send_multipart(pull.recv_multipart(zmq.NOBLOCK))
+                        except zmq.Again:
+                            break
+                        except Exception as e:
+                            self._log("error", f"[ZMQ] send reply error: {e}")
+                            break
+                if router in events:
+                    while True:
+                        try:
+                            frames = router.recv_multipart(zmq.NOBLOCK)
+                        except zmq.Again:
+                            break
+                        envelope, raw = frames[:-1], frames[-1]
+                        try:
+                            name = self._classify(raw)
+                        except Exception:
+                            name = None
+                        lane = self.lanes.get(name) or next(iter(self.lanes.values()))
+                        with lane.lock:
+                            lane.submitted += 1
+                        try:
+                            lane.q.put_nowait((envelope, raw, time.monotonic()))
+                            with lane.lock:
+                                lane.depth_max = max(lane.depth_max, lane.q.qsize())
+                        except queue.Full:
+                            with lane.lock:
+                                lane.rejected += 1
+                            router.send_multipart(envelope + [self._encode(
+                                self._error_reply(raw, f"BUSY: lane '{lane.name}' queue full ({lane.q.maxsize})"))])
+        finally:
+            for t in threads:
+                t.join(timeout=1)
+            router.close(linger=0)
+            pull.close(linger=0)
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: lane.stats() for name, lane in self.lanes.items()}